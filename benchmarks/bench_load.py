@@ -0,0 +1,152 @@
+"""Load-test a running render service (python -m pixfuck.server).
+
+Starts --clients threads that each upload-once-then-sort a synthetic image
+for --duration seconds, retrying after Retry-After when the queue is full,
+and reports throughput, latency percentiles and how often the service pushed
+back. Uses only the standard library and Pillow:
+
+    python -m pixfuck.server --jobs 4 &
+    python -m benchmarks.bench_load --clients 8 --size 2 --duration 60
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from PIL import Image
+
+from benchmarks.bench_sort import synthetic_image
+
+# Seconds between status polls while a job runs
+POLL_INTERVAL = 0.1
+
+
+def request(url, method='GET', data=None):
+    """(status, headers, body) of an HTTP request; error statuses are returned, not raised."""
+    try:
+        with urlopen(Request(url, data=data, method=method)) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def png_bytes(array):
+    output = io.BytesIO()
+    Image.fromarray(array).save(output, 'PNG')
+    return output.getvalue()
+
+
+class Client(threading.Thread):
+    """Submits jobs one after another until stop is set; records latencies and refusals."""
+
+    def __init__(self, base_url, image_id, parameters, stop, cancel_every=0):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.image_id = image_id
+        self.parameters = parameters
+        self.stop = stop
+        self.cancel_every = cancel_every
+        self.latencies = []
+        self.refused = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def run(self):
+        submitted = 0
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            query = urlencode(dict(self.parameters, image=self.image_id))
+            status, headers, body = request(f"{self.base_url}/jobs?{query}", 'POST', b'')
+            if status == 503:
+                self.refused += 1
+                self.stop.wait(float(headers.get('Retry-After', 1)))
+                continue
+            if status != 202:
+                self.failed += 1
+                continue
+            job_id = json.loads(body)['id']
+            submitted += 1
+            if self.cancel_every and submitted % self.cancel_every == 0:
+                request(f"{self.base_url}/jobs/{job_id}", 'DELETE')
+            state = self.wait(job_id)
+            if state == 'done':
+                status, _, _ = request(f"{self.base_url}/jobs/{job_id}/result")
+                if status == 200:
+                    self.latencies.append(time.perf_counter() - start)
+                    continue
+            if state == 'cancelled':
+                self.cancelled += 1
+            else:
+                self.failed += 1
+
+    def wait(self, job_id):
+        """Poll a job until it finishes; return its final state."""
+        while True:
+            status, _, body = request(f"{self.base_url}/jobs/{job_id}")
+            if status != 200:
+                return 'failed'
+            state = json.loads(body)['state']
+            if state in ('done', 'failed', 'cancelled'):
+                return state
+            time.sleep(POLL_INTERVAL)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--size', type=float, default=1, help="image size in megapixels")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to keep submitting")
+    parser.add_argument('--angle', type=float, default=30)
+    parser.add_argument('--criterion', default='Hue')
+    parser.add_argument('--intensity', type=float, default=1.0)
+    parser.add_argument('--cancel-every', type=int, default=0, metavar='N',
+                        help="cancel every Nth job of each client right after submitting it")
+    args = parser.parse_args()
+
+    status, _, body = request(f"{args.url}/images", 'POST', png_bytes(synthetic_image(args.size)))
+    if status != 201:
+        print(f"Upload failed with {status}: {body.decode(errors='replace')}", file=sys.stderr)
+        return 1
+    image_id = json.loads(body)['image']
+    # Different angles per client keep the result cache from answering every job
+    clients = [Client(args.url, image_id, {'angle': args.angle + i, 'criterion': args.criterion,
+                                           'intensity': args.intensity}, threading.Event(), args.cancel_every)
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    time.sleep(args.duration)
+    for client in clients:
+        client.stop.set()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    print(f"{len(latencies)} job(s) in {elapsed:.1f}s: {len(latencies) / elapsed:.2f} jobs/s, "
+          f"{len(latencies) * args.size / elapsed:.1f} MP/s")
+    if latencies:
+        print(f"latency p50 {percentile(latencies, 0.5):.2f}s, p90 {percentile(latencies, 0.9):.2f}s, "
+              f"max {max(latencies):.2f}s")
+    print(f"refused {sum(client.refused for client in clients)}, "
+          f"cancelled {sum(client.cancelled for client in clients)}, "
+          f"failed {sum(client.failed for client in clients)}")
+    status, _, body = request(f"{args.url}/health")
+    if status == 200:
+        print(f"service: {json.loads(body)}")
+    return 1 if any(client.failed for client in clients) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
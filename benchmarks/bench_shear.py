@@ -0,0 +1,75 @@
+"""Compare the exact integer-grid shear with the scipy affine_transform shear.
+
+Both are timed the way sort_image uses them: the exact shear gathers the
+sheared lines into a contiguous array and scatters them back (gather_lines
+and scatter_lines), and the scipy shear resamples the image and then
+resamples it back.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_shear --width 4000 --height 3000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from pixfuck.core import gather_lines, interpolated_shear, scatter_lines, shear_offsets, shear_parameters
+
+ANGLES = (0, 30, 60)
+
+
+def interpolated_round_trip(array, shear_factor, sort_axis):
+    sheared = interpolated_shear(array, shear_factor, sort_axis)
+    return interpolated_shear(sheared, -shear_factor, sort_axis)
+
+
+def exact_round_trip(array, shear_factor, sort_axis):
+    """Gather the sheared lines and scatter them back, as sort_image's exact mode does."""
+    transposed = sort_axis == 0
+    height, width, channels = array.shape
+    n_lines, length = (width, height) if transposed else (height, width)
+    offsets = shear_offsets(array.shape, shear_factor, sort_axis)
+    lines = np.empty((n_lines, length, channels), dtype=array.dtype)
+    gather_lines(array, offsets, 0, lines, transposed)
+    out = np.empty_like(array)
+    scatter_lines(lines, offsets, 0, out, transposed)
+    return out
+
+
+def time_round_trip(round_trip, array, shear_factor, sort_axis, repeats):
+    """Best wall time of a shear followed by its inverse."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        round_trip(array, shear_factor, sort_axis)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    array = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+    # Compile the numba kernels before timing
+    for angle in ANGLES:
+        exact_round_trip(array[:8, :8], *shear_parameters(angle))
+
+    megapixels = args.width * args.height / 1e6
+    print(f"Shear + inverse shear on a {args.width}x{args.height} RGB image ({megapixels:.1f} MP)")
+    print(f"{'angle':>6} {'scipy (s)':>10} {'exact (s)':>10} {'speedup':>8}")
+    for angle in ANGLES:
+        shear_factor, sort_axis = shear_parameters(angle)
+        scipy_time = time_round_trip(interpolated_round_trip, array, shear_factor, sort_axis, args.repeats)
+        exact_time = time_round_trip(exact_round_trip, array, shear_factor, sort_axis, args.repeats)
+        print(f"{angle:>5}° {scipy_time:>10.3f} {exact_time:>10.3f} {scipy_time / exact_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
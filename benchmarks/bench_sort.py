@@ -0,0 +1,175 @@
+"""Benchmark sort_image and check it against a saved baseline.
+
+Sorts synthetic images of several sizes with every criterion, horizontally
+and vertically, at partial and full intensity, and reports throughput in
+megapixels per second and the peak resident memory of each case. Run from
+the repository root:
+
+    python -m benchmarks.bench_sort --save benchmarks/baseline.json
+    python -m benchmarks.bench_sort --baseline benchmarks/baseline.json
+
+With --baseline the exit status is 1 if any case is slower, or uses more
+memory, than the baseline by more than --threshold. Baselines are only
+comparable on the same machine; the machine is recorded with them.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numba
+import numpy as np
+import psutil
+
+from pixfuck.core import sort_image
+from pixfuck.keys import KEYS
+from pixfuck.warmup import warm_up
+
+# Image sizes in megapixels, all 4:3
+SIZES = (1, 12, 48)
+
+# A horizontal and a vertical sort; sheared angles cost the same plus the shear
+ANGLES = {'horizontal': 0, 'vertical': 90}
+
+INTENSITIES = (0.5, 1.0)
+
+# Seconds between resident memory samples while a case runs
+RSS_INTERVAL = 0.002
+
+
+class PeakRSS:
+    """Context manager sampling this process's resident memory from a thread; .peak is in bytes."""
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.done = threading.Event()
+
+    def sample(self):
+        while not self.done.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self.done.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def synthetic_image(megapixels, seed=0):
+    """A 4:3 RGB image of smooth gradients with noise, so keys have both runs and ties."""
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    width = int(round(megapixels * 1e6 / height))
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    for channel, gradient in enumerate((x, y, (x + y) / 2)):
+        noise = rng.integers(-32, 33, (height, width), dtype=np.int16)
+        image[..., channel] = np.clip(gradient + noise, 0, 255)
+    return image
+
+
+def run_case(array, criterion, angle, intensity, repeats):
+    """Best time and peak resident memory of sorting array with these parameters."""
+    best = float('inf')
+    peak = 0
+    for _ in range(repeats):
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            sort_image(array, angle, criterion, 'Linear', intensity, seed=0)
+            best = min(best, time.perf_counter() - start)
+        peak = max(peak, rss.peak)
+    return best, peak
+
+
+def machine():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numba_threads': numba.get_num_threads(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': numba.__version__,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Regression messages for cases slower or larger than the baseline by more than threshold."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['mp_per_s'] < base['mp_per_s'] * (1 - threshold):
+            regressions.append(f"{name}: {result['mp_per_s']:.1f} MP/s, baseline {base['mp_per_s']:.1f} MP/s")
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"{name}: {result['peak_rss_mb']:.0f} MB peak RSS, "
+                               f"baseline {base['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=SIZES, help="image sizes in megapixels")
+    parser.add_argument('--criteria', nargs='+', default=list(KEYS), choices=list(KEYS), metavar='CRITERION')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--save', metavar='PATH', help="write the results to PATH as a JSON baseline")
+    parser.add_argument('--baseline', metavar='PATH', help="compare with a baseline written by --save")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="fraction by which a case may be slower or larger than the baseline")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['machine'] != machine():
+            print("warning: the baseline was recorded on a different machine or environment", file=sys.stderr)
+
+    warm_up()
+    results = {}
+    print(f"{'case':<44} {'s':>8} {'MP/s':>8} {'peak MB':>8}")
+    for megapixels in args.sizes:
+        array = synthetic_image(megapixels)
+        for criterion in args.criteria:
+            for direction, angle in ANGLES.items():
+                for intensity in INTENSITIES:
+                    name = f"{megapixels:g}MP/{criterion}/{direction}/{intensity:g}"
+                    seconds, peak = run_case(array, criterion, angle, intensity, args.repeats)
+                    result = {
+                        'seconds': seconds,
+                        'mp_per_s': array.shape[0] * array.shape[1] / 1e6 / seconds,
+                        'peak_rss_mb': peak / 2 ** 20,
+                    }
+                    results[name] = result
+                    print(f"{name:<44} {seconds:>8.3f} {result['mp_per_s']:>8.1f} {result['peak_rss_mb']:>8.0f}",
+                          flush=True)
+        del array
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': machine(), 'results': results}, f, indent=2)
+        print(f"Saved {len(results)} result(s) to {args.save}")
+    if baseline is not None:
+        regressions = compare(results, baseline['results'], args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        print(f"{len(regressions)} regression(s) against {args.baseline} at a {args.threshold:.0%} threshold")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
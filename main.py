@@ -1,6 +1,14 @@
 import sys
 import os
 import traceback
+
+# Pin numba's threading layer before pixfuck is imported. The tbb layer's
+# worker pool, once sorts have started it from a QThread, can keep the
+# interpreter from exiting; the workqueue layer's threads do not hold up
+# exit, and pixfuck.core.KERNEL_LOCK already keeps two sorts from entering
+# it at once. Set NUMBA_THREADING_LAYER to choose another layer.
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'workqueue')
+
 from PyQt6.QtWidgets import QApplication
 from ui import PixelSortApp
 from ui.logger import setup_logger, get_logger
@@ -46,6 +54,7 @@ def run_application():
         app_logger.info("Window shown")
         exit_code = app.exec()
         app_logger.info("Application exited successfully")
+        # closeEvent has already waited for every worker thread and the warm-up process
         sys.exit(exit_code)
     except Exception as e:
         handle_error(app_logger, e)
@@ -0,0 +1,4 @@
+"""Headless pixel sorting: the sort engine and command-line renderer, without PyQt6."""
+from .core import SortCancelled, sort_image
+
+__all__ = ['SortCancelled', 'sort_image']
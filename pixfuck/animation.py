@@ -0,0 +1,142 @@
+"""Sort animations and frame sequences one frame at a time.
+
+Frames are decoded lazily, sorted with sort_image on a process pool with at
+most max_in_flight frames submitted at once, and handed on in order as soon
+as the oldest one is done. Memory use therefore depends on max_in_flight and
+not on the length of the clip, as long as the output is a numbered frame
+sequence; Pillow's GIF and APNG writers keep earlier frames until the file
+is closed.
+"""
+import logging
+from collections import deque
+
+from PIL import Image, ImageSequence
+
+from .core import sort_image
+from .decode import rgb_array
+
+logger = logging.getLogger('pixfuck.animation')
+
+# Frame duration, in milliseconds, for inputs that do not have one
+DEFAULT_DURATION = 100
+
+
+def frame_count(path):
+    """Number of frames in an image file; 1 for stills."""
+    with Image.open(path) as img:
+        return getattr(img, 'n_frames', 1)
+
+
+def read_frames(path, n_frames=None):
+    """Yield (RGB array, duration in ms) for each frame of an animated image.
+
+    A still is decoded once and yielded n_frames times, so it can be swept
+    through a range of sort parameters.
+    """
+    with Image.open(path) as img:
+        if getattr(img, 'n_frames', 1) == 1 and n_frames:
+            frame = rgb_array(img)
+            for _ in range(n_frames):
+                yield frame, img.info.get('duration', DEFAULT_DURATION)
+            return
+        for frame in ImageSequence.Iterator(img):
+            yield rgb_array(frame), frame.info.get('duration', DEFAULT_DURATION)
+
+
+def read_sequence(paths, duration=DEFAULT_DURATION):
+    """Yield (RGB array, duration in ms) for each image file of a sequence, in order."""
+    for path in paths:
+        with Image.open(path) as img:
+            yield rgb_array(img), duration
+
+
+def sweep_parameters(index, n_frames, angle, criterion, pattern, intensity, angle_end=None,
+                     intensity_end=None, **kwargs):
+    """sort_image keyword arguments for frame index of n_frames.
+
+    The angle and intensity move linearly to angle_end and intensity_end over
+    the clip when those are given. Other keyword arguments, such as seed, are
+    the same for every frame; a fixed seed keeps partial intensity from
+    flickering between frames.
+    """
+    t = index / max(1, n_frames - 1)
+    if angle_end is not None:
+        angle += (angle_end - angle) * t
+    if intensity_end is not None:
+        intensity += (intensity_end - intensity) * t
+    return dict(kwargs, angle=angle, criterion=criterion, pattern=pattern, intensity=intensity)
+
+
+def sort_frame(frame, parameters):
+    """Sort one frame in a worker process."""
+    return sort_image(frame, **parameters)
+
+
+def sort_frames(executor, frames, parameters, max_in_flight):
+    """Sort (array, duration) frames on executor and yield (sorted array, duration) in order.
+
+    parameters maps a frame index to sort_image keyword arguments. At most
+    max_in_flight frames are decoded and waiting at any time; if the caller
+    stops early, frames not yet started are cancelled.
+    """
+    pending = deque()
+    try:
+        for index, (frame, duration) in enumerate(frames):
+            if len(pending) >= max_in_flight:
+                future, oldest_duration = pending.popleft()
+                yield future.result(), oldest_duration
+            pending.append((executor.submit(sort_frame, frame, parameters(index)), duration))
+        while pending:
+            future, duration = pending.popleft()
+            yield future.result(), duration
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+def frame_image(frame, duration):
+    image = Image.fromarray(frame)
+    image.info['duration'] = duration
+    return image
+
+
+def save_frames(frames, output_path, loop=0):
+    """Encode (array, duration) frames as they arrive; return the number written.
+
+    An output_path containing a %-format such as 'frame_%04d.png' is written
+    as one file per frame. Anything else is saved as an animation by Pillow
+    (GIF, APNG or WebP), with each frame keeping its own duration.
+    """
+    if '%' in output_path:
+        count = 0
+        for count, (frame, _) in enumerate(frames, 1):
+            Image.fromarray(frame).save(output_path % (count - 1))
+        return count
+
+    images = (frame_image(frame, duration) for frame, duration in frames)
+    first = next(images, None)
+    if first is None:
+        return 0
+    count = 1
+
+    def rest():
+        nonlocal count
+        for image in images:
+            count += 1
+            yield image
+
+    first.save(output_path, save_all=True, append_images=rest(), loop=loop)
+    return count
+
+
+def render_animation(executor, frames, n_frames, output_path, angle, criterion, pattern, intensity,
+                     max_in_flight, **kwargs):
+    """Sort and save a clip of n_frames (array, duration) frames; return the number of frames written.
+
+    Extra keyword arguments go to sweep_parameters, and from there to sort_image.
+    """
+    def parameters(index):
+        return sweep_parameters(index, n_frames, angle, criterion, pattern, intensity, **kwargs)
+
+    logger.info(f"Rendering {n_frames} frame(s) to {output_path} with up to {max_in_flight} in flight")
+    return save_frames(sort_frames(executor, frames, parameters, max_in_flight), output_path)
@@ -0,0 +1,207 @@
+"""Cache of finished sorts, keyed by image content and sort parameters.
+
+ResultCache keeps recent results in memory, evicting the least recently used
+once a byte budget is exceeded, and can also keep them as .npy files in a
+directory. The on-disk tier is safe to share between processes, so the GUI
+and every CLI worker can point at the same directory (PIXFUCK_CACHE_DIR).
+
+Only deterministic sorts are cached: a result that depends on random draws
+(partial intensity or random spans) is cached only when it was made with a
+seed, which is then part of the key.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .core import PATTERN_IDS, sort_image
+from .keys import get_sort_key
+from .profiling import stage
+
+logger = logging.getLogger('pixfuck.cache')
+
+# Bump when a change to the engine alters its output, so old disk entries are ignored
+CACHE_VERSION = 4
+
+# Default in-memory budget, in bytes
+DEFAULT_MEMORY_BYTES = 512 << 20
+
+# Default on-disk budget, in bytes
+DEFAULT_DISK_BYTES = 4 << 30
+
+# Environment variable naming a shared on-disk cache directory
+CACHE_DIR_ENV = 'PIXFUCK_CACHE_DIR'
+
+
+def content_hash(array):
+    """Hex digest of an image array's shape and pixels."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((array.shape, array.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def is_deterministic(intensity, pattern, seed):
+    """Whether a sort with these parameters always gives the same result."""
+    return seed is not None or (intensity >= 1.0 and pattern != 'Random Spans')
+
+
+def result_key(image_hash, angle, criterion, pattern, intensity, seed=None, shear_mode='exact', key_bits=None,
+               mask_hash=None):
+    """Cache key of a sort; criterion names and equivalent SortKeys give the same key.
+
+    mask_hash is the content_hash of the sort's mask, if it has one.
+    """
+    cache_id = get_sort_key(criterion, key_bits).cache_id
+    # Patterns the engine does not know all sort whole lines, so they share one key
+    pattern_id = PATTERN_IDS.get(pattern, 0)
+    parameters = (CACHE_VERSION, image_hash, float(angle), cache_id, pattern_id, float(intensity),
+                  seed, shear_mode, mask_hash)
+    return hashlib.blake2b(repr(parameters).encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """LRU cache of sorted images with an optional on-disk tier.
+
+    Arrays are stored read-only and returned as stored, so callers must not
+    modify them. Safe to use from several threads.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, directory=None, max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls, max_bytes=DEFAULT_MEMORY_BYTES):
+        """A cache whose disk tier is PIXFUCK_CACHE_DIR, if that is set."""
+        return cls(max_bytes, os.environ.get(CACHE_DIR_ENV) or None)
+
+    def get(self, key):
+        """The cached array for key, or None."""
+        with self.lock:
+            array = self.entries.get(key)
+            if array is not None:
+                self.entries.move_to_end(key)
+                return array
+        array = self.load(key)
+        if array is not None:
+            self.remember(key, array)
+        return array
+
+    def put(self, key, array):
+        """Store a result in memory and, if there is one, on disk."""
+        array.flags.writeable = False
+        self.remember(key, array)
+        self.store(key, array)
+
+    def remember(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).nbytes
+            self.entries[key] = array
+            self.size += array.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def load(self, key):
+        if not self.directory:
+            return None
+        path = self.path(key)
+        try:
+            array = np.load(path)
+        except (OSError, ValueError):
+            return None
+        # The modification time orders disk entries for eviction
+        os.utime(path)
+        array.flags.writeable = False
+        return array
+
+    def store(self, key, array):
+        if not self.directory or array.nbytes > self.max_disk_bytes:
+            return
+        # Write under a temporary name and rename, so other processes never read a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, self.path(key))
+        except OSError as e:
+            logger.warning(f"Could not write cache entry: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict_disk()
+
+    def evict_disk(self):
+        """Delete the least recently used .npy files until the directory fits max_disk_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process evicted it first
+                pass
+            total -= size
+
+
+def cached_sort(cache, array, angle, criterion, pattern, intensity, seed=None, image_hash=None, **kwargs):
+    """sort_image through a ResultCache.
+
+    seed is passed on to sort_image; without one the sort draws from the
+    global random state and is only cached if it draws nothing. image_hash
+    may be passed to avoid rehashing the same image; extra keyword arguments
+    go to sort_image. With out, the result is always written into it, hit or
+    miss, and the cache keeps its own copy, so out stays writable. Returns
+    (result, hit).
+    """
+    if cache is None or not is_deterministic(intensity, pattern, seed):
+        return sort_image(array, angle, criterion, pattern, intensity, seed=seed, **kwargs), False
+    out = kwargs.get('out')
+    with stage(kwargs.get('trace'), 'cache lookup'):
+        if image_hash is None:
+            image_hash = content_hash(array)
+        mask = kwargs.get('mask')
+        key = result_key(image_hash, angle, criterion, pattern, intensity, seed,
+                         kwargs.get('shear_mode', 'exact'), kwargs.get('key_bits'),
+                         content_hash(np.asarray(mask)) if mask is not None else None)
+        result = cache.get(key)
+    if result is not None:
+        logger.info("Using cached result")
+        if kwargs.get('trace') is not None:
+            kwargs['trace'].count('cache_hits')
+        if kwargs.get('progress') is not None:
+            kwargs['progress'](100)
+        if out is not None:
+            np.copyto(out, result)
+            result = out
+        return result, True
+    result = sort_image(array, angle, criterion, pattern, intensity, seed=seed, **kwargs)
+    # put makes what it stores read-only, which the caller's buffer must not become
+    cache.put(key, result.copy() if result is out else result)
+    return result, False
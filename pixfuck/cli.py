@@ -0,0 +1,314 @@
+"""Render images from the command line, one image per worker process.
+
+Run from the repository root:
+
+    python -m pixfuck 'photos/*.jpg' -o sorted --angle 30 --criterion Hue
+
+Animated inputs are sorted frame by frame across the same worker processes
+(see pixfuck.animation). --pipeline replaces the single sort with a chain of
+passes from a file (see pixfuck.pipeline).
+"""
+import argparse
+import glob
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from .animation import DEFAULT_DURATION, frame_count, read_frames, read_sequence, render_animation
+from .cache import CACHE_DIR_ENV, ResultCache, cached_sort
+from .core import PATTERN_IDS, SHEAR_MODES
+from .decode import decode_image, rgb_array
+from .keys import KEYS, parse_composite
+from .masks import alpha_mask, load_mask
+from .pipeline import load_pipeline, run_pipeline
+from .profiling import PROFILE_ENV, TRACE_ENV, SortTrace, profile_job, stage
+from .tiled import sort_file
+from .warmup import warm_up
+
+logger = logging.getLogger('pixfuck.cli')
+
+# Patterns the GUI offers that sort whole lines
+LINE_PATTERNS = ('Linear',)
+
+
+def init_worker(numba_threads):
+    """Split the cores between worker processes and compile the kernels before the first image.
+
+    Warming up here keeps JIT time out of the per-file timings; it is logged
+    separately by warm_up.
+    """
+    import numba
+    numba.set_num_threads(numba_threads)
+    warm_up()
+
+
+def render_file(path, output_dir, angle, criterion, pattern, intensity, shear_mode, key_bits, extension,
+                memory_budget=None, scratch_dir=None, cache_dir=None, seed=None, mask_path=None,
+                use_alpha=False, passes=None):
+    """Load, sort and save one image; return (output path, seconds spent, cache hit).
+
+    With a memory_budget the image is sorted out of core by pixfuck.tiled,
+    and never cached. With a cache_dir, results are looked up in and added to
+    the on-disk cache there. A seed makes partial intensity and random spans
+    reproducible. Only the pixels selected by the mask in mask_path, or with
+    use_alpha by the image's own alpha channel, are sorted. With passes, the
+    image goes through that pipeline instead of the single sort, uncached.
+    Stage timings are recorded as in pixfuck.profiling.
+    """
+    start = time.perf_counter()
+    stem, source_extension = os.path.splitext(os.path.basename(path))
+    output_path = os.path.join(output_dir, stem + (extension or source_extension))
+    trace = SortTrace('render', path=path, angle=angle, criterion=criterion, pattern=pattern,
+                      intensity=intensity, shear_mode=shear_mode, key_bits=key_bits, seed=seed, passes=passes)
+    hit = False
+    with profile_job(stem):
+        if memory_budget is not None:
+            with stage(trace, 'out-of-core sort'):
+                sort_file(path, output_path, angle, criterion, pattern, intensity, key_bits=key_bits,
+                          memory_budget=memory_budget, scratch_dir=scratch_dir, seed=seed)
+        else:
+            mask = None
+            with stage(trace, 'decode'):
+                image = decode_image(path)
+                if use_alpha:
+                    mask = alpha_mask(image)
+                    if mask is None:
+                        logger.warning(f"{path} has no alpha channel, sorting every pixel")
+                array = rgb_array(image)
+                del image
+                if mask_path:
+                    mask = load_mask(mask_path, (array.shape[1], array.shape[0]))
+            if passes is not None:
+                result, _ = run_pipeline(array, passes, mask=mask, trace=trace)
+            else:
+                # Each process renders a file once, so only the shared disk tier is worth keeping
+                cache = ResultCache(max_bytes=0, directory=cache_dir) if cache_dir else None
+                result, hit = cached_sort(cache, array, angle, criterion, pattern, intensity, seed,
+                                          shear_mode=shear_mode, key_bits=key_bits, trace=trace, mask=mask)
+            with stage(trace, 'encode'):
+                Image.fromarray(result).save(output_path)
+    trace.record()
+    return output_path, time.perf_counter() - start, hit
+
+
+def animation_jobs(paths, args):
+    """Split inputs into stills for render_file and (frames, n_frames, output_path) clips.
+
+    With --sequence every input is one frame of a single clip; otherwise
+    animated files, and stills when --frames is given, are clips of their own.
+    """
+    if args.sequence:
+        duration = round(1000 / args.fps) if args.fps else DEFAULT_DURATION
+        return [], [(read_sequence(paths, duration), len(paths), os.path.join(args.output_dir, args.sequence))]
+    stills, clips = [], []
+    for path in paths:
+        source_frames = frame_count(path)
+        if source_frames == 1 and args.frames is None:
+            stills.append(path)
+            continue
+        n_frames = source_frames if source_frames > 1 else args.frames
+        stem, source_extension = os.path.splitext(os.path.basename(path))
+        # A still swept into a clip needs a format that can hold one
+        extension = args.extension or (source_extension if source_frames > 1 else '.gif')
+        clips.append((read_frames(path, n_frames), n_frames, os.path.join(args.output_dir, stem + extension)))
+    return stills, clips
+
+
+def criterion_type(text):
+    """argparse type for a registered criterion name or a 'Name=weight,...' composite."""
+    if text not in KEYS:
+        try:
+            parse_composite(text)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def finite_float(text):
+    """argparse type for a float that is neither infinite nor nan."""
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number {text!r}")
+    if not math.isfinite(value):
+        raise argparse.ArgumentTypeError(f"expected a finite number, got {text!r}")
+    return value
+
+
+def expand_inputs(patterns):
+    """Files matching any of the glob patterns, in order and without duplicates."""
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='pixfuck', description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help="input files or glob patterns (quote them)")
+    parser.add_argument('-o', '--output-dir', required=True, help="directory to write sorted images to")
+    parser.add_argument('--angle', type=finite_float, default=0.0, help="sort angle in degrees")
+    parser.add_argument('--criterion', type=criterion_type, default='Brightness',
+                        help=f"one of {', '.join(KEYS)}, or a weighted blend such as 'Luma=0.7,Saturation=0.3'")
+    parser.add_argument('--pattern', choices=list(LINE_PATTERNS) + list(PATTERN_IDS), default='Linear')
+    parser.add_argument('--intensity', type=float, default=1.0, help="fraction of pixels sorted, 0 to 1")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="seed for partial intensity and random spans, for reproducible renders")
+    parser.add_argument('--shear-mode', choices=SHEAR_MODES, default='exact')
+    parser.add_argument('--key-bits', type=int, default=None,
+                        help="quantize float keys such as Hue to this many bits (8-16)")
+    parser.add_argument('--format', dest='extension', default=None,
+                        help="output file extension, e.g. .png (default: same as input)")
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+                        help="sort out of core, with at most this much memory for the sort's strips per image; "
+                             "decoding, and encoding any format but .npy, still hold the whole image once")
+    parser.add_argument('--scratch-dir', default=None,
+                        help="directory for out-of-core scratch files (default: system temp)")
+    parser.add_argument('--mask', default=None, metavar='PATH',
+                        help="only sort the pixels this grayscale or alpha image selects; it is resized to fit")
+    parser.add_argument('--alpha-mask', action='store_true',
+                        help="only sort the opaque pixels of each input's own alpha channel")
+    parser.add_argument('--pipeline', default=None, metavar='PATH',
+                        help="sort each image with the chain of passes in this JSON or YAML file instead of "
+                             "the sort options; --seed seeds passes without their own")
+    parser.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV),
+                        help=f"directory of cached results shared with the GUI (default: ${CACHE_DIR_ENV})")
+    parser.add_argument('--frames', type=int, default=None,
+                        help="render each still as an animation of this many frames (use with --angle-end)")
+    parser.add_argument('--sequence', default=None, metavar='NAME',
+                        help="treat the inputs as the frames of one clip saved as NAME in the output directory; "
+                             "a name such as frame_%%04d.png writes numbered frames")
+    parser.add_argument('--fps', type=finite_float, default=None, help="frame rate of --sequence clips")
+    parser.add_argument('--angle-end', type=finite_float, default=None,
+                        help="sweep the angle from --angle to this over the frames of a clip")
+    parser.add_argument('--intensity-end', type=float, default=None,
+                        help="sweep the intensity from --intensity to this over the frames of a clip")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="frames of a clip decoded or being sorted at once (default: twice --jobs)")
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help=f"append a JSON line of stage timings per image to PATH (default: ${TRACE_ENV})")
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help=f"write a cProfile dump per image to DIR (default: ${PROFILE_ENV})")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes")
+    args = parser.parse_args(argv)
+    if not 0.0 <= args.intensity <= 1.0:
+        parser.error("--intensity must be between 0 and 1")
+    if args.intensity_end is not None and not 0.0 <= args.intensity_end <= 1.0:
+        parser.error("--intensity-end must be between 0 and 1")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.frames is not None and args.frames < 1:
+        parser.error("--frames must be at least 1")
+    if args.fps is not None and args.fps <= 0:
+        parser.error("--fps must be positive")
+    if args.max_in_flight is not None and args.max_in_flight < 1:
+        parser.error("--max-in-flight must be at least 1")
+    if args.max_memory is not None and (args.sequence or args.frames):
+        parser.error("--max-memory cannot be used for clips")
+    if args.max_memory is not None and args.max_memory < 1:
+        parser.error("--max-memory must be at least 1 MB")
+    if args.max_memory is not None and args.shear_mode != 'exact':
+        parser.error("--max-memory only supports --shear-mode exact")
+    masked = args.mask or args.alpha_mask
+    if args.mask and args.alpha_mask:
+        parser.error("--mask and --alpha-mask cannot be used together")
+    if masked and (args.max_memory is not None or args.sequence or args.frames):
+        parser.error("masks cannot be used with --max-memory or for clips")
+    if masked and args.shear_mode == 'interpolated':
+        parser.error("masks need --shear-mode exact or lines")
+    if args.pipeline and (args.max_memory is not None or args.sequence or args.frames):
+        parser.error("--pipeline cannot be used with --max-memory or for clips")
+    args.passes = None
+    if args.pipeline:
+        try:
+            args.passes = load_pipeline(args.pipeline, args.seed)
+        except (OSError, ValueError) as e:
+            parser.error(f"--pipeline: {e}")
+        if masked and any(parameters['shear_mode'] == 'interpolated' for parameters in args.passes):
+            parser.error("masks need every pipeline pass to use shear_mode exact or lines")
+    if args.extension and not args.extension.startswith('.'):
+        args.extension = '.' + args.extension
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        logger.error("No input files matched")
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Worker processes inherit the environment, which is where they look for these
+    if args.trace:
+        os.environ[TRACE_ENV] = os.path.abspath(args.trace)
+    if args.profile:
+        os.environ[PROFILE_ENV] = os.path.abspath(args.profile)
+    stills, clips = animation_jobs(paths, args)
+    if clips and (args.mask or args.alpha_mask):
+        logger.warning("Masks only apply to still images; animated inputs are sorted whole")
+    if clips and args.passes:
+        logger.warning("Pipelines only apply to still images; animated inputs get the single sort")
+
+    # Clips spread their frames over every process; stills need one each
+    jobs = args.jobs if clips else min(args.jobs, len(stills))
+    numba_threads = max(1, (os.cpu_count() or 1) // jobs)
+    logger.info(f"Rendering {len(stills)} image(s) and {len(clips)} clip(s) with {jobs} process(es), "
+                f"{numba_threads} thread(s) each")
+
+    memory_budget = args.max_memory * 2 ** 20 if args.max_memory is not None else None
+    max_in_flight = args.max_in_flight or 2 * jobs
+    failures = 0
+    timings = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(numba_threads,)) as executor:
+        # Clips go first and one at a time, each keeping the whole pool busy
+        for frames, n_frames, output_path in clips:
+            clip_start = time.perf_counter()
+            try:
+                written = render_animation(executor, frames, n_frames, output_path, args.angle, args.criterion,
+                                           args.pattern, args.intensity, max_in_flight,
+                                           angle_end=args.angle_end, intensity_end=args.intensity_end,
+                                           seed=args.seed, shear_mode=args.shear_mode, key_bits=args.key_bits)
+            except Exception as e:
+                failures += 1
+                logger.error(f"{output_path}: {e}")
+                continue
+            seconds = time.perf_counter() - clip_start
+            timings.append((output_path, seconds))
+            print(f"{seconds:8.2f}s  {written} frame(s) -> {output_path}", flush=True)
+
+        futures = {
+            executor.submit(render_file, path, args.output_dir, args.angle, args.criterion, args.pattern,
+                            args.intensity, args.shear_mode, args.key_bits, args.extension,
+                            memory_budget, args.scratch_dir, args.cache_dir, args.seed, args.mask,
+                            args.alpha_mask, args.passes): path
+            for path in stills
+        }
+        # Report each file as soon as it is written rather than in submission order
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                output_path, seconds, hit = future.result()
+            except Exception as e:
+                failures += 1
+                logger.error(f"{path}: {e}")
+                continue
+            timings.append((path, seconds))
+            print(f"{seconds:8.2f}s  {path} -> {output_path}{'  (cached)' if hit else ''}", flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"{len(timings)} rendered, {failures} failed in {elapsed:.2f}s", end='')
+    if timings:
+        print(f" ({sum(seconds for _, seconds in timings) / len(timings):.2f}s per image)")
+    else:
+        print()
+    return 1 if failures else 0
@@ -0,0 +1,971 @@
+"""Qt-free pixel sorting engine.
+
+Everything in this module works on NumPy arrays and never imports PyQt6, so
+it can be used by the GUI worker, the command-line renderer and benchmarks.
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from numba import njit, prange
+import scipy.ndimage
+
+from .keys import fill_keys, get_sort_key
+from .profiling import stage
+
+logger = logging.getLogger('pixfuck.core')
+
+# Number of progress updates emitted per sort; lines are processed in this many chunks
+PROGRESS_STEPS = 20
+
+# Patterns that sort spans of each line instead of the whole line; any other
+# pattern sorts lines end to end
+PATTERN_IDS = {
+    'Threshold': 1,
+    'Edges': 2,
+    'Random Spans': 3,
+}
+
+# Span defaults, as fractions of the criterion's key range (see SortKey.scale)
+SPAN_LOWER = 0.25
+SPAN_UPPER = 0.8
+EDGE_THRESHOLD = 0.12
+SPAN_LENGTH = (16, 256)
+
+# Integer keys are sorted with a stable counting sort, which gives the same
+# pixels as the stable float argsort but in O(n). Above this many bins the
+# counting sort is done 8 bits at a time (LSD radix)
+RADIX_BINS = 1024
+
+# Per-image key caches keep the keys of this many criteria
+KEY_CACHE_SIZE = 2
+
+# Transposing gathers and scatters move pixels in square tiles of this size,
+# so the rows read and the rows written both stay in cache
+TRANSPOSE_TILE = 32
+
+# 'exact' shifts whole pixels (a lossless permutation) and sorts the sheared
+# rows, which wrap around the image edges; 'lines' sorts along straight,
+# unwrapped digital lines; 'interpolated' resamples with scipy
+SHEAR_MODES = ('exact', 'interpolated', 'lines')
+
+# uint8 mask values from this up select a pixel for sorting; float masks select from 0.5
+MASK_THRESHOLD = 128
+
+# Line indexes are cached, least recently used first out, up to this many
+# bytes in all; each takes 4 bytes per pixel, or 8 above 2**31 pixels, and a
+# larger one is rebuilt for every sort
+LINE_INDEX_CACHE_BYTES = 128 << 20
+
+# Held while a sort runs its parallel kernels. Without tbb, numba uses the
+# workqueue threading layer, which aborts the process when two threads enter
+# parallel regions at once, so superseded, preview and full-size sorts take turns
+KERNEL_LOCK = threading.Lock()
+
+
+class SortCancelled(Exception):
+    """Raised by sort_image when its cancel event is set between chunks."""
+
+
+@njit(cache=True)
+def counting_argsort(key, n_bins):
+    """Stable argsort of integer keys in [0, n_bins)."""
+    counts = np.zeros(n_bins + 1, dtype=np.int64)
+    for j in range(key.shape[0]):
+        counts[key[j] + 1] += 1
+    for b in range(n_bins):
+        counts[b + 1] += counts[b]
+    order = np.empty(key.shape[0], dtype=np.int64)
+    for j in range(key.shape[0]):
+        order[counts[key[j]]] = j
+        counts[key[j]] += 1
+    return order
+
+
+@njit(cache=True)
+def radix_argsort(key, n_bins):
+    """Stable argsort of integer keys in [0, n_bins).
+
+    Small ranges take a single counting pass; larger ones one LSD pass per 8 bits.
+    """
+    if n_bins <= RADIX_BINS:
+        return counting_argsort(key, n_bins)
+    order = counting_argsort(key & 255, 256)
+    shift = 8
+    while (n_bins - 1) >> shift:
+        digits = (key[order] >> shift) & 255
+        order = order[counting_argsort(digits, min(256, ((n_bins - 1) >> shift) + 1))]
+        shift += 8
+    return order
+
+
+@njit(parallel=True, cache=True)
+def sort_lines(lines, keys):
+    """Sort every line of an (n_lines, length, 3) array in place by its float keys, in parallel."""
+    for i in prange(lines.shape[0]):
+        sorted_indices = np.argsort(keys[i], kind='mergesort')
+        lines[i] = lines[i][sorted_indices]
+
+
+@njit(parallel=True, cache=True)
+def sort_lines_int(lines, keys, n_bins):
+    """sort_lines with integer keys in [0, n_bins) and a stable counting/radix sort."""
+    for i in prange(lines.shape[0]):
+        sorted_indices = radix_argsort(keys[i], n_bins)
+        lines[i] = lines[i][sorted_indices]
+
+
+@njit(parallel=True, cache=True)
+def blend_lines(lines, original, draws, intensity):
+    """Partial intensity in place: put back the original pixel wherever draws >= intensity."""
+    for i in prange(lines.shape[0]):
+        for j in range(lines.shape[1]):
+            if draws[i, j] >= intensity:
+                for k in range(lines.shape[2]):
+                    lines[i, j, k] = original[i, j, k]
+
+
+@njit(cache=True)
+def span_order(key, pattern_id, lower, upper, edge_threshold, span_lengths):
+    """Permutation of one line that sorts each span by key and leaves the rest in place.
+
+    Threshold spans are runs of keys within [lower, upper], edge spans end where
+    neighbouring keys differ by more than edge_threshold, and random spans take
+    their lengths from span_lengths.
+    """
+    length = key.shape[0]
+    order = np.arange(length)
+    start = 0
+    span = 0
+    while start < length:
+        if pattern_id == 1:
+            if key[start] < lower or key[start] > upper:
+                start += 1
+                continue
+            end = start + 1
+            while end < length and lower <= key[end] <= upper:
+                end += 1
+        elif pattern_id == 2:
+            end = start + 1
+            while end < length and abs(key[end] - key[end - 1]) <= edge_threshold:
+                end += 1
+        elif span < span_lengths.shape[0]:
+            end = min(start + span_lengths[span], length)
+            span += 1
+        else:
+            end = length
+        if end - start > 1:
+            order[start:end] = start + np.argsort(key[start:end], kind='mergesort')
+        start = end
+    return order
+
+
+@njit(cache=True)
+def masked_order(key, mask, pattern_id, lower, upper, edge_threshold, span_lengths):
+    """span_order applied to each run of masked pixels on its own; unmasked pixels stay in place."""
+    length = key.shape[0]
+    order = np.arange(length)
+    start = 0
+    while start < length:
+        if not mask[start]:
+            start += 1
+            continue
+        end = start + 1
+        while end < length and mask[end]:
+            end += 1
+        if end - start > 1:
+            order[start:end] = start + span_order(key[start:end], pattern_id, lower, upper, edge_threshold,
+                                                  span_lengths)
+        start = end
+    return order
+
+
+@njit(parallel=True, cache=True)
+def sort_masked_lines(lines, keys, mask, pattern_id, lower, upper, edge_threshold, span_lengths):
+    """sort_spans restricted to the masked pixels of every line; lines with none are skipped."""
+    for i in prange(lines.shape[0]):
+        if not mask[i].any():
+            continue
+        order = masked_order(keys[i], mask[i], pattern_id, lower, upper, edge_threshold, span_lengths[i])
+        lines[i] = lines[i][order]
+
+
+@njit(parallel=True, cache=True)
+def sort_spans(lines, keys, pattern_id, lower, upper, edge_threshold, span_lengths):
+    """Sort the spans of every line of an (n_lines, length, 3) array in place, in parallel.
+
+    lower, upper and edge_threshold are in key units; span_lengths holds one
+    row of random span lengths per line.
+    """
+    for i in prange(lines.shape[0]):
+        order = span_order(keys[i], pattern_id, lower, upper, edge_threshold, span_lengths[i])
+        lines[i] = lines[i][order]
+
+
+@njit(cache=True)
+def permute_line(pixels, line_index, order):
+    """Reorder the pixels of one line of a flat (n_pixels, 3) array: the p-th becomes the order[p]-th."""
+    n = line_index.shape[0]
+    moved = np.empty((n, pixels.shape[1]), dtype=pixels.dtype)
+    for p in range(n):
+        src = line_index[order[p]]
+        for k in range(pixels.shape[1]):
+            moved[p, k] = pixels[src, k]
+    for p in range(n):
+        dst = line_index[p]
+        for k in range(pixels.shape[1]):
+            pixels[dst, k] = moved[p, k]
+
+
+@njit(parallel=True, cache=True)
+def sort_index_lines(pixels, keys, index, starts):
+    """Sort lines of a flat (n_pixels, 3) array in place by their float keys, in parallel.
+
+    Line l is the pixels index[starts[l]:starts[l + 1]], in order along the
+    line; lines must not share pixels.
+    """
+    for l in prange(starts.shape[0] - 1):
+        line_index = index[starts[l]:starts[l + 1]]
+        permute_line(pixels, line_index, np.argsort(keys[line_index], kind='mergesort'))
+
+
+@njit(parallel=True, cache=True)
+def sort_index_lines_int(pixels, keys, index, starts, n_bins):
+    """sort_index_lines with integer keys in [0, n_bins) and a stable counting/radix sort."""
+    for l in prange(starts.shape[0] - 1):
+        line_index = index[starts[l]:starts[l + 1]]
+        permute_line(pixels, line_index, radix_argsort(keys[line_index], n_bins))
+
+
+@njit(parallel=True, cache=True)
+def sort_index_spans(pixels, keys, index, starts, pattern_id, lower, upper, edge_threshold, span_lengths):
+    """sort_spans for the lines of sort_index_lines."""
+    for l in prange(starts.shape[0] - 1):
+        line_index = index[starts[l]:starts[l + 1]]
+        order = span_order(keys[line_index], pattern_id, lower, upper, edge_threshold, span_lengths[l])
+        permute_line(pixels, line_index, order)
+
+
+@njit(parallel=True, cache=True)
+def sort_index_masked(pixels, keys, mask, index, starts, pattern_id, lower, upper, edge_threshold, span_lengths):
+    """sort_masked_lines for the lines of sort_index_lines, with a flat mask."""
+    for l in prange(starts.shape[0] - 1):
+        line_index = index[starts[l]:starts[l + 1]]
+        line_mask = mask[line_index]
+        if not line_mask.any():
+            continue
+        order = masked_order(keys[line_index], line_mask, pattern_id, lower, upper, edge_threshold,
+                             span_lengths[l])
+        permute_line(pixels, line_index, order)
+
+
+@njit(cache=True)
+def line_extents(offsets, n_minor, n_lines):
+    """First and one-past-last major coordinate of each of n_lines lines.
+
+    The pixel at major coordinate m (along the line) and minor coordinate q
+    (across it) lies on line q - offsets[m] + max(offsets). Offsets are
+    monotonic, so every line is one unbroken run of major coordinates. Steps
+    of at most one pixel leave no line empty; any that is has first == last.
+    """
+    base = offsets.max()
+    first = np.full(n_lines, offsets.shape[0], dtype=np.int64)
+    last = np.zeros(n_lines, dtype=np.int64)
+    for m in range(offsets.shape[0]):
+        for q in range(n_minor):
+            l = q - offsets[m] + base
+            first[l] = min(first[l], m)
+            last[l] = max(last[l], m + 1)
+    for l in range(n_lines):
+        if last[l] < first[l]:
+            first[l] = last[l]
+    return first, last
+
+
+@njit(parallel=True, cache=True)
+def fill_line_index(offsets, n_minor, width, sort_axis, first, starts, index):
+    """Write the flat pixel index of every line, in order along it, into index."""
+    base = offsets.max()
+    for m in prange(offsets.shape[0]):
+        for q in range(n_minor):
+            l = q - offsets[m] + base
+            y, x = (q, m) if sort_axis == 1 else (m, q)
+            index[starts[l] + m - first[l]] = y * width + x
+
+
+@njit(parallel=True, cache=True)
+def gather_lines(src, offsets, start, lines, transposed):
+    """Copy lines start, start + 1, ... of the sheared image into a contiguous (n_lines, length, c) array.
+
+    Without transposed, line i is a row of src with each column shifted by
+    its offset: lines[i, j] = src[(start + i + offsets[j]) % n_rows, j]. With
+    transposed, it is a column of src with each row shifted by its offset:
+    lines[i, j] = src[j, (start + i + offsets[j]) % n_rows]. The transposing
+    copy is done in tiles, so vertical lines cost about the same as rows.
+    """
+    n_lines, length, channels = lines.shape
+    if transposed:
+        n_rows = src.shape[1]
+        for tile in prange((n_lines + TRANSPOSE_TILE - 1) // TRANSPOSE_TILE):
+            first = tile * TRANSPOSE_TILE
+            last = min(first + TRANSPOSE_TILE, n_lines)
+            for j_tile in range(0, length, TRANSPOSE_TILE):
+                for j in range(j_tile, min(j_tile + TRANSPOSE_TILE, length)):
+                    for i in range(first, last):
+                        src_i = (start + i + offsets[j]) % n_rows
+                        for k in range(channels):
+                            lines[i, j, k] = src[j, src_i, k]
+    else:
+        n_rows = src.shape[0]
+        for i in prange(n_lines):
+            for j in range(length):
+                src_i = (start + i + offsets[j]) % n_rows
+                for k in range(channels):
+                    lines[i, j, k] = src[src_i, j, k]
+
+
+@njit(parallel=True, cache=True)
+def scatter_lines(lines, offsets, start, out, transposed):
+    """Write lines back to their unsheared positions in out; the inverse of gather_lines."""
+    n_lines, length, channels = lines.shape
+    if transposed:
+        n_rows = out.shape[1]
+        for tile in prange((length + TRANSPOSE_TILE - 1) // TRANSPOSE_TILE):
+            # Tiled over j, so no two threads write the same row of out
+            first = tile * TRANSPOSE_TILE
+            last = min(first + TRANSPOSE_TILE, length)
+            for i_tile in range(0, n_lines, TRANSPOSE_TILE):
+                for i in range(i_tile, min(i_tile + TRANSPOSE_TILE, n_lines)):
+                    for j in range(first, last):
+                        dst = (start + i + offsets[j]) % n_rows
+                        for k in range(channels):
+                            out[j, dst, k] = lines[i, j, k]
+    else:
+        n_rows = out.shape[0]
+        for i in prange(n_lines):
+            for j in range(length):
+                dst = (start + i + offsets[j]) % n_rows
+                for k in range(channels):
+                    out[dst, j, k] = lines[i, j, k]
+
+
+def shear_offsets(shape, shear_factor, sort_axis):
+    """Per-column (sort_axis=1) or per-row (sort_axis=0) shifts of the exact shear, for gather_lines."""
+    height, width = shape[:2]
+    length = width if sort_axis == 1 else height
+    wrap = height if sort_axis == 1 else width
+    return np.mod(np.rint(np.arange(length) * shear_factor), wrap).astype(np.int64)
+
+
+def interpolated_shear(array, shear_factor, sort_axis):
+    """Shear with a bilinear scipy.ndimage.affine_transform, wrapping at the edges."""
+    if sort_axis == 1:
+        shear_matrix = np.array([
+            [1, shear_factor, 0],
+            [0, 1, 0],
+            [0, 0, 1]
+        ])
+    else:
+        shear_matrix = np.array([
+            [1, 0, 0],
+            [shear_factor, 1, 0],
+            [0, 0, 1]
+        ])
+    return scipy.ndimage.affine_transform(
+        array,
+        shear_matrix,
+        offset=[0, 0, 0],
+        order=1,
+        mode='wrap',
+        cval=0
+    )
+
+
+def shear_parameters(angle):
+    """Return (shear_factor, sort_axis) for a sort angle in degrees; abs(shear_factor) is at most 1."""
+    # A line at angle and at angle + 180 is the same line, so fold the angle into [-90, 90)
+    angle = (float(angle) + 90.0) % 180.0 - 90.0
+    angle_rad = np.radians(angle)
+
+    # Determine if we should shear horizontally or vertically
+    # For angles between -45 and 45 degrees, shear horizontally
+    # For the rest, shear vertically
+    if -45.0 <= angle <= 45.0:
+        # Shear horizontally, sort horizontally
+        return np.tan(angle_rad), 1
+    # Shear vertically, sort vertically; at -90 degrees 1 / tan rounds to 0
+    return 1.0 / np.tan(angle_rad), 0
+
+
+def line_offsets(shape, shear_factor, sort_axis):
+    """shear_offsets without wrapping: the minor-axis step of a digital line at each major coordinate.
+
+    Rounding every step of the exact slope is the rasterization Bresenham's
+    algorithm computes incrementally.
+    """
+    length = shape[1] if sort_axis == 1 else shape[0]
+    return np.rint(np.arange(length) * shear_factor).astype(np.int64)
+
+
+# (starts, index) by line_index arguments, most recently used last, and their total size
+line_indexes = OrderedDict()
+line_indexes_bytes = 0
+line_indexes_lock = threading.Lock()
+
+
+def line_index(height, width, shear_factor, sort_axis):
+    """(starts, index) of the parallel digital lines that cover a height x width image exactly once.
+
+    Line l is the flat pixel indices index[starts[l]:starts[l + 1]], in order
+    along the line. Lines run along rows (sort_axis=1) or columns
+    (sort_axis=0), stepping across by shear_factor pixels per pixel, and
+    stop at the image edges instead of wrapping. Results are cached per
+    arguments up to LINE_INDEX_CACHE_BYTES in all; the arrays are read-only.
+    """
+    global line_indexes_bytes
+    arguments = (height, width, shear_factor, sort_axis)
+    with line_indexes_lock:
+        cached = line_indexes.get(arguments)
+        if cached is not None:
+            line_indexes.move_to_end(arguments)
+            return cached
+    starts, index = build_line_index(height, width, shear_factor, sort_axis)
+    size = starts.nbytes + index.nbytes
+    if size <= LINE_INDEX_CACHE_BYTES:
+        with line_indexes_lock:
+            if arguments not in line_indexes:
+                line_indexes[arguments] = starts, index
+                line_indexes_bytes += size
+            while line_indexes_bytes > LINE_INDEX_CACHE_BYTES:
+                _, (old_starts, old_index) = line_indexes.popitem(last=False)
+                line_indexes_bytes -= old_starts.nbytes + old_index.nbytes
+    return starts, index
+
+
+def build_line_index(height, width, shear_factor, sort_axis):
+    """Compute the uncached (starts, index) of line_index."""
+    if abs(shear_factor) > 1.0:
+        # Steeper lines would skip pixels; shear_parameters never returns them
+        raise ValueError(f"line_index needs abs(shear_factor) <= 1, got {shear_factor}")
+    offsets = line_offsets((height, width), shear_factor, sort_axis)
+    n_minor = height if sort_axis == 1 else width
+    n_lines = n_minor + int(offsets.max() - offsets.min())
+    first, last = line_extents(offsets, n_minor, n_lines)
+    starts = np.zeros(n_lines + 1, dtype=np.int64)
+    np.cumsum(last - first, out=starts[1:])
+    index = np.empty(height * width, dtype=np.int32 if height * width < 2 ** 31 else np.int64)
+    fill_line_index(offsets, n_minor, width, sort_axis, first, starts, index)
+    starts.flags.writeable = False
+    index.flags.writeable = False
+    return starts, index
+
+
+def sort_image(array, angle, criterion, pattern, intensity, rng=None, progress=None,
+               shear_mode='exact', key_bits=None, cancel=None, key_cache=None, seed=None, trace=None,
+               mask=None, resort=None, out=None):
+    """Sort the pixels of an (height, width, 3) uint8 array along lines at the given angle.
+
+    criterion is a name, a composite such as 'Luma=0.7,Saturation=0.3' or a
+    SortKey (see pixfuck.keys). rng is a numpy.random.Generator for the blend
+    mask and random spans; seed makes one with numpy.random.default_rng, so
+    the same seed always gives the same result. With neither, the global
+    NumPy random state is used. shear_mode is one of SHEAR_MODES; 'lines'
+    sorts along straight lines that stop at the image edges, with a line
+    index cached per shape and angle. progress, if given, is called with the
+    percentage of lines sorted after every chunk. key_bits quantizes float
+    keys to that many bits so they can use the counting sort as well; integer
+    keys always use it. cancel is an optional threading.Event checked between
+    chunks; once it is set, SortCancelled is raised. key_cache is a dict the
+    caller keeps for this image so sorting it again at another angle reuses
+    its keys. trace is an optional pixfuck.profiling.SortTrace that receives
+    the time of each stage and counts of lines and bytes. mask is an optional
+    (height, width) boolean, uint8 or float array (see active_pixels): only
+    the pixels it selects are sorted, each unbroken run along a line on its
+    own, and lines that miss its bounding box are skipped. resort is a dict
+    the caller keeps for this image, like key_cache: it holds the last
+    full-intensity sort, so a call that differs only in intensity just
+    blends that again (see resorted). out is an optional array of the same
+    shape and dtype, not sharing memory with array, that the result is
+    written into instead of a new one, so repeated sorts can reuse buffers.
+    Returns the result: out, a new uint8 array of the same shape, or with
+    resort and full intensity the read-only array kept in it. The input is
+    not modified. Sorts on different threads run their kernels one at a time
+    (see KERNEL_LOCK).
+    """
+    logger.debug(f"Starting sort_image with image shape {array.shape}")
+    started = time.perf_counter()
+    signatures = compiled_signatures()
+    sort_key, pattern_id = sort_settings(criterion, pattern, key_bits)
+    rng = seeded_rng(rng, seed)
+    if out is not None and (out.shape != array.shape or out.dtype != array.dtype or np.shares_memory(out, array)):
+        raise ValueError("out must have the shape and dtype of array and not share its memory")
+
+    shear_factor, sort_axis = shear_parameters(angle)
+
+    active = bounds = None
+    if mask is not None:
+        if shear_mode == 'interpolated':
+            raise ValueError("Masks need shear_mode 'exact' or 'lines'")
+        active = active_pixels(mask, array.shape[:2])
+        bounds = mask_bounds(active)
+
+    def sort_sheared(intensity, rng, out):
+        return sort_dispatch(array, sort_key, pattern_id, intensity, rng, progress, cancel, key_cache, trace,
+                             shear_factor, sort_axis, shear_mode, active, bounds, out)
+
+    with KERNEL_LOCK:
+        if resort is not None and shear_mode != 'interpolated':
+            settings = (float(angle), sort_key.cache_id, pattern_id, shear_mode, seed)
+            result_array, n_lines, allocated = resorted(resort, array, mask, settings, intensity, rng, progress,
+                                                        trace, sort_sheared)
+        else:
+            result_array, n_lines, allocated = sort_sheared(intensity, rng, out)
+
+    # Ensure the result has the same shape as the input
+    if result_array.shape != array.shape:
+        with stage(trace, 'aspect ratio'):
+            result_array = maintain_aspect_ratio(result_array, array.shape)
+
+    new_signatures = compiled_signatures() - signatures
+    log_sort_time(time.perf_counter() - started, new_signatures)
+    result_array = result_array.astype(np.uint8, copy=False)
+    if out is not None and result_array is not out:
+        # Kept resort results and resampled shears are not written in place
+        np.copyto(out, result_array)
+        result_array = out
+    if trace is not None:
+        trace.count('lines_sorted', n_lines)
+        trace.count('pixels', array.shape[0] * array.shape[1])
+        trace.count('new_signatures', new_signatures)
+        # out was allocated by the caller
+        trace.allocated(*(allocated_array for allocated_array in allocated if allocated_array is not out))
+    return result_array
+
+
+def sort_dispatch(array, sort_key, pattern_id, intensity, rng, progress, cancel, key_cache, trace,
+                  shear_factor, sort_axis, shear_mode, active, bounds, out=None):
+    """Run the sort of shear_mode, masked or not, for sort_image; returns (result, lines sorted, arrays allocated)."""
+    if active is not None and bounds is None:
+        logger.debug("The mask selects no pixels, nothing to sort")
+        result_array = output_copy(array, out)
+        return result_array, 0, (result_array,)
+    if shear_mode == 'lines':
+        return sort_true_lines(array, sort_key, pattern_id, intensity, rng, progress, cancel, key_cache, trace,
+                               shear_factor, sort_axis, active, bounds, out)
+    if active is not None:
+        return sort_masked_sheared_lines(array, active, bounds, sort_key, pattern_id, intensity, rng, progress,
+                                         cancel, key_cache, trace, shear_factor, sort_axis, out)
+    return sort_sheared_lines(array, sort_key, pattern_id, intensity, rng, progress, cancel, key_cache, trace,
+                              shear_factor, sort_axis, shear_mode, out)
+
+
+def output_copy(array, out=None):
+    """A copy of array written into out, or into a new array when out is None."""
+    if out is None:
+        return array.copy()
+    np.copyto(out, array)
+    return out
+
+
+def resorted(resort, array, mask, settings, intensity, rng, progress, trace, sort_sheared):
+    """sort_image through a resort dict, re-blending the last full sort when only the intensity changed.
+
+    Partial intensity puts back the original pixel wherever a uniform draw
+    is at or above the intensity, and the draws are the next ones after the
+    sort; so a full-intensity sort and a copy of the random state after it
+    reproduce any intensity exactly. A sort of another image, mask or
+    settings replaces the state, dropping the old one first.
+    """
+    state = resort.get('state')
+    if (state is not None and state['array'] is array and state['mask'] is mask
+            and state['settings'] == settings):
+        logger.debug("Only the intensity changed, blending the last sort")
+        full, n_lines, allocated = state['sorted'], 0, ()
+        if trace is not None:
+            trace.count('resorts')
+        if progress is not None:
+            progress(100)
+    else:
+        resort.pop('state', None)
+        full, n_lines, allocated = sort_sheared(1.0, rng, None)
+        full.flags.writeable = False
+        state = {'array': array, 'mask': mask, 'settings': settings, 'sorted': full,
+                 'rng': copy.deepcopy(rng)}
+        resort['state'] = state
+    if intensity >= 1.0:
+        return full, n_lines, allocated
+    with stage(trace, 'blend'):
+        result_array = full.copy()
+        blend_lines(result_array, array, random_values(copy.deepcopy(state['rng']), array.shape[:2]), intensity)
+    return result_array, n_lines, allocated + (result_array,)
+
+
+def sort_in_chunks(n_lines, sort_range, progress=None, cancel=None):
+    """Call sort_range(start, stop) over n_lines lines in PROGRESS_STEPS chunks.
+
+    Each chunk is one parallel kernel call, so progress is reported
+    PROGRESS_STEPS times instead of once per line, and cancel is checked in
+    between.
+    """
+    chunk_size = max(1, -(-n_lines // PROGRESS_STEPS))
+    for start in range(0, n_lines, chunk_size):
+        check_cancelled(cancel)
+        stop = min(start + chunk_size, n_lines)
+        sort_range(start, stop)
+        if progress is not None:
+            progress(int((stop / n_lines) * 100))
+    check_cancelled(cancel)
+
+
+def sort_sheared_lines(array, sort_key, pattern_id, intensity, rng, progress, cancel, key_cache, trace,
+                       shear_factor, sort_axis, shear_mode, out=None):
+    """Shear, sort rows and unshear, for sort_image; returns (result, lines sorted, arrays allocated)."""
+    # Gather the sheared lines into a contiguous (n_lines, length, 3) array,
+    # transposing for vertical sorts, so every line is sorted as a row
+    logger.debug(f"Applying {shear_mode} shear transformation")
+    if shear_mode == 'interpolated':
+        keys = None
+        with stage(trace, 'shear'):
+            lines, key_lines = interpolated_lines(array, sort_key, shear_factor, sort_axis)
+    else:
+        with stage(trace, 'keys'):
+            keys = image_keys(array, sort_key, key_cache)
+        with stage(trace, 'shear'):
+            offsets = shear_offsets(array.shape, shear_factor, sort_axis)
+            lines, key_lines = exact_lines(array, keys, offsets, sort_axis)
+
+    # Sort pixels; the exact shear only moves pixels, so partial intensity is blended after unshearing
+    logger.debug("Sorting pixels")
+    line_intensity = intensity if shear_mode == 'interpolated' else 1.0
+    with stage(trace, 'sort'):
+        sort_in_chunks(lines.shape[0], lambda start, stop: sort_chunk(
+            lines[start:stop], key_lines[start:stop], sort_key, pattern_id, line_intensity, rng), progress,
+            cancel)
+
+    # Apply inverse shear transformation
+    logger.debug("Applying inverse shear transformation")
+    with stage(trace, 'inverse shear'):
+        if shear_mode == 'interpolated':
+            sorted_array = lines if sort_axis == 1 else lines.swapaxes(0, 1)
+            result_array = interpolated_shear(sorted_array, -shear_factor, sort_axis)
+        else:
+            result_array = np.empty_like(array) if out is None else out
+            scatter_lines(lines, offsets, 0, result_array, sort_axis == 0)
+    if line_intensity > intensity:
+        with stage(trace, 'blend'):
+            blend_lines(result_array, array, random_values(rng, array.shape[:2]), intensity)
+
+    # Unsheared keys may come from key_cache, so only gathered copies of them count
+    allocated = (lines, result_array) + (() if key_lines is keys else (key_lines,))
+    return result_array, lines.shape[0], allocated
+
+
+def sort_masked_sheared_lines(array, active, bounds, sort_key, pattern_id, intensity, rng, progress, cancel,
+                              key_cache, trace, shear_factor, sort_axis, out=None):
+    """sort_sheared_lines for the pixels of a mask, with the exact shear only.
+
+    Only the sheared lines that can cross the mask's bounding box are
+    gathered, a chunk at a time, sorted and scattered into a copy of the
+    image. Returns (result, lines sorted, arrays allocated).
+    """
+    with stage(trace, 'keys'):
+        keys = image_keys(array, sort_key, key_cache)
+    transposed = sort_axis == 0
+    height, width, channels = array.shape
+    n_rows, length = (width, height) if transposed else (height, width)
+    offsets = shear_offsets(array.shape, shear_factor, sort_axis)
+    first, count = candidate_lines(bounds, shear_factor, sort_axis, array.shape)
+    first, count = first % n_rows, min(count, n_rows)
+
+    def sort_range(start, stop):
+        n = stop - start
+        lines = np.empty((n, length, channels), dtype=array.dtype)
+        key_lines = np.empty((n, length), dtype=keys.dtype)
+        mask_lines = np.empty((n, length), dtype=np.bool_)
+        gather_lines(array, offsets, first + start, lines, transposed)
+        gather_lines(keys.reshape(height, width, 1), offsets, first + start, key_lines.reshape(n, length, 1),
+                     transposed)
+        gather_lines(active.reshape(height, width, 1), offsets, first + start, mask_lines.reshape(n, length, 1),
+                     transposed)
+        sort_chunk(lines, key_lines, sort_key, pattern_id, 1.0, rng, mask_lines)
+        scatter_lines(lines, offsets, first + start, result_array, transposed)
+
+    logger.debug(f"Sorting the {count} of {n_rows} lines that can cross the mask")
+    with stage(trace, 'sort'):
+        result_array = output_copy(array, out)
+        sort_in_chunks(count, sort_range, progress, cancel)
+        if intensity < 1.0:
+            blend_lines(result_array, array, random_values(rng, array.shape[:2]), intensity)
+    return result_array, count, (result_array,)
+
+
+def sort_true_lines(array, sort_key, pattern_id, intensity, rng, progress, cancel, key_cache, trace,
+                    shear_factor, sort_axis, active=None, bounds=None, out=None):
+    """Sort along the unwrapped digital lines of line_index, for sort_image.
+
+    Each line is gathered, sorted and scattered back in place by one kernel,
+    so nothing is resampled and no sheared copy is made. With a mask (active
+    and its bounds), only the lines crossing the bounding box are visited.
+    Returns (result, lines sorted, arrays allocated).
+    """
+    with stage(trace, 'keys'):
+        keys = image_keys(array, sort_key, key_cache).reshape(-1)
+    with stage(trace, 'line index'):
+        starts, index = line_index(array.shape[0], array.shape[1], shear_factor, sort_axis)
+    first, n_lines = 0, starts.shape[0] - 1
+    if active is not None:
+        # line_index numbers lines from the largest offset down
+        base = int(line_offsets(array.shape, shear_factor, sort_axis).max())
+        candidate, count = candidate_lines(bounds, shear_factor, sort_axis, array.shape)
+        first = max(0, candidate + base)
+        n_lines = min(n_lines, candidate + base + count) - first
+        active = active.reshape(-1)
+    max_length = array.shape[1] if sort_axis == 1 else array.shape[0]
+    lower, upper, edge_threshold = span_thresholds(sort_key)
+
+    def sort_range(start, stop):
+        chunk_starts = starts[first + start:first + stop + 1]
+        if active is not None or pattern_id:
+            span_lengths = random_span_lengths(stop - start, max_length, pattern_id, rng)
+        if active is not None:
+            sort_index_masked(pixels, keys, active, index, chunk_starts, pattern_id, lower, upper,
+                              edge_threshold, span_lengths)
+        elif pattern_id:
+            sort_index_spans(pixels, keys, index, chunk_starts, pattern_id, lower, upper, edge_threshold,
+                             span_lengths)
+        elif sort_key.integer:
+            sort_index_lines_int(pixels, keys, index, chunk_starts, sort_key.n_bins)
+        else:
+            sort_index_lines(pixels, keys, index, chunk_starts)
+
+    logger.debug(f"Sorting {n_lines} lines")
+    with stage(trace, 'sort'):
+        result_array = output_copy(array, out)
+        pixels = result_array.reshape(-1, array.shape[2])
+        sort_in_chunks(n_lines, sort_range, progress, cancel)
+        if intensity < 1.0:
+            # The input still holds every unsorted pixel, so the blend needs no copy
+            blend_lines(result_array, array, random_values(rng, array.shape[:2]), intensity)
+    return result_array, n_lines, (result_array,)
+
+
+def active_pixels(mask, shape):
+    """The pixels a mask selects, as a contiguous boolean array of the given shape.
+
+    Boolean masks are used as they are; uint8 masks (grayscale or alpha)
+    select values of at least MASK_THRESHOLD and float masks values of at
+    least 0.5.
+    """
+    mask = np.asarray(mask)
+    if mask.shape != tuple(shape):
+        raise ValueError(f"Mask shape {mask.shape} does not match the image's {tuple(shape)}")
+    if mask.dtype == np.bool_:
+        return np.ascontiguousarray(mask)
+    if np.issubdtype(mask.dtype, np.floating):
+        return mask >= 0.5
+    return mask >= MASK_THRESHOLD
+
+
+def mask_bounds(active):
+    """(top, bottom, left, right), inclusive, of a boolean mask's selected pixels, or None if there are none."""
+    rows = np.flatnonzero(active.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(active.any(axis=0))
+    return rows[0], rows[-1], cols[0], cols[-1]
+
+
+def candidate_lines(bounds, shear_factor, sort_axis, shape):
+    """(first, count) of the lines that can cross a bounding box.
+
+    Both shear modes put the pixel at major coordinate m and minor
+    coordinate q on line q - line_offsets[m]; 'exact' takes that modulo the
+    number of lines and 'lines' adds max(line_offsets).
+    """
+    top, bottom, left, right = bounds
+    minor_first, minor_last, major_first, major_last = (
+        (top, bottom, left, right) if sort_axis == 1 else (left, right, top, bottom))
+    offsets = line_offsets(shape, shear_factor, sort_axis)[major_first:major_last + 1]
+    first = int(minor_first - offsets.max())
+    return first, int(minor_last - offsets.min()) - first + 1
+
+
+def exact_lines(array, keys, offsets, sort_axis):
+    """The lines of an integer-grid shear and their keys, as contiguous (n_lines, length) arrays.
+
+    Keys of unsheared rows are used as they are; otherwise they are gathered
+    the same way as the pixels.
+    """
+    transposed = sort_axis == 0
+    height, width, channels = array.shape
+    n_lines, length = (width, height) if transposed else (height, width)
+    lines = np.empty((n_lines, length, channels), dtype=array.dtype)
+    gather_lines(array, offsets, 0, lines, transposed)
+    if not transposed and not offsets.any():
+        return lines, keys
+    key_lines = np.empty((n_lines, length), dtype=keys.dtype)
+    gather_lines(keys.reshape(height, width, 1), offsets, 0, key_lines.reshape(n_lines, length, 1), transposed)
+    return lines, key_lines
+
+
+def interpolated_lines(array, sort_key, shear_factor, sort_axis):
+    """The lines of a resampled shear and their keys, as contiguous (n_lines, length) arrays."""
+    sheared = interpolated_shear(array, shear_factor, sort_axis)
+    lines = sheared if sort_axis == 1 else np.ascontiguousarray(sheared.swapaxes(0, 1))
+    # Resampling blends pixels, so keys must come from the sheared image
+    return lines, sort_key(lines)
+
+
+def check_cancelled(cancel):
+    """Raise SortCancelled if the cancel event is set."""
+    if cancel is not None and cancel.is_set():
+        raise SortCancelled("Sort cancelled")
+
+
+def compiled_signatures():
+    """Number of signatures compiled or loaded from the cache for the top-level kernels."""
+    return sum(len(kernel.signatures) for kernel in (fill_keys, sort_lines, sort_lines_int, sort_spans,
+                                                       blend_lines, gather_lines, scatter_lines,
+                                                       sort_index_lines, sort_index_lines_int, sort_index_spans,
+                                                       line_extents, fill_line_index, sort_masked_lines,
+                                                       sort_index_masked))
+
+
+def log_sort_time(seconds, new_signatures):
+    """Log how long a sort took and whether it had to wait for the JIT."""
+    if new_signatures:
+        logger.info(f"Pixel sorting completed in {seconds:.3f}s, including JIT compilation "
+                    f"of {new_signatures} kernel signature(s); see pixfuck.warmup")
+    else:
+        logger.info(f"Pixel sorting completed in {seconds:.3f}s")
+
+
+def seeded_rng(rng=None, seed=None):
+    """The Generator a sort draws from: rng, a new one for seed, or None for the global state."""
+    if seed is None:
+        return rng
+    if rng is not None:
+        raise ValueError("Pass either rng or seed, not both")
+    return np.random.default_rng(seed)
+
+
+def sort_settings(criterion, pattern, key_bits=None):
+    """Resolve a criterion and a pattern name to (sort_key, pattern_id) for sort_chunk."""
+    sort_key = get_sort_key(criterion, key_bits)
+    logger.debug(f"Using {'integer' if sort_key.integer else 'float'} sort key {sort_key.cache_id}")
+    pattern_id = PATTERN_IDS.get(pattern, 0)
+    logger.debug(f"Using pattern: {pattern} (span mode {pattern_id})")
+    return sort_key, pattern_id
+
+
+def image_keys(array, sort_key, key_cache=None):
+    """Keys of every pixel of an image, taken from key_cache when it has them.
+
+    key_cache is a dict owned by the caller for this one image; it keeps the
+    keys of the KEY_CACHE_SIZE most recently used criteria.
+    """
+    if key_cache is None:
+        return sort_key(array)
+    keys = key_cache.pop(sort_key.cache_id, None)
+    if keys is None:
+        logger.debug(f"Computing {sort_key.cache_id} keys")
+        keys = sort_key(array)
+        # Dicts keep insertion order and hits are re-inserted, so the first keys are the least recent
+        for stale in list(key_cache)[:max(0, len(key_cache) - KEY_CACHE_SIZE + 1)]:
+            key_cache.pop(stale, None)
+    key_cache[sort_key.cache_id] = keys
+    return keys
+
+
+def sort_chunk(chunk, keys, sort_key, pattern_id, intensity, rng=None, mask=None):
+    """Sort an (n_lines, length, 3) batch of lines in place by their (n_lines, length) keys.
+
+    With a boolean (n_lines, length) mask, only the masked pixels are
+    sorted. Partial intensity then blends the sorted lines with the
+    originals, drawing the mask for the whole chunk in one call; only the
+    chunk being sorted is copied to keep its unsorted pixels.
+    """
+    n_lines, length = chunk.shape[:2]
+    original = chunk.copy() if intensity < 1.0 else None
+    if mask is not None:
+        span_lengths = random_span_lengths(n_lines, length, pattern_id, rng)
+        sort_masked_lines(chunk, keys, mask, pattern_id, *span_thresholds(sort_key), span_lengths)
+    elif pattern_id:
+        span_lengths = random_span_lengths(n_lines, length, pattern_id, rng)
+        sort_spans(chunk, keys, pattern_id, *span_thresholds(sort_key), span_lengths)
+    elif sort_key.integer:
+        sort_lines_int(chunk, keys, sort_key.n_bins)
+    else:
+        sort_lines(chunk, keys)
+    if intensity < 1.0:
+        blend_lines(chunk, original, random_values(rng, (n_lines, length)), intensity)
+
+
+def span_thresholds(sort_key):
+    """(lower, upper, edge_threshold) of the span patterns, in the key's units."""
+    scale = sort_key.scale
+    return SPAN_LOWER * scale, SPAN_UPPER * scale, EDGE_THRESHOLD * scale
+
+
+def random_values(rng, shape):
+    """Uniform floats in [0, 1) from rng, or from the global random state when rng is None.
+
+    The global draws come in the same order as one np.random.rand(length) per line.
+    """
+    if rng is None:
+        return np.random.rand(*shape)
+    return rng.random(shape)
+
+
+def random_span_lengths(n_lines, length, pattern_id, rng=None):
+    """Draw enough random span lengths to cover each line, or none for other patterns."""
+    if pattern_id != PATTERN_IDS['Random Spans']:
+        return np.zeros((n_lines, 0), dtype=np.int64)
+    min_length, max_length = SPAN_LENGTH
+    shape = (n_lines, -(-length // min_length))
+    if rng is None:
+        return np.random.randint(min_length, max_length + 1, size=shape).astype(np.int64)
+    return rng.integers(min_length, max_length + 1, size=shape, dtype=np.int64)
+
+
+def maintain_aspect_ratio(img_array, target_shape):
+    """Maintain aspect ratio while resizing the image to match target shape."""
+    logger.debug(f"Maintaining aspect ratio: current shape {img_array.shape} -> target shape {target_shape}")
+
+    current_height, current_width = img_array.shape[:2]
+    target_height, target_width = target_shape[:2]
+
+    # Calculate scaling factors
+    scale_h = target_height / current_height
+    scale_w = target_width / current_width
+
+    # Use the smaller scaling factor to maintain aspect ratio
+    scale = min(scale_h, scale_w)
+
+    # Calculate new dimensions
+    new_height = int(current_height * scale)
+    new_width = int(current_width * scale)
+
+    # Resize the image
+    resized = scipy.ndimage.zoom(
+        img_array,
+        (scale, scale, 1) if len(img_array.shape) == 3 else (scale, scale),
+        order=1,
+        mode='constant',
+        cval=0
+    )
+
+    # Create a new array with target shape
+    result = np.zeros(target_shape, dtype=img_array.dtype)
+
+    # Calculate padding
+    pad_h = (target_height - new_height) // 2
+    pad_w = (target_width - new_width) // 2
+
+    # Copy the resized image into the center of the result
+    result[pad_h:pad_h + new_height, pad_w:pad_w + new_width] = resized
+
+    return result
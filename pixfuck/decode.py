@@ -0,0 +1,121 @@
+"""Decode image files into sort-ready RGB arrays, with progress and cancellation.
+
+decode_image feeds the file to Pillow's incremental parser a chunk at a time,
+so the header is read once, checked before any pixels are decoded, and
+progress follows the bytes actually decoded. rgb_array then converts the
+decoded image into the final (height, width, 3) buffer a strip of rows at a
+time, so no full-size intermediate copy is made. draft_preview decodes a JPEG
+at a reduced scale inside the decoder itself, for a proxy that is ready long
+before the full image.
+"""
+import logging
+import os
+
+import numpy as np
+from PIL import Image, ImageFile
+
+logger = logging.getLogger('pixfuck.decode')
+
+# Bytes fed to the parser between progress reports and cancel checks
+CHUNK_BYTES = 1 << 20
+
+# Rows converted into the RGB array between progress reports and cancel checks
+STRIP_ROWS = 256
+
+# Share of the progress range spent decoding; converting to RGB takes the rest
+DECODE_SHARE = 0.8
+
+
+class DecodeCancelled(Exception):
+    """Raised by decode_image and rgb_array when their cancel event is set."""
+
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise DecodeCancelled()
+
+
+def report(progress, fraction):
+    if progress is not None:
+        progress(int(100 * fraction))
+
+
+def decode_image(path, progress=None, cancel=None, check_header=None):
+    """Decode an image file into a PIL image, reading it once.
+
+    check_header is called with the image as soon as its header has been
+    parsed, before the pixels are decoded, and may raise to refuse it (for
+    example for its size). progress receives 0 to DECODE_SHARE * 100.
+    Formats the parser cannot decode incrementally are decoded when the last
+    chunk arrives, so their progress only follows the reading.
+    """
+    total = max(1, os.path.getsize(path))
+    parser = ImageFile.Parser()
+    checked = False
+    done = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_BYTES):
+            parser.feed(chunk)
+            done += len(chunk)
+            if not checked and parser.image is not None:
+                checked = True
+                if check_header is not None:
+                    check_header(parser.image)
+            report(progress, DECODE_SHARE * done / total)
+            check_cancelled(cancel)
+    image = parser.close()
+    if not checked and check_header is not None:
+        check_header(image)
+    return image
+
+
+def rgb_array(image, progress=None, cancel=None):
+    """Convert a decoded PIL image into a new contiguous (height, width, 3) uint8 array.
+
+    Rows are converted a strip at a time straight into the array, so other
+    modes never need a full-size RGB copy in Pillow as well. progress
+    continues from DECODE_SHARE * 100 to 100.
+    """
+    width, height = image.size
+    array = np.empty((height, width, 3), dtype=np.uint8)
+    for top in range(0, height, STRIP_ROWS):
+        bottom = min(top + STRIP_ROWS, height)
+        strip = image.crop((0, top, width, bottom))
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        array[top:bottom] = np.asarray(strip)
+        report(progress, DECODE_SHARE + (1 - DECODE_SHARE) * bottom / height)
+        check_cancelled(cancel)
+    return array
+
+
+def preview_size(size, max_size):
+    """(width, height) of a proxy for an image of the given size, at most max_size on its longest side."""
+    width, height = size
+    scale = min(1.0, max_size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def draft_preview(path, max_size, check_header=None):
+    """A reduced RGB decode of a JPEG for a proxy, or None for other formats.
+
+    The JPEG decoder scales by 1/2, 1/4 or 1/8 while decoding, so this costs
+    a fraction of a full decode; the result is then resized to
+    preview_size. check_header is called first, as for decode_image.
+    """
+    with Image.open(path) as img:
+        if img.format != 'JPEG':
+            return None
+        if check_header is not None:
+            check_header(img)
+        size = preview_size(img.size, max_size)
+        img.draft('RGB', size)
+        return reduced(img, size)
+
+
+def reduced(image, size):
+    """image resized to size, reducing by whole factors first, as an RGB image."""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    # reducing_gap lets Pillow box-reduce by an integer factor before the bilinear pass
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
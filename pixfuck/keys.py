@@ -0,0 +1,222 @@
+"""Sort keys: what a pixel is sorted by.
+
+A SortKey computes a key for every pixel of an (n, m, 3) uint8 array in one
+pass and says whether the keys are small integers (sorted with a counting or
+radix sort) or floats (sorted with a stable mergesort). Keys are computed
+once per image, before the shear, so the line kernels only ever see
+precomputed keys. New criteria are added with register_key; weighted blends
+of existing ones with composite_key.
+"""
+import functools
+import logging
+
+import numpy as np
+from numba import njit, prange
+
+logger = logging.getLogger('pixfuck.keys')
+
+# Float keys may be quantized to between 8 and 16 bits to take the integer path
+KEY_BITS_RANGE = (8, 16)
+
+# Built-in keys computed by fill_keys
+BRIGHTNESS, HUE, SATURATION, INTENSITY, MINIMUM, LUMA, LIGHTNESS, HUE_SATURATION = range(8)
+
+# Rec. 709 luma weights, scaled to integers so luma keys are exact
+LUMA_WEIGHTS = (2126, 7152, 722)
+
+def srgb_to_linear_table():
+    """Linear light of each 8-bit sRGB value."""
+    c = np.arange(256) / 255.0
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+SRGB_TO_LINEAR = srgb_to_linear_table()
+
+@njit(cache=True)
+def hue_saturation(pixel_r, pixel_g, pixel_b):
+    """HSV hue and saturation in [0, 1] of one 8-bit pixel, in float32.
+
+    Where channels tie for the maximum, blue wins over green and green over red.
+    """
+    r = np.float32(pixel_r) / np.float32(255.0)
+    g = np.float32(pixel_g) / np.float32(255.0)
+    b = np.float32(pixel_b) / np.float32(255.0)
+    maxc = max(r, g, b)
+    delta = maxc - min(r, g, b)
+    if delta == 0:
+        return np.float32(0.0), np.float32(0.0)
+    rc = (maxc - r) / delta
+    gc = (maxc - g) / delta
+    bc = (maxc - b) / delta
+    if b == maxc:
+        h = np.float32(4.0) + gc - rc
+    elif g == maxc:
+        h = np.float32(2.0) + rc - bc
+    else:
+        h = bc - gc
+    return (h / np.float32(6.0)) % np.float32(1.0), delta / maxc
+
+@njit(cache=True)
+def cie_lightness(pixel_r, pixel_g, pixel_b):
+    """CIE L* in [0, 100] of one 8-bit sRGB pixel."""
+    y = (0.2126 * SRGB_TO_LINEAR[pixel_r] + 0.7152 * SRGB_TO_LINEAR[pixel_g]
+         + 0.0722 * SRGB_TO_LINEAR[pixel_b])
+    if y > 216.0 / 24389.0:
+        return 116.0 * y ** (1.0 / 3.0) - 16.0
+    return y * (24389.0 / 27.0)
+
+@njit(parallel=True, cache=True)
+def fill_keys(pixels, key_id, out):
+    """Compute a built-in key for every pixel of an (n, m, 3) array into an (n, m) array."""
+    for i in prange(pixels.shape[0]):
+        for j in range(pixels.shape[1]):
+            r = np.int32(pixels[i, j, 0])
+            g = np.int32(pixels[i, j, 1])
+            b = np.int32(pixels[i, j, 2])
+            if key_id == HUE or key_id == SATURATION or key_id == HUE_SATURATION:
+                h, s = hue_saturation(r, g, b)
+                if key_id == HUE:
+                    out[i, j] = h
+                elif key_id == SATURATION:
+                    out[i, j] = s
+                else:
+                    # 16 bits of hue, then 8 bits of saturation to break ties
+                    out[i, j] = (np.int32(h * 65535 + 0.5) << 8) | np.int32(s * 255 + 0.5)
+            elif key_id == INTENSITY:
+                out[i, j] = max(r, g, b) + min(r, g, b)
+            elif key_id == MINIMUM:
+                out[i, j] = min(r, g, b)
+            elif key_id == LUMA:
+                out[i, j] = LUMA_WEIGHTS[0] * r + LUMA_WEIGHTS[1] * g + LUMA_WEIGHTS[2] * b
+            elif key_id == LIGHTNESS:
+                out[i, j] = cie_lightness(r, g, b)
+            else:
+                out[i, j] = r + g + b
+
+@njit(parallel=True, cache=True)
+def quantize_keys(keys, scale, levels, out):
+    """out = round(keys / scale * (levels - 1)), clipped to [0, levels)."""
+    for i in prange(keys.shape[0]):
+        for j in range(keys.shape[1]):
+            q = np.int32(keys[i, j] / scale * (levels - 1) + 0.5)
+            out[i, j] = min(max(q, 0), levels - 1)
+
+def builtin_keys(pixels, key_id, integer):
+    """Run fill_keys into a new int32 or float32 array."""
+    out = np.empty(pixels.shape[:2], dtype=np.int32 if integer else np.float32)
+    fill_keys(pixels, key_id, out)
+    return out
+
+class SortKey:
+    """A sort criterion.
+
+    compute takes an (n, m, 3) uint8 array and returns (n, m) keys. Integer
+    keys must be int32 in [0, n_bins); float keys are float32 and n_bins is
+    None. scale is the largest key, so span thresholds given as fractions
+    mean the same for every key. cache_id identifies the key in per-image
+    key caches.
+    """
+
+    def __init__(self, name, compute, n_bins=None, scale=1.0, cache_id=None):
+        self.name = name
+        self.compute = compute
+        self.n_bins = n_bins
+        self.scale = scale
+        self.cache_id = cache_id or name
+
+    @property
+    def integer(self):
+        return self.n_bins is not None
+
+    def __call__(self, pixels):
+        return self.compute(pixels)
+
+    def __repr__(self):
+        return f"SortKey({self.cache_id!r})"
+
+    def quantized(self, levels):
+        """This key mapped onto `levels` integer steps, or itself if it is already integer."""
+        if self.integer:
+            return self
+        return SortKey(self.name, functools.partial(quantized_keys, self, levels),
+                       levels, levels - 1, f"{self.cache_id}@{levels}")
+
+def quantized_keys(sort_key, levels, pixels):
+    keys = sort_key(pixels)
+    out = np.empty(keys.shape, dtype=np.int32)
+    quantize_keys(keys, np.float32(sort_key.scale), levels, out)
+    return out
+
+def builtin(name, key_id, n_bins=None, scale=1.0):
+    return SortKey(name, functools.partial(builtin_keys, key_id=key_id, integer=n_bins is not None),
+                   n_bins, scale)
+
+# Registered keys by name, in the order the GUI lists them
+KEYS = {}
+
+def register_key(sort_key):
+    """Make a SortKey available by name to sort_image, the GUI and the CLI."""
+    KEYS[sort_key.name] = sort_key
+    return sort_key
+
+register_key(builtin('Brightness', BRIGHTNESS, 766, 765))
+register_key(builtin('Hue', HUE))
+register_key(builtin('Saturation', SATURATION))
+# HSL lightness, (max + min) / 2, kept as max + min so it stays an exact integer
+register_key(builtin('Intensity', INTENSITY, 511, 510))
+register_key(builtin('Minimum', MINIMUM, 256, 255))
+register_key(builtin('Luma', LUMA, sum(LUMA_WEIGHTS) * 255 + 1, sum(LUMA_WEIGHTS) * 255))
+register_key(builtin('CIE Lightness', LIGHTNESS, scale=100.0))
+register_key(builtin('Hue + Saturation', HUE_SATURATION, 1 << 24, (1 << 24) - 1))
+
+def composite_keys(parts, pixels):
+    # Negative weights pull keys below zero; start from their total so keys stay in [0, scale]
+    offset = -sum(min(weight, 0.0) for _, weight in parts)
+    keys = np.full(pixels.shape[:2], offset, dtype=np.float32)
+    for sort_key, weight in parts:
+        keys += sort_key(pixels) * np.float32(weight / sort_key.scale)
+    return keys
+
+def composite_key(weights):
+    """A float key blending registered keys, each normalized to [0, 1], by {name: weight}.
+
+    Keys are offset by the total of the negative weights, so they lie in
+    [0, sum of |weight|] like every other key and quantize and threshold the
+    same way.
+    """
+    parts = tuple((KEYS[name], float(weight)) for name, weight in weights.items())
+    cache_id = ','.join(f"{name}={weight:g}" for name, weight in weights.items())
+    scale = sum(abs(weight) for _, weight in parts) or 1.0
+    return SortKey(cache_id, functools.partial(composite_keys, parts), scale=scale, cache_id=cache_id)
+
+def parse_composite(text):
+    """{name: weight} from 'Luma=0.7,Saturation=0.3'."""
+    weights = {}
+    for item in text.split(','):
+        name, sep, weight = item.partition('=')
+        name = name.strip()
+        if not sep or name not in KEYS:
+            raise ValueError(f"Expected name=weight with a known criterion, got {item!r}")
+        weights[name] = float(weight)
+    return weights
+
+def get_sort_key(criterion, key_bits=None):
+    """Resolve a criterion to a SortKey.
+
+    criterion is a SortKey, a registered name or a composite such as
+    'Luma=0.7,Saturation=0.3'; other names fall back to Brightness. key_bits
+    quantizes float keys so they can use the counting sort.
+    """
+    if key_bits is not None and not KEY_BITS_RANGE[0] <= key_bits <= KEY_BITS_RANGE[1]:
+        raise ValueError(f"key_bits must be between {KEY_BITS_RANGE[0]} and {KEY_BITS_RANGE[1]}, got {key_bits}")
+    if isinstance(criterion, SortKey):
+        sort_key = criterion
+    elif criterion in KEYS:
+        sort_key = KEYS[criterion]
+    elif '=' in criterion:
+        sort_key = composite_key(parse_composite(criterion))
+    else:
+        logger.warning(f"Unknown criterion {criterion!r}, sorting by Brightness")
+        sort_key = KEYS['Brightness']
+    if key_bits is not None:
+        sort_key = sort_key.quantized(1 << key_bits)
+    return sort_key
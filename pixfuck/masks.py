@@ -0,0 +1,44 @@
+"""Load masks for sort_image from image files or alpha channels.
+
+Masks are (height, width) uint8 arrays: pixels of at least MASK_THRESHOLD are
+sorted and the rest are left where they are.
+"""
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger('pixfuck.masks')
+
+
+def load_mask(path, size):
+    """A grayscale mask from an image file, resized to size (width, height) if it differs.
+
+    An image with an alpha channel gives its alpha, anything else its luminance.
+    """
+    with Image.open(path) as img:
+        mask = alpha_channel(img)
+        if mask is None:
+            mask = img.convert('L')
+        if mask.size != size:
+            logger.info(f"Resizing mask {path} from {mask.size[0]}x{mask.size[1]} to {size[0]}x{size[1]}")
+            mask = mask.resize(size, Image.Resampling.BILINEAR)
+        return np.asarray(mask)
+
+
+def scaled_mask(mask, size):
+    """A uint8 mask resized to size (width, height), such as for a preview proxy."""
+    return np.asarray(Image.fromarray(mask).resize(size, Image.Resampling.BILINEAR))
+
+
+def alpha_channel(img):
+    """The alpha channel of a PIL image as an 'L' image, or None if it has none."""
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        return img.convert('RGBA').getchannel('A')
+    return None
+
+
+def alpha_mask(img):
+    """The alpha channel of a PIL image as a uint8 mask, or None if it has none."""
+    alpha = alpha_channel(img)
+    return np.asarray(alpha) if alpha is not None else None
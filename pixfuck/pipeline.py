@@ -0,0 +1,189 @@
+"""Run a declarative chain of sorts on one image, each pass feeding the next.
+
+Run from the repository root:
+
+    python -m pixfuck.pipeline photo.jpg -o sorted.png passes.json
+
+A pipeline file is JSON, or YAML when PyYAML is installed, holding a list of
+passes or an object with a "passes" list. Each pass sets any of the
+parameters of sort_image, and the rest take their defaults:
+
+    {"passes": [
+        {"angle": 0, "criterion": "Brightness"},
+        {"angle": 60, "criterion": "Hue", "intensity": 0.8, "seed": 1}
+    ]}
+
+The image is decoded once and every pass sorts between two preallocated
+buffers, reading one and writing the other (see run_pipeline), so a chain
+of any length needs no PIL conversion or new image between passes. The same
+run_pipeline backs the command line, the GUI and pixfuck.cli --pipeline.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from .core import PATTERN_IDS, SHEAR_MODES, check_cancelled, sort_image
+from .decode import decode_image, rgb_array
+from .keys import KEYS, parse_composite
+from .profiling import SortTrace, stage
+
+logger = logging.getLogger('pixfuck.pipeline')
+
+# Parameters of a pass and their defaults
+PASS_DEFAULTS = {
+    'angle': 0.0,
+    'criterion': 'Brightness',
+    'pattern': 'Linear',
+    'intensity': 1.0,
+    'shear_mode': 'exact',
+    'key_bits': None,
+    'seed': None,
+}
+
+
+def parse_pass(entry, seed=None):
+    """A complete pass from a dict of some of PASS_DEFAULTS; raises ValueError if it is invalid.
+
+    seed is used when the entry does not set one.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError(f"Expected a pass as an object of parameters, got {entry!r}")
+    unknown = set(entry) - set(PASS_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown pass parameter(s) {', '.join(sorted(unknown))}; "
+                         f"expected {', '.join(PASS_DEFAULTS)}")
+    parameters = dict(PASS_DEFAULTS, seed=seed)
+    parameters.update(entry)
+    try:
+        parameters['angle'] = float(parameters['angle'])
+        parameters['intensity'] = float(parameters['intensity'])
+    except (TypeError, ValueError):
+        raise ValueError("angle and intensity must be numbers") from None
+    criterion = parameters['criterion']
+    if not isinstance(criterion, str):
+        raise ValueError(f"criterion must be a name or a 'Name=weight,...' composite, got {criterion!r}")
+    if criterion not in KEYS:
+        parse_composite(criterion)
+    if parameters['pattern'] != 'Linear' and parameters['pattern'] not in PATTERN_IDS:
+        raise ValueError(f"Unknown pattern {parameters['pattern']!r}")
+    if parameters['shear_mode'] not in SHEAR_MODES:
+        raise ValueError(f"shear_mode must be one of {', '.join(SHEAR_MODES)}, got {parameters['shear_mode']!r}")
+    if not 0.0 <= parameters['intensity'] <= 1.0:
+        raise ValueError(f"intensity must be between 0 and 1, got {parameters['intensity']}")
+    return parameters
+
+
+def parse_pipeline(data, seed=None):
+    """The passes of a loaded pipeline file: a list of passes or {"passes": [...]}."""
+    if isinstance(data, dict):
+        data = data.get('passes')
+    if not isinstance(data, list) or not data:
+        raise ValueError("A pipeline needs a non-empty list of passes")
+    passes = []
+    for i, entry in enumerate(data):
+        try:
+            passes.append(parse_pass(entry, seed))
+        except ValueError as e:
+            raise ValueError(f"Pass {i + 1}: {e}") from None
+    return passes
+
+
+def load_pipeline(path, seed=None):
+    """Read the passes of a .json, .yaml or .yml pipeline file; YAML needs PyYAML."""
+    with open(path) as f:
+        text = f.read()
+    if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"Reading {path} needs PyYAML (pip install pyyaml); JSON pipelines do not") from None
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+    return parse_pipeline(data, seed)
+
+
+def pass_name(index, parameters):
+    """A stage name such as '2: Hue 60°'."""
+    return f"{index + 1}: {parameters['criterion']} {parameters['angle']:g}\N{DEGREE SIGN}"
+
+
+def run_pipeline(array, passes, mask=None, progress=None, cancel=None, trace=None):
+    """Sort array with each pass in turn; return (result, a SortTrace per pass).
+
+    Passes alternate between two buffers allocated once, each reading the
+    result of the last and writing the other, so the input is never modified
+    and a chain of any length allocates two images at most. The result is
+    one of those buffers. mask applies to every pass. progress receives 0 to
+    100 over the whole pipeline; cancel is checked between and during
+    passes. trace, if given, gets one stage per pass, named by pass_name,
+    and each pass's own stages are in its SortTrace.
+    """
+    buffers = [None, None]
+    source = array
+    pass_traces = []
+    for i, parameters in enumerate(passes):
+        check_cancelled(cancel)
+
+        def pass_progress(value, done=i):
+            if progress is not None:
+                progress(int(100 * (done + value / 100) / len(passes)))
+
+        if buffers[i % 2] is None:
+            buffers[i % 2] = np.empty_like(array)
+        pass_trace = SortTrace('pipeline pass', index=i, **parameters)
+        with stage(trace, pass_name(i, parameters)):
+            source = sort_image(source, parameters['angle'], parameters['criterion'], parameters['pattern'],
+                                parameters['intensity'], progress=pass_progress,
+                                shear_mode=parameters['shear_mode'], key_bits=parameters['key_bits'],
+                                cancel=cancel, seed=parameters['seed'], trace=pass_trace, mask=mask,
+                                out=buffers[i % 2])
+        pass_traces.append(pass_trace)
+        logger.info(f"Pass {pass_name(i, parameters)}: {pass_trace.summary()}")
+    return source, pass_traces
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help="image to sort")
+    parser.add_argument('pipeline', help="JSON or YAML file of passes")
+    parser.add_argument('-o', '--output', required=True, help="file to write the result to")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the passes that do not set their own")
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help="append a JSON line of the pipeline's and each pass's timings to PATH")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    try:
+        passes = load_pipeline(args.pipeline, args.seed)
+    except (OSError, ValueError) as e:
+        logger.error(f"{args.pipeline}: {e}")
+        return 1
+    trace = SortTrace('pipeline', path=args.input, passes=passes)
+    start = time.perf_counter()
+    with stage(trace, 'decode'):
+        array = rgb_array(decode_image(args.input))
+    result, pass_traces = run_pipeline(array, passes, trace=trace)
+    with stage(trace, 'encode'):
+        Image.fromarray(result).save(args.output)
+    for pass_trace in pass_traces:
+        pass_trace.record(args.trace)
+    trace.record(args.trace)
+    for i, parameters in enumerate(passes):
+        print(f"{trace.stages[pass_name(i, parameters)]:8.2f}s  pass {pass_name(i, parameters)}")
+    print(f"{len(passes)} pass(es) in {time.perf_counter() - start:.2f}s -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
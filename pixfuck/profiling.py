@@ -0,0 +1,129 @@
+"""Per-stage timing of sort jobs, and opt-in profiling.
+
+A SortTrace records how long each stage of a job took, plus counters such as
+lines sorted, bytes allocated and time spent in the numba JIT. sort_image
+fills in its own stages when it is given a trace; callers add theirs (decode,
+encode, display) to the same one. When PIXFUCK_TRACE names a file, every
+recorded trace is appended to it as one JSON line.
+
+When PIXFUCK_PROFILE names a directory, every job wrapped in profile_job runs
+under cProfile and its stats are dumped there, for snakeviz or pstats.
+Sampling profilers such as py-spy need no hook: the stages are separate,
+named functions, and `py-spy record --native` also shows the numba kernels.
+"""
+import cProfile
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+from numba.core import event
+
+logger = logging.getLogger('pixfuck.profiling')
+
+# Environment variable naming a JSON-lines file that traces are appended to
+TRACE_ENV = 'PIXFUCK_TRACE'
+
+# Environment variable naming a directory for cProfile dumps
+PROFILE_ENV = 'PIXFUCK_PROFILE'
+
+
+class SortTrace:
+    """Stage timings and counters of one job.
+
+    info holds free-form details of the job, such as its parameters. Stages
+    must not be nested, or their time is counted twice.
+    """
+
+    def __init__(self, job, **info):
+        self.job = job
+        self.info = info
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage, including any JIT compilation it triggers."""
+        start = time.perf_counter()
+        try:
+            with event.install_timer('numba:compile', lambda seconds: self.count('jit_seconds', seconds)):
+                yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def allocated(self, *arrays):
+        """Count the bytes of arrays the job allocated."""
+        self.count('bytes_allocated', sum(array.nbytes for array in arrays))
+
+    @property
+    def total(self):
+        return sum(self.stages.values())
+
+    def summary(self):
+        """One line such as 'keys 0.12s, shear 0.05s, sort 1.31s (total 1.52s)'."""
+        stages = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+        summary = f"{stages} (total {self.total:.2f}s)"
+        if self.counters.get('jit_seconds'):
+            summary += f", JIT {self.counters['jit_seconds']:.2f}s"
+        if self.counters.get('cache_hits'):
+            summary += ", cached"
+        return summary
+
+    def to_dict(self):
+        return {
+            'job': self.job,
+            'started': self.started,
+            'info': self.info,
+            'stages': self.stages,
+            'total': self.total,
+            'counters': self.counters,
+        }
+
+    def record(self, path=None):
+        """Log the summary and append the trace to path, or to PIXFUCK_TRACE if that is set."""
+        logger.debug(f"{self.job}: {self.summary()}")
+        path = path or os.environ.get(TRACE_ENV)
+        if not path:
+            return
+        # One write per line, so processes appending to the same file do not interleave
+        line = json.dumps(self.to_dict(), default=str) + '\n'
+        try:
+            with open(path, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write trace to {path}: {e}")
+
+
+def stage(trace, name):
+    """trace.stage(name), or a no-op when trace is None."""
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+@contextmanager
+def profile_job(name):
+    """Run the block under cProfile if PIXFUCK_PROFILE is set, dumping to <dir>/<name>-<time>.prof."""
+    directory = os.environ.get(PROFILE_ENV)
+    if not directory:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Only one profiler can run at a time, e.g. when a preview overlaps a render
+        logger.warning(f"Not profiling {name}: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(directory, f"{name}-{time.time_ns()}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"Wrote profile to {path}")
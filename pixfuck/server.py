@@ -0,0 +1,491 @@
+"""Local HTTP render service: a bounded job queue in front of a pool of sort processes.
+
+Run from the repository root:
+
+    python -m pixfuck.server --port 8000 --jobs 4
+
+and talk to it with any HTTP client (benchmarks/bench_load.py is one):
+
+    POST   /images                upload an image; returns {"image": id}
+    POST   /jobs?angle=30&...     sort the image in the body, or ?image=id; returns {"id": ...}
+    GET    /jobs/<id>             status and progress (0-100) as JSON
+    GET    /jobs/<id>/events      the same as a text/event-stream, until the job ends
+    GET    /jobs/<id>/result      the sorted image, once the job is done
+    DELETE /jobs/<id>             cancel the job, queued or running
+    GET    /health                queue and pool counters
+
+Job parameters are angle, criterion, pattern, intensity, seed, shear_mode,
+key_bits and format, as for python -m pixfuck. When max_queue jobs are
+already queued or running, new jobs are refused with 503 and a Retry-After
+header rather than queued without bound. Worker processes compile the
+kernels before their first job, report progress back through a queue and
+check a per-job cancel event between chunks, exactly as the GUI worker does.
+Only the standard library is used on top of the engine's own dependencies.
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image
+
+from .cache import CACHE_DIR_ENV, ResultCache, cached_sort, content_hash
+from .cli import LINE_PATTERNS, criterion_type, init_worker
+from .core import PATTERN_IDS, SHEAR_MODES, SortCancelled
+from .decode import rgb_array
+from .keys import KEY_BITS_RANGE
+from .profiling import SortTrace
+
+logger = logging.getLogger('pixfuck.server')
+
+# Jobs queued or running at once before new ones are refused
+DEFAULT_MAX_QUEUE = 16
+
+# Largest request body accepted, in bytes
+MAX_UPLOAD_BYTES = 256 << 20
+
+# Bytes of uploaded images kept for ?image= jobs; the oldest are dropped first
+DEFAULT_IMAGE_BYTES = 1 << 30
+
+# Finished jobs, and their results, kept for polling and download
+MAX_FINISHED_JOBS = 64
+
+# Seconds between event-stream messages when a job's progress has not changed
+EVENT_KEEPALIVE = 15.0
+
+# Output formats a job may ask for, by Pillow format name
+FORMATS = {'png': ('PNG', 'image/png'), 'jpeg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp'),
+           'bmp': ('BMP', 'image/bmp'), 'tiff': ('TIFF', 'image/tiff')}
+
+# States in which a job will not change again
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+# Where worker processes send (job id, progress) messages; set by init_service_worker
+progress_queue = None
+
+
+def init_service_worker(numba_threads, queue):
+    """init_worker, and keep the queue progress is reported on."""
+    global progress_queue
+    progress_queue = queue
+    init_worker(numba_threads)
+
+
+def render_job(job_id, data, parameters, image_format, cancel, cache_dir):
+    """Decode, sort and encode one image in a worker process; return (encoded bytes, cache hit, trace)."""
+    def progress(value):
+        progress_queue.put((job_id, value))
+
+    progress(0)
+    trace = SortTrace('serve', job_id=job_id, **parameters)
+    with trace.stage('decode'):
+        with Image.open(io.BytesIO(data)) as img:
+            array = rgb_array(img)
+    # Workers share only the disk tier; the service keeps no results of its own beyond MAX_FINISHED_JOBS
+    cache = ResultCache(max_bytes=0, directory=cache_dir) if cache_dir else None
+    result, hit = cached_sort(cache, array, progress=progress, cancel=cancel, trace=trace, **parameters)
+    with trace.stage('encode'):
+        output = io.BytesIO()
+        Image.fromarray(result).save(output, FORMATS[image_format][0])
+    trace.record()
+    return output.getvalue(), hit, trace.to_dict()
+
+
+def job_parameters(query):
+    """cached_sort keyword arguments and the output format from a parsed query string.
+
+    Raises ValueError for anything python -m pixfuck would reject.
+    """
+    def value(name, default=None):
+        return query[name][-1] if name in query else default
+
+    parameters = {
+        'angle': float(value('angle', 0.0)),
+        'criterion': criterion_type(value('criterion', 'Brightness')),
+        'pattern': value('pattern', 'Linear'),
+        'intensity': float(value('intensity', 1.0)),
+        'seed': int(value('seed')) if value('seed') is not None else None,
+        'shear_mode': value('shear_mode', 'exact'),
+        'key_bits': int(value('key_bits')) if value('key_bits') is not None else None,
+    }
+    if not math.isfinite(parameters['angle']):
+        raise ValueError("angle must be a finite number of degrees")
+    if parameters['key_bits'] is not None and not KEY_BITS_RANGE[0] <= parameters['key_bits'] <= KEY_BITS_RANGE[1]:
+        raise ValueError(f"key_bits must be between {KEY_BITS_RANGE[0]} and {KEY_BITS_RANGE[1]}")
+    if parameters['seed'] is not None and parameters['seed'] < 0:
+        raise ValueError("seed must not be negative")
+    if parameters['pattern'] not in LINE_PATTERNS + tuple(PATTERN_IDS):
+        raise ValueError(f"Unknown pattern {parameters['pattern']!r}")
+    if not 0.0 <= parameters['intensity'] <= 1.0:
+        raise ValueError("intensity must be between 0 and 1")
+    if parameters['shear_mode'] not in SHEAR_MODES:
+        raise ValueError(f"shear_mode must be one of {', '.join(SHEAR_MODES)}")
+    image_format = value('format', 'png').lower()
+    if image_format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return parameters, image_format
+
+
+class Job:
+    """One sort request and its state; changes are announced on self.changed."""
+
+    def __init__(self, job_id, parameters, image_format, cancel):
+        self.id = job_id
+        self.parameters = parameters
+        self.format = image_format
+        self.cancel_event = cancel
+        self.state = 'queued'
+        self.progress = 0
+        self.error = None
+        self.result = None
+        self.hit = False
+        self.trace = None
+        self.submitted = time.time()
+        self.finished = None
+        self.future = None
+        self.changed = threading.Condition()
+
+    def update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.changed.notify_all()
+
+    def status(self):
+        status = {
+            'id': self.id,
+            'state': self.state,
+            'progress': self.progress,
+            'parameters': self.parameters,
+            'format': self.format,
+            'cached': self.hit,
+        }
+        if self.error:
+            status['error'] = self.error
+        if self.finished is not None:
+            status['seconds'] = self.finished - self.submitted
+        if self.trace is not None:
+            status['stages'] = self.trace['stages']
+        return status
+
+
+class RenderService:
+    """The job table, the process pool and the uploaded images, shared by all request threads."""
+
+    def __init__(self, jobs=os.cpu_count() or 1, max_queue=DEFAULT_MAX_QUEUE, cache_dir=None,
+                 image_bytes=DEFAULT_IMAGE_BYTES):
+        self.max_queue = max_queue
+        self.cache_dir = cache_dir
+        self.image_bytes = image_bytes
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.finished = OrderedDict()
+        self.images = OrderedDict()
+        self.images_size = 0
+        self.counters = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+        # Events and the progress queue must cross into worker processes, so they come from a manager
+        self.manager = multiprocessing.Manager()
+        self.progress_queue = self.manager.Queue()
+        numba_threads = max(1, (os.cpu_count() or 1) // jobs)
+        self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_service_worker,
+                                            initargs=(numba_threads, self.progress_queue))
+        self.n_workers = jobs
+        self.progress_thread = threading.Thread(target=self.read_progress, daemon=True)
+        self.progress_thread.start()
+        logger.info(f"Render service with {jobs} process(es), {numba_threads} thread(s) each, "
+                    f"at most {max_queue} job(s) in flight")
+
+    def read_progress(self):
+        """Move progress messages from the workers onto their jobs until shutdown."""
+        while True:
+            message = self.progress_queue.get()
+            if message is None:
+                return
+            job_id, value = message
+            job = self.jobs.get(job_id)
+            if job is not None and job.state in ('queued', 'running'):
+                job.update(state='running', progress=value)
+
+    def add_image(self, data):
+        """Keep an uploaded image for later jobs; return its id."""
+        image_id = content_hash(np.frombuffer(data, dtype=np.uint8))
+        with self.lock:
+            if image_id in self.images:
+                self.images.move_to_end(image_id)
+                return image_id
+            self.images[image_id] = data
+            self.images_size += len(data)
+            while self.images_size > self.image_bytes and len(self.images) > 1:
+                _, dropped = self.images.popitem(last=False)
+                self.images_size -= len(dropped)
+        return image_id
+
+    def image(self, image_id):
+        with self.lock:
+            return self.images.get(image_id)
+
+    def in_flight(self):
+        return sum(job.state in ('queued', 'running') for job in self.jobs.values())
+
+    def submit(self, data, parameters, image_format):
+        """Queue a job and return it, or None when max_queue jobs are already in flight."""
+        with self.lock:
+            if self.in_flight() >= self.max_queue:
+                self.counters['rejected'] += 1
+                return None
+            job = Job(uuid.uuid4().hex, parameters, image_format, self.manager.Event())
+            self.jobs[job.id] = job
+            self.counters['submitted'] += 1
+        job.future = self.executor.submit(render_job, job.id, data, parameters, image_format, job.cancel_event,
+                                          self.cache_dir)
+        job.future.add_done_callback(lambda future, job=job: self.on_done(job, future))
+        return job
+
+    def on_done(self, job, future):
+        try:
+            result, hit, trace = future.result()
+        except (CancelledError, SortCancelled):
+            job.update(state='cancelled', finished=time.time())
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.update(state='failed', error=str(e), finished=time.time())
+        else:
+            job.update(state='done', progress=100, result=result, hit=hit, trace=trace, finished=time.time())
+        with self.lock:
+            self.counters[job.state] += 1
+            self.finished[job.id] = job
+            while len(self.finished) > MAX_FINISHED_JOBS:
+                dropped, _ = self.finished.popitem(last=False)
+                del self.jobs[dropped]
+
+    def job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        """Cancel a job: a queued one never starts, a running one stops at its next chunk."""
+        if not job.future.cancel():
+            job.cancel_event.set()
+
+    def retry_after(self):
+        """Seconds a refused client should wait, from the mean time of recent jobs."""
+        with self.lock:
+            times = [job.finished - job.submitted for job in self.finished.values() if job.state == 'done']
+        if not times:
+            return 1
+        return max(1, round(sum(times) / len(times) * self.max_queue / self.n_workers))
+
+    def health(self):
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+            return dict(self.counters, queued=states.count('queued'), running=states.count('running'),
+                        workers=self.n_workers, max_queue=self.max_queue, images=len(self.images))
+
+    def shutdown(self):
+        """Cancel everything in flight and stop the pool, the progress thread and the manager."""
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if job.state in ('queued', 'running')]
+        for job in jobs:
+            self.cancel(job)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.progress_queue.put(None)
+        self.progress_thread.join()
+        self.manager.shutdown()
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """HTTP front end of the RenderService in self.server.service."""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, headers=()):
+        self.send_json(status, {'error': message}, headers)
+
+    def read_body(self):
+        """The request body, or None after sending an error for a malformed or oversized one."""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # The body's end is unknown, so the connection cannot be reused
+            self.send_error_json(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer")
+            self.close_connection = True
+            return None
+        if length > MAX_UPLOAD_BYTES:
+            self.send_error_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                 f"Uploads are limited to {MAX_UPLOAD_BYTES >> 20} MB")
+            self.close_connection = True
+            return None
+        return self.rfile.read(length) if length else b''
+
+    def route(self):
+        """(path parts, parsed query) of the request."""
+        url = urlsplit(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def do_GET(self):
+        parts, _ = self.route()
+        if parts == ['health']:
+            self.send_json(HTTPStatus.OK, self.service.health())
+            return
+        if len(parts) < 2 or parts[0] != 'jobs':
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return
+        job = self.service.job(parts[1])
+        if job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"No job {parts[1]}")
+        elif len(parts) == 2:
+            self.send_json(HTTPStatus.OK, job.status())
+        elif parts[2:] == ['events']:
+            self.send_events(job)
+        elif parts[2:] == ['result']:
+            self.send_result(job)
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+
+    def do_POST(self):
+        parts, query = self.route()
+        data = self.read_body()
+        if data is None:
+            return
+        if parts == ['images']:
+            if not data:
+                self.send_error_json(HTTPStatus.BAD_REQUEST, "Empty upload")
+                return
+            self.send_json(HTTPStatus.CREATED, {'image': self.service.add_image(data)})
+            return
+        if parts != ['jobs']:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return
+        try:
+            parameters, image_format = job_parameters(query)
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        if 'image' in query:
+            data = self.service.image(query['image'][-1])
+            if data is None:
+                self.send_error_json(HTTPStatus.NOT_FOUND, "Unknown image; upload it again")
+                return
+        if not data:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, "Send an image as the body or an uploaded ?image= id")
+            return
+        job = self.service.submit(data, parameters, image_format)
+        if job is None:
+            self.send_error_json(HTTPStatus.SERVICE_UNAVAILABLE, "The queue is full, try again later",
+                                 [('Retry-After', str(self.service.retry_after()))])
+            return
+        self.send_json(HTTPStatus.ACCEPTED, job.status(), [('Location', f"/jobs/{job.id}")])
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        job = self.service.job(parts[1]) if len(parts) == 2 and parts[0] == 'jobs' else None
+        if job is None:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "Not found")
+            return
+        self.service.cancel(job)
+        self.send_json(HTTPStatus.ACCEPTED, job.status())
+
+    def send_result(self, job):
+        if job.state != 'done':
+            self.send_error_json(HTTPStatus.CONFLICT, f"Job is {job.state}")
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', FORMATS[job.format][1])
+        self.send_header('Content-Length', str(len(job.result)))
+        self.end_headers()
+        self.wfile.write(job.result)
+
+    def send_events(self, job):
+        """Stream the job's status whenever it changes, until it finishes or the client goes away."""
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        last = None
+        try:
+            while True:
+                with job.changed:
+                    if (job.state, job.progress) == last:
+                        job.changed.wait(EVENT_KEEPALIVE)
+                    status = job.status()
+                last = (status['state'], status['progress'])
+                self.wfile.write(f"data: {json.dumps(status)}\n\n".encode())
+                self.wfile.flush()
+                if status['state'] in FINISHED_STATES:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f"Event stream of job {job.id} closed by the client")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: localhost only)")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes")
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help="jobs queued or running at once before new ones get 503")
+    parser.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV),
+                        help=f"directory of the shared result cache (default: ${CACHE_DIR_ENV})")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.max_queue < 1:
+        parser.error("--max-queue must be at least 1")
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    service = RenderService(args.jobs, args.max_queue, args.cache_dir)
+    server = ThreadingHTTPServer((args.host, args.port), RenderHandler)
+    server.daemon_threads = True
+    server.service = service
+    logger.info(f"Listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
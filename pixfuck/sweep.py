@@ -0,0 +1,225 @@
+"""Render a grid of sort parameters as individual files and a contact sheet.
+
+Run from the repository root:
+
+    python -m pixfuck.sweep photo.jpg -o sweeps --angles 0:165:15 --criteria all --intensities 0.5 0.75 1
+
+Variants share everything they can. The image is decoded once. Keys are
+computed once per criterion and kept for the whole sweep. Angles are the
+outer loop, so line_index is built once per angle while it fits its cache.
+Each (angle, criterion) pair is sorted once at full intensity, and other
+intensities are blended from that result (see pixfuck.core.resorted), so
+they cost a copy and a blend rather than a sort. The sort kernels already
+use every core, so variants are sorted one after another while a thread pool
+thumbnails, encodes and saves the finished ones.
+"""
+import argparse
+import logging
+import math
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .core import PATTERN_IDS, SHEAR_MODES, check_cancelled, sort_image
+from .decode import decode_image, rgb_array
+from .keys import KEYS
+from .profiling import stage
+
+logger = logging.getLogger('pixfuck.sweep')
+
+# Width, in pixels, of each thumbnail on the contact sheet
+DEFAULT_TILE_WIDTH = 256
+
+# Height of the label under each thumbnail
+LABEL_HEIGHT = 16
+
+# Gap between thumbnails
+SHEET_MARGIN = 4
+
+SHEET_BACKGROUND = (24, 24, 24)
+LABEL_COLOR = (220, 220, 220)
+
+
+def parse_angles(values):
+    """Angles from numbers and 'start:stop:step' ranges, stop included."""
+    angles = []
+    for value in values:
+        if ':' in value:
+            start, stop, step = (float(part) for part in value.split(':'))
+            if step <= 0:
+                raise ValueError(f"Angle range step must be positive, got {value!r}")
+            angles.extend(start + i * step for i in range(int(math.floor((stop - start) / step + 1e-9)) + 1))
+        else:
+            angles.append(float(value))
+    return angles
+
+
+def variant_name(angle, criterion, intensity):
+    """A file-name-safe label such as 'a30_Hue_i0.75'."""
+    criterion = re.sub(r'[^\w.-]+', '-', criterion)
+    return f"a{angle:g}_{criterion}_i{intensity:g}"
+
+
+def sweep_variants(array, angles, criteria, intensities, pattern='Linear', seed=0, shear_mode='exact',
+                   key_bits=None, progress=None, cancel=None, trace=None):
+    """Yield (index, angle, criterion, intensity, result) for every variant of the grid.
+
+    Variants come angle by angle, then criterion, then intensity. Each
+    criterion keeps its keys for the whole sweep, and each (angle,
+    criterion) is sorted once: its intensities are blended from that sort
+    through sort_image's resort state, so every variant is exactly what
+    sort_image gives with the same seed. progress receives 0 to 100 over
+    the whole sweep; cancel is checked between and during sorts.
+    """
+    key_caches = {criterion: {} for criterion in criteria}
+    n_sorts = len(angles) * len(criteria)
+    index = 0
+    for i, angle in enumerate(angles):
+        for j, criterion in enumerate(criteria):
+            check_cancelled(cancel)
+            done = i * len(criteria) + j
+
+            def sort_progress(value, done=done):
+                if progress is not None:
+                    progress(int(100 * (done + value / 100) / n_sorts))
+
+            resort = {}
+            for intensity in intensities:
+                result = sort_image(array, angle, criterion, pattern, intensity, progress=sort_progress,
+                                    shear_mode=shear_mode, key_bits=key_bits, cancel=cancel,
+                                    key_cache=key_caches[criterion], seed=seed, trace=trace, resort=resort)
+                yield index, angle, criterion, intensity, result
+                index += 1
+
+
+class ContactSheet:
+    """A grid of labelled thumbnails, filled in as variants finish, in any order."""
+
+    def __init__(self, image_size, n_rows, n_columns, tile_width=DEFAULT_TILE_WIDTH):
+        width, height = image_size
+        self.tile_size = (tile_width, max(1, round(height * tile_width / width)))
+        self.cell = (self.tile_size[0] + SHEET_MARGIN, self.tile_size[1] + LABEL_HEIGHT + SHEET_MARGIN)
+        self.n_columns = n_columns
+        self.image = Image.new('RGB', (SHEET_MARGIN + n_columns * self.cell[0],
+                                       SHEET_MARGIN + n_rows * self.cell[1]), SHEET_BACKGROUND)
+        self.draw = ImageDraw.Draw(self.image)
+
+    def thumbnail(self, array):
+        """A tile-sized copy of a variant; safe to call from worker threads."""
+        return Image.fromarray(array).resize(self.tile_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    def add(self, index, thumbnail, label):
+        row, column = divmod(index, self.n_columns)
+        x = SHEET_MARGIN + column * self.cell[0]
+        y = SHEET_MARGIN + row * self.cell[1]
+        self.image.paste(thumbnail, (x, y))
+        self.draw.text((x, y + self.tile_size[1] + 2), label, fill=LABEL_COLOR)
+
+
+def save_variant(sheet, array, output_path):
+    """Thumbnail and, when output_path is set, save one variant; run on the thread pool."""
+    if output_path:
+        Image.fromarray(array).save(output_path)
+    return sheet.thumbnail(array)
+
+
+def render_sweep(array, output_dir, stem, angles, criteria, intensities, pattern='Linear', seed=0,
+                 shear_mode='exact', key_bits=None, extension='.png', tile_width=DEFAULT_TILE_WIDTH,
+                 save_variants=True, workers=None, progress=None, cancel=None, trace=None):
+    """Render every variant of the grid and a contact sheet; return (sheet path, sheet array).
+
+    The sheet has one row per angle and a column per (criterion, intensity).
+    Variants are saved as <stem>_<variant_name><extension> when
+    save_variants is set. At most twice workers variants wait for the pool
+    at any time, bounding memory for large grids.
+    """
+    workers = workers or min(4, os.cpu_count() or 1)
+    sheet = ContactSheet((array.shape[1], array.shape[0]), len(angles), len(criteria) * len(intensities),
+                         tile_width)
+    pending = deque()
+
+    def collect(entry):
+        future, index, label = entry
+        sheet.add(index, future.result(), label)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, angle, criterion, intensity, result in sweep_variants(
+                array, angles, criteria, intensities, pattern, seed, shear_mode, key_bits, progress, cancel,
+                trace):
+            name = variant_name(angle, criterion, intensity)
+            output_path = os.path.join(output_dir, f"{stem}_{name}{extension}") if save_variants else None
+            label = f"{angle:g}\N{DEGREE SIGN} {criterion} {intensity:.0%}"
+            pending.append((executor.submit(save_variant, sheet, result, output_path), index, label))
+            while len(pending) > 2 * workers:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    sheet_path = os.path.join(output_dir, f"{stem}_sheet.png")
+    with stage(trace, 'encode'):
+        sheet.image.save(sheet_path)
+    logger.info(f"Wrote a {len(angles)}x{len(criteria) * len(intensities)} contact sheet to {sheet_path}")
+    return sheet_path, np.asarray(sheet.image)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help="image to sweep")
+    parser.add_argument('-o', '--output-dir', required=True, help="directory to write the variants and sheet to")
+    parser.add_argument('--angles', nargs='+', default=['0:165:15'],
+                        help="angles in degrees, or start:stop:step ranges with stop included; "
+                             "180 sorts like 0, so half-turn ranges stop a step short of it")
+    parser.add_argument('--criteria', nargs='+', default=['all'],
+                        help="criteria to sweep, or 'all' for every registered one")
+    parser.add_argument('--intensities', type=float, nargs='+', default=[0.5, 0.75, 1.0])
+    parser.add_argument('--pattern', choices=['Linear'] + list(PATTERN_IDS), default='Linear')
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of partial intensity and random spans, so a sweep can be repeated")
+    parser.add_argument('--shear-mode', choices=SHEAR_MODES, default='exact')
+    parser.add_argument('--key-bits', type=int, default=None)
+    parser.add_argument('--format', dest='extension', default='.png', help="format of the variant files")
+    parser.add_argument('--tile-width', type=int, default=DEFAULT_TILE_WIDTH,
+                        help="width of each thumbnail on the contact sheet")
+    parser.add_argument('--sheet-only', action='store_true', help="only write the contact sheet")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="threads encoding finished variants")
+    args = parser.parse_args(argv)
+    try:
+        args.angles = parse_angles(args.angles)
+    except ValueError as e:
+        parser.error(f"--angles: {e}")
+    if args.criteria == ['all']:
+        args.criteria = list(KEYS)
+    if not all(0.0 <= intensity <= 1.0 for intensity in args.intensities):
+        parser.error("--intensities must be between 0 and 1")
+    if args.tile_width < 16:
+        parser.error("--tile-width must be at least 16")
+    if not args.extension.startswith('.'):
+        args.extension = '.' + args.extension
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    array = rgb_array(decode_image(args.input))
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+    n_variants = len(args.angles) * len(args.criteria) * len(args.intensities)
+    logger.info(f"Rendering {n_variants} variant(s) of {args.input}")
+    sheet_path, _ = render_sweep(array, args.output_dir, stem, args.angles, args.criteria, args.intensities,
+                                 args.pattern, args.seed, args.shear_mode, args.key_bits, args.extension,
+                                 args.tile_width, not args.sheet_only, args.jobs)
+    elapsed = time.perf_counter() - start
+    print(f"{n_variants} variant(s) in {elapsed:.2f}s ({elapsed / n_variants:.2f}s each) -> {sheet_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Out-of-core sorting for images too large to hold several copies of in memory.
+
+The image is decoded into a numpy.memmap scratch file and sorted a strip of
+lines at a time: each strip is gathered from the scratch file in sheared
+order, sorted and scattered straight into the output with the same kernels
+as sort_image, so the sheared image is never materialized. For vertical
+sorts the scratch file is written transposed, so that a column of the image
+is a contiguous row on disk.
+
+Only the exact integer shear is supported; it is what makes gathering lines
+strip by strip possible. With the same rng or seed, the result is identical
+to sort_image(..., shear_mode='exact') as long as the random draws fall in
+the same order, which is always the case without partial intensity or
+random spans.
+
+The memory budget bounds the sort's own working arrays, the strips and
+their keys, not the whole job: PIL holds the decoded image once while it is
+copied into the scratch file, and any output other than .npy is encoded
+from the whole result in memory. Peak memory is therefore about one image
+plus the budget, against several images for sort_image.
+"""
+import logging
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from .core import (KERNEL_LOCK, check_cancelled, gather_lines, scatter_lines, seeded_rng, shear_offsets,
+                   shear_parameters, sort_chunk, sort_settings)
+
+logger = logging.getLogger('pixfuck.tiled')
+
+# Default memory for the strips of a sort, in bytes
+DEFAULT_MEMORY_BUDGET = 1 << 30
+
+# Bytes held per pixel of a strip: the strip itself, its unsorted copy for
+# partial intensity and room for the per-thread key and index arrays
+STRIP_BYTES_PER_PIXEL = 3 * 2 + 16
+
+
+def strip_lines(length, memory_budget):
+    """Number of lines of the given length that fit in the memory budget."""
+    return max(1, memory_budget // (length * STRIP_BYTES_PER_PIXEL))
+
+
+def scratch_memmap(scratch_dir, shape):
+    """A uint8 memmap backed by an anonymous temporary file, removed once it is closed."""
+    return np.memmap(tempfile.TemporaryFile(dir=scratch_dir), dtype=np.uint8, mode='w+', shape=shape)
+
+
+def decode_to_memmap(path, scratch_dir, transposed, memory_budget):
+    """Decode an image into a uint8 RGB memmap, transposed to (width, height, 3) if asked.
+
+    PIL still holds the decoded image once while it is copied out; mode
+    conversion is done a strip at a time so no second full copy is made.
+
+    PIL's decompression bomb limit, Image.MAX_IMAGE_PIXELS, is a process-wide
+    setting that PIL offers no per-call override for. It is lifted while the
+    file is opened, so an image opened on another thread at the same moment
+    is not checked either. Only the batch renderer calls this, from worker
+    processes that decode one image at a time; do not call it from the GUI
+    or the render service.
+    """
+    # PIL's decompression bomb guard rejects exactly the images this mode is for
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        img = Image.open(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+    with img:
+        width, height = img.size
+        shape = (width, height, 3) if transposed else (height, width, 3)
+        layout = scratch_memmap(scratch_dir, shape)
+        rows = strip_lines(width, memory_budget)
+        for top in range(0, height, rows):
+            bottom = min(top + rows, height)
+            strip = img.crop((0, top, width, bottom))
+            if strip.mode != 'RGB':
+                strip = strip.convert('RGB')
+            strip = np.asarray(strip)
+            if transposed:
+                layout[:, top:bottom] = strip.swapaxes(0, 1)
+            else:
+                layout[top:bottom] = strip
+    return layout
+
+
+def sort_layout(layout, out, angle, criterion, pattern, intensity, rng=None, progress=None,
+                key_bits=None, memory_budget=DEFAULT_MEMORY_BUDGET, transposed=False, cancel=None, seed=None):
+    """Sort a (possibly memory-mapped) image strip by strip into out.
+
+    layout holds the source image, as (height, width, 3), or as its transpose
+    when transposed is True. out is a (height, width, 3) uint8 array and may
+    be a memmap; it must not be layout itself. cancel is checked between
+    strips, and rng and seed are used, as in sort_image.
+    """
+    sort_key, pattern_id = sort_settings(criterion, pattern, key_bits)
+    rng = seeded_rng(rng, seed)
+    shape = (layout.shape[1], layout.shape[0]) if transposed else layout.shape[:2]
+    shear_factor, sort_axis = shear_parameters(angle)
+    if (sort_axis == 0) != transposed:
+        raise ValueError("Vertical sorts need a transposed layout and horizontal sorts a plain one")
+    offsets = shear_offsets(shape, shear_factor, sort_axis)
+
+    src = np.asarray(layout)
+    dst = np.asarray(out)
+    n_lines, length = src.shape[:2]
+    rows = min(n_lines, strip_lines(length, memory_budget))
+    logger.debug(f"Sorting {n_lines} lines of {length} pixels in strips of {rows}")
+    lines = np.empty((rows, length, 3), dtype=np.uint8)
+    for start in range(0, n_lines, rows):
+        check_cancelled(cancel)
+        strip = lines[:min(rows, n_lines - start)]
+        # One strip at a time, so sorts on other threads can interleave (see KERNEL_LOCK)
+        with KERNEL_LOCK:
+            # The layout is already transposed for vertical sorts, so lines are its rows either way
+            gather_lines(src, offsets, start, strip, False)
+            sort_chunk(strip, sort_key(strip), sort_key, pattern_id, intensity, rng)
+            scatter_lines(strip, offsets, start, dst, transposed)
+        if progress is not None:
+            progress(int(((start + strip.shape[0]) / n_lines) * 100))
+    return out
+
+
+def sort_file(path, output_path, angle, criterion, pattern, intensity, rng=None, progress=None,
+              key_bits=None, memory_budget=DEFAULT_MEMORY_BUDGET, scratch_dir=None, cancel=None, seed=None):
+    """Sort an image file out of core and save the result to output_path.
+
+    A .npy output_path is written as a memory-mapped array and never held in
+    memory; any other format is encoded by PIL, which needs the whole result
+    in memory once.
+    """
+    transposed = shear_parameters(angle)[1] == 0
+    logger.info(f"Decoding {path} into a {'transposed ' if transposed else ''}scratch file")
+    layout = decode_to_memmap(path, scratch_dir, transposed, memory_budget)
+    shape = (layout.shape[1], layout.shape[0], 3) if transposed else layout.shape
+    npy_output = os.path.splitext(output_path)[1].lower() == '.npy'
+    if npy_output:
+        out = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.uint8, shape=shape)
+    else:
+        out = scratch_memmap(scratch_dir, shape)
+    sort_layout(layout, out, angle, criterion, pattern, intensity, rng, progress,
+                key_bits, memory_budget, transposed, cancel, seed)
+    del layout
+    if npy_output:
+        out.flush()
+    else:
+        Image.fromarray(np.asarray(out)).save(output_path)
+    return output_path
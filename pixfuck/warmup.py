@@ -0,0 +1,75 @@
+"""Compile every numba kernel before the first real sort.
+
+Kernels are compiled with cache=True, so after the first run in an
+environment warm_up mostly loads machine code from __pycache__ (or
+NUMBA_CACHE_DIR) instead of compiling. Calling it at startup, off the critical
+path, makes the first sort as fast as the tenth.
+
+The GUI runs it as `python -m pixfuck.warmup` in a child process: that fills
+the numba cache without starting parallel regions on a background thread of
+the GUI process itself, whose threads then keep it from exiting.
+"""
+import logging
+import sys
+import time
+
+import numpy as np
+
+from .core import compiled_signatures, sort_image
+from .tiled import sort_layout
+
+logger = logging.getLogger('pixfuck.warmup')
+
+# Angles that reach every kernel: no shear and a column shift for horizontal
+# sorts, no shear and a row shift for vertical ones
+WARM_UP_ANGLES = (0, 30, 90, 60)
+
+# Criteria that reach the float and the integer key and line kernels
+WARM_UP_CRITERIA = ('Hue', 'Brightness')
+
+
+def warm_up():
+    """Compile or load every kernel signature sort_image and pixfuck.tiled use.
+
+    Returns the seconds spent, which is almost all JIT time since the arrays
+    are tiny.
+    """
+    started = time.perf_counter()
+    signatures = compiled_signatures()
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    # np.asarray on a PIL image is read-only, which numba compiles separately
+    read_only = image.copy()
+    read_only.flags.writeable = False
+    mask = rng.random(image.shape[:2]) < 0.5
+    for array in (image, read_only):
+        for angle in WARM_UP_ANGLES:
+            for criterion in WARM_UP_CRITERIA:
+                sort_image(array, angle, criterion, 'Linear', 0.5, rng)
+            sort_image(array, angle, 'Hue', 'Linear', 1.0, rng, key_bits=8)
+            sort_image(array, angle, 'Hue', 'Threshold', 0.5, rng)
+            for criterion in WARM_UP_CRITERIA:
+                sort_image(array, angle, criterion, 'Linear', 0.5, rng, shear_mode='lines')
+            sort_image(array, angle, 'Hue', 'Threshold', 1.0, rng, shear_mode='lines')
+            for shear_mode in ('exact', 'lines'):
+                for criterion in WARM_UP_CRITERIA:
+                    sort_image(array, angle, criterion, 'Linear', 0.5, rng, shear_mode=shear_mode, mask=mask)
+    transposed = np.ascontiguousarray(image.swapaxes(0, 1))
+    for layout, angle in ((image, 30), (transposed, 60)):
+        sort_layout(layout, np.empty_like(image), angle, 'Hue', 'Linear', 0.5, rng,
+                    transposed=layout is transposed)
+    seconds = time.perf_counter() - started
+    logger.info(f"JIT warm-up took {seconds:.2f}s for {compiled_signatures() - signatures} "
+                f"new kernel signature(s) (compiled or loaded from the numba cache)")
+    return seconds
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    warm_up()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
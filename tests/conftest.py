@@ -0,0 +1,10 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def random_image():
+    """A factory of seeded random RGB images, 37 by 53 unless told otherwise."""
+    def make(height=37, width=53, seed=0):
+        return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return make
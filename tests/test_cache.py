@@ -0,0 +1,62 @@
+import numpy as np
+
+from pixfuck.cache import ResultCache, cached_sort
+from pixfuck.core import sort_image
+
+
+def test_hit_equals_a_fresh_sort(random_image):
+    cache = ResultCache()
+    array = random_image()
+    fresh = sort_image(array, 30, 'Hue', 'Linear', 0.5, seed=2)
+    _, hit = cached_sort(cache, array, 30, 'Hue', 'Linear', 0.5, seed=2)
+    assert not hit
+    result, hit = cached_sort(cache, array, 30, 'Hue', 'Linear', 0.5, seed=2)
+    assert hit and np.array_equal(result, fresh)
+
+
+def test_other_settings_miss(random_image):
+    cache = ResultCache()
+    array = random_image()
+    cached_sort(cache, array, 30, 'Hue', 'Linear', 1.0)
+    for angle, criterion, intensity in ((31, 'Hue', 1.0), (30, 'Luma', 1.0), (30, 'Hue', 0.9)):
+        _, hit = cached_sort(cache, array, angle, criterion, 'Linear', intensity, seed=0)
+        assert not hit
+
+
+def test_unseeded_partial_intensity_is_not_cached(random_image):
+    cache = ResultCache()
+    array = random_image()
+    cached_sort(cache, array, 30, 'Hue', 'Linear', 0.5)
+    _, hit = cached_sort(cache, array, 30, 'Hue', 'Linear', 0.5)
+    assert not hit
+
+
+def test_disk_tier_is_shared_between_caches(random_image, tmp_path):
+    array = random_image()
+    fresh, _ = cached_sort(ResultCache(directory=str(tmp_path)), array, 30, 'Hue', 'Linear', 1.0)
+    result, hit = cached_sort(ResultCache(directory=str(tmp_path)), array, 30, 'Hue', 'Linear', 1.0)
+    assert hit and np.array_equal(result, fresh)
+
+
+def test_memory_tier_evicts_the_least_recent(random_image):
+    array = random_image()
+    cache = ResultCache(max_bytes=2 * array.nbytes)
+    for angle in (10, 20, 30):
+        cached_sort(cache, array, angle, 'Hue', 'Linear', 1.0)
+    assert cache.size <= 2 * array.nbytes
+    assert not cached_sort(cache, array, 10, 'Hue', 'Linear', 1.0)[1]
+    assert cached_sort(cache, array, 30, 'Hue', 'Linear', 1.0)[1]
+
+
+def test_out_stays_writable_and_is_filled_on_a_hit(random_image):
+    cache = ResultCache()
+    array = random_image()
+    first = np.empty_like(array)
+    result, hit = cached_sort(cache, array, 30, 'Hue', 'Linear', 1.0, out=first)
+    assert not hit and result is first and first.flags.writeable
+    second = np.zeros_like(array)
+    result, hit = cached_sort(cache, array, 30, 'Hue', 'Linear', 1.0, out=second)
+    assert hit and result is second
+    assert np.array_equal(second, first)
+    # A later sort may reuse the buffer
+    sort_image(random_image(seed=1), 60, 'Hue', 'Linear', 1.0, out=first)
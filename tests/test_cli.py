@@ -0,0 +1,14 @@
+import pytest
+
+from pixfuck.cli import parse_args
+
+
+@pytest.mark.parametrize('option', ['--angle', '--angle-end', '--fps'])
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf', 'steep'])
+def test_non_finite_numbers_are_rejected(option, value):
+    with pytest.raises(SystemExit):
+        parse_args(['in.png', '-o', 'out', f'{option}={value}'])
+
+
+def test_finite_angle_is_accepted():
+    assert parse_args(['in.png', '-o', 'out', '--angle', '-30.5']).angle == -30.5
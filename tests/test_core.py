@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pixfuck import core
+from pixfuck.core import line_index, shear_parameters, sort_image
+
+
+def packed_pixels(array):
+    """The pixels of an RGB array as sorted uint32s, equal for any two permutations of it."""
+    pixels = array.reshape(-1, 3).astype(np.uint32)
+    return np.sort(pixels[:, 0] << 16 | pixels[:, 1] << 8 | pixels[:, 2])
+
+
+@pytest.mark.parametrize('shear_mode', ['exact', 'lines'])
+@pytest.mark.parametrize('angle', [0, 30, 90, 135])
+def test_masked_sorts_only_move_selected_pixels(random_image, angle, shear_mode):
+    array = random_image()
+    mask = np.zeros(array.shape[:2], dtype=np.bool_)
+    mask[5:20, 10:40] = True
+    result = sort_image(array, angle, 'Hue', 'Linear', 1.0, shear_mode=shear_mode, mask=mask)
+    assert np.array_equal(result[~mask], array[~mask])
+    assert np.array_equal(packed_pixels(result[mask][np.newaxis]), packed_pixels(array[mask][np.newaxis]))
+
+
+@pytest.mark.parametrize('shear_mode', ['exact', 'lines'])
+def test_angle_sweep_stays_in_bounds(random_image, shear_mode):
+    array = random_image()
+    for angle in range(0, 181, 5):
+        result = sort_image(array, angle, 'Hue', 'Linear', 1.0, shear_mode=shear_mode)
+        assert np.array_equal(packed_pixels(result), packed_pixels(array)), angle
+
+
+@pytest.mark.parametrize('pattern', ['Linear', 'Threshold', 'Edges', 'Random Spans'])
+@pytest.mark.parametrize('criterion', ['Brightness', 'Hue', 'Luma=0.7,Saturation=0.3'])
+def test_sorts_are_permutations(random_image, criterion, pattern):
+    array = random_image()
+    result = sort_image(array, 30, criterion, pattern, 1.0, seed=1)
+    assert np.array_equal(packed_pixels(result), packed_pixels(array))
+
+
+def test_sorted_rows_are_ordered_by_key(random_image):
+    array = random_image()
+    result = sort_image(array, 0, 'Brightness', 'Linear', 1.0)
+    brightness = result.astype(np.int32).sum(axis=2)
+    assert np.all(np.diff(brightness, axis=1) >= 0)
+
+
+def test_input_is_not_modified(random_image):
+    array = random_image()
+    before = array.copy()
+    sort_image(array, 30, 'Hue', 'Linear', 0.5, seed=1)
+    assert np.array_equal(array, before)
+
+
+def test_sorts_on_several_threads_take_turns(random_image):
+    array = random_image(64, 96)
+    expected = sort_image(array, 30, 'Hue', 'Linear', 1.0)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda angle: sort_image(array, angle, 'Hue', 'Linear', 1.0), [30] * 8))
+    for result in results:
+        assert np.array_equal(result, expected)
+
+
+def test_same_seed_gives_the_same_result(random_image):
+    array = random_image()
+    first = sort_image(array, 30, 'Hue', 'Linear', 0.5, seed=7)
+    second = sort_image(array, 30, 'Hue', 'Linear', 0.5, seed=7)
+    assert np.array_equal(first, second)
+
+
+@pytest.mark.parametrize('angle', [-90, -45, 0, 30, 45, 60, 90, 135, 150, 179, 180, 225, 270, 359])
+def test_shear_factor_is_at_most_one(angle):
+    shear_factor, sort_axis = shear_parameters(angle)
+    assert abs(shear_factor) <= 1.0
+    assert sort_axis in (0, 1)
+
+
+@pytest.mark.parametrize('angle', [0, 45, 90, 135, 179])
+def test_angle_and_opposite_angle_are_the_same_line(angle):
+    assert shear_parameters(angle) == pytest.approx(shear_parameters(angle + 180))
+
+
+@pytest.mark.parametrize('shape', [(37, 53), (53, 37), (1, 9), (9, 1)])
+@pytest.mark.parametrize('angle', [0, 30, 45, 60, 90, 135, 179, 180])
+def test_line_index_covers_every_pixel_once(shape, angle):
+    starts, index = line_index(*shape, *shear_parameters(angle))
+    assert np.all(np.diff(starts) >= 0)
+    assert starts[-1] == shape[0] * shape[1]
+    assert np.array_equal(np.sort(index), np.arange(shape[0] * shape[1]))
+
+
+
+def test_line_index_cache_stays_within_its_budget(monkeypatch):
+    monkeypatch.setattr(core, 'line_indexes', OrderedDict())
+    monkeypatch.setattr(core, 'line_indexes_bytes', 0)
+    # Room for two 37 x 53 indexes, but not three
+    monkeypatch.setattr(core, 'LINE_INDEX_CACHE_BYTES', 2 * (37 * 53 * 4 + 80 * 8))
+    first = line_index(37, 53, *shear_parameters(10))
+    assert line_index(37, 53, *shear_parameters(10)) is first
+    for angle in (20, 30):
+        line_index(37, 53, *shear_parameters(angle))
+    assert core.line_indexes_bytes <= core.LINE_INDEX_CACHE_BYTES
+    assert line_index(37, 53, *shear_parameters(10)) is not first
+    # An index larger than the whole budget is built but not kept
+    line_index(200, 200, *shear_parameters(10))
+    assert (200, 200, *shear_parameters(10)) not in core.line_indexes
+
+@pytest.mark.parametrize('shear_mode', ['exact', 'lines'])
+@pytest.mark.parametrize('angle', [90, 135, 179, 180])
+def test_steep_angles_sort_a_permutation(random_image, angle, shear_mode):
+    array = random_image()
+    result = sort_image(array, angle, 'Brightness', 'Linear', 1.0, shear_mode=shear_mode)
+    assert result.shape == array.shape
+    assert np.array_equal(packed_pixels(result), packed_pixels(array))
+
+
+@pytest.mark.parametrize('shear_mode', ['exact', 'lines'])
+def test_180_degrees_sorts_rows_like_0_degrees(random_image, shear_mode):
+    array = random_image()
+    at_0 = sort_image(array, 0, 'Brightness', 'Linear', 1.0, shear_mode=shear_mode)
+    at_180 = sort_image(array, 180, 'Brightness', 'Linear', 1.0, shear_mode=shear_mode)
+    # Rows hold the same pixels either way; the direction along them may differ
+    for row_0, row_180 in zip(at_0, at_180):
+        assert np.array_equal(packed_pixels(row_0[np.newaxis]), packed_pixels(row_180[np.newaxis]))
+    assert np.array_equal(at_0, at_180) or np.array_equal(at_0, at_180[:, ::-1])
+
+
+@pytest.mark.parametrize('shear_mode', ['exact', 'lines'])
+def test_resort_equals_a_fresh_sort(random_image, shear_mode):
+    array = random_image()
+    resort, key_cache = {}, {}
+    for intensity in (1.0, 0.5, 0.8, 1.0, 0.3):
+        resorted = sort_image(array, 30, 'Hue', 'Linear', intensity, shear_mode=shear_mode, seed=3,
+                              key_cache=key_cache, resort=resort)
+        fresh = sort_image(array, 30, 'Hue', 'Linear', intensity, shear_mode=shear_mode, seed=3)
+        assert np.array_equal(resorted, fresh), intensity
+
+
+def test_resort_follows_a_change_of_angle(random_image):
+    array = random_image()
+    resort = {}
+    sort_image(array, 30, 'Hue', 'Linear', 0.5, seed=3, resort=resort)
+    resorted = sort_image(array, 60, 'Hue', 'Linear', 0.5, seed=3, resort=resort)
+    assert np.array_equal(resorted, sort_image(array, 60, 'Hue', 'Linear', 0.5, seed=3))
+
+
+def test_out_receives_the_result(random_image):
+    array = random_image()
+    out = np.empty_like(array)
+    result = sort_image(array, 30, 'Hue', 'Linear', 1.0, out=out)
+    assert result is out
+    assert np.array_equal(out, sort_image(array, 30, 'Hue', 'Linear', 1.0))
+    with pytest.raises(ValueError):
+        sort_image(array, 30, 'Hue', 'Linear', 1.0, out=array)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from pixfuck.keys import KEYS, get_sort_key, parse_composite
+
+
+@pytest.mark.parametrize('name', list(KEYS))
+def test_builtin_keys_are_in_range(random_image, name):
+    sort_key = KEYS[name]
+    keys = sort_key(random_image())
+    assert keys.shape == (37, 53)
+    if sort_key.integer:
+        assert keys.dtype == np.int32
+        assert keys.min() >= 0 and keys.max() < sort_key.n_bins
+    else:
+        assert keys.dtype == np.float32
+        assert keys.min() >= 0 and keys.max() <= sort_key.scale
+
+
+def test_composite_key_is_the_normalized_weighted_sum(random_image):
+    pixels = random_image()
+    composite = get_sort_key('Luma=0.7,Saturation=0.3')
+    luma, saturation = KEYS['Luma'], KEYS['Saturation']
+    expected = 0.7 * luma(pixels) / luma.scale + 0.3 * saturation(pixels) / saturation.scale
+    assert np.allclose(composite(pixels), expected, atol=1e-5)
+    assert composite.cache_id == 'Luma=0.7,Saturation=0.3'
+
+
+def test_single_part_composite_orders_like_its_key(random_image):
+    pixels = random_image()
+    composite = get_sort_key('Brightness=1')(pixels).ravel()
+    brightness = KEYS['Brightness'](pixels).ravel()
+    assert np.array_equal(np.argsort(composite, kind='stable'), np.argsort(brightness, kind='stable'))
+
+
+@pytest.mark.parametrize('text', ['Luma', 'Nope=1', 'Luma=heavy'])
+def test_parse_composite_rejects_malformed_text(text):
+    with pytest.raises(ValueError):
+        parse_composite(text)
+
+
+def test_quantized_keys_fit_their_bits(random_image):
+    sort_key = get_sort_key('Hue', key_bits=10)
+    keys = sort_key(random_image())
+    assert sort_key.integer and keys.min() >= 0 and keys.max() < 1 << 10
+    with pytest.raises(ValueError):
+        get_sort_key('Hue', key_bits=40)
+
+
+@pytest.mark.parametrize('text', ['Luma=-1', 'Luma=0.7,Hue=-0.3'])
+def test_negative_weight_composites_stay_in_range(random_image, text):
+    pixels = random_image()
+    composite = get_sort_key(text)
+    keys = composite(pixels)
+    assert keys.min() >= -1e-5 and keys.max() <= composite.scale + 1e-5
+    quantized = get_sort_key(text, key_bits=8)(pixels)
+    assert quantized.min() >= 0 and quantized.max() < 1 << 8
+    assert len(np.unique(quantized)) > 1
+
+
+def test_negative_weight_reverses_the_order(random_image):
+    pixels = random_image()
+    luma = KEYS['Luma'](pixels).ravel()
+    for key_bits in (None, 16):
+        negated = get_sort_key('Luma=-1', key_bits)(pixels).ravel()
+        # Quantizing may merge neighbours, but never swaps them
+        assert np.all(np.diff(negated[np.argsort(luma, kind='stable')]) <= 0)
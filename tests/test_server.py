@@ -0,0 +1,128 @@
+import argparse
+import http.client
+import io
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pixfuck.core import sort_image
+from pixfuck.server import RenderHandler, RenderService, job_parameters
+
+
+def query(**values):
+    return {name: [str(value)] for name, value in values.items()}
+
+
+def test_job_parameters_defaults():
+    parameters, image_format = job_parameters({})
+    assert parameters['angle'] == 0.0 and parameters['key_bits'] is None
+    assert image_format == 'png'
+
+
+@pytest.mark.parametrize('values', [
+    {'key_bits': 40},
+    {'key_bits': 4},
+    {'key_bits': 'many'},
+    {'angle': 'nan'},
+    {'angle': 'inf'},
+    {'intensity': 1.5},
+    {'intensity': 'nan'},
+    {'seed': -1},
+    {'shear_mode': 'diagonal'},
+    {'pattern': 'Spiral'},
+    {'criterion': 'Nope=1'},
+])
+def test_job_parameters_rejects_invalid_values(values):
+    # The handler answers both with 400
+    with pytest.raises((ValueError, argparse.ArgumentTypeError)):
+        job_parameters(query(**values))
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    """A render service with one worker and room for one job, on a free local port."""
+    service = RenderService(jobs=1, max_queue=1)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RenderHandler)
+    server.daemon_threads = True
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+
+def request(url, method='GET', data=None):
+    """(status, headers, body); error statuses are returned, not raised."""
+    try:
+        with urlopen(Request(url, data=data, method=method)) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def png_bytes(array):
+    output = io.BytesIO()
+    Image.fromarray(array).save(output, 'PNG')
+    return output.getvalue()
+
+
+def wait_for(url, job_id, timeout=120):
+    """Poll a job until it leaves the queue; return its final status."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = json.loads(request(f"{url}/jobs/{job_id}")[2])
+        if status['state'] not in ('queued', 'running'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_full_queue_answers_503_with_retry_after(server_url):
+    # Large enough that the first job is still in flight when the second arrives
+    data = png_bytes(np.random.default_rng(0).integers(0, 256, (1500, 2000, 3), dtype=np.uint8))
+    status, _, body = request(f"{server_url}/jobs?angle=30&criterion=Hue", 'POST', data)
+    assert status == 202
+    job_id = json.loads(body)['id']
+    status, headers, _ = request(f"{server_url}/jobs?angle=60&criterion=Hue", 'POST', data)
+    assert status == 503
+    assert int(headers['Retry-After']) >= 1
+    request(f"{server_url}/jobs/{job_id}", 'DELETE')
+    wait_for(server_url, job_id)
+
+
+def test_invalid_parameters_answer_400(server_url):
+    status, _, _ = request(f"{server_url}/jobs?key_bits=40", 'POST', b'not read')
+    assert status == 400
+
+
+
+@pytest.mark.parametrize('length', ['many', '-1'])
+def test_malformed_content_length_answers_400(server_url, length):
+    url = urlsplit(server_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    connection.putrequest('POST', '/jobs')
+    connection.putheader('Content-Length', length)
+    connection.endheaders()
+    assert connection.getresponse().status == 400
+    connection.close()
+
+def test_result_equals_sort_image(server_url):
+    array = np.random.default_rng(1).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+    status, _, body = request(f"{server_url}/jobs?angle=30&criterion=Hue", 'POST', png_bytes(array))
+    assert status == 202
+    job_id = json.loads(body)['id']
+    assert wait_for(server_url, job_id)['state'] == 'done'
+    status, _, body = request(f"{server_url}/jobs/{job_id}/result")
+    assert status == 200
+    result = np.asarray(Image.open(io.BytesIO(body)))
+    assert np.array_equal(result, sort_image(array, 30, 'Hue', 'Linear', 1.0))
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from pixfuck.core import shear_parameters, sort_image
+from pixfuck.tiled import sort_file, sort_layout
+
+
+@pytest.mark.parametrize('criterion', ['Brightness', 'Hue'])
+@pytest.mark.parametrize('angle', [0, 30, 60, 90, 135, 180])
+def test_tiled_equals_sort_image(random_image, angle, criterion):
+    array = random_image()
+    transposed = shear_parameters(angle)[1] == 0
+    layout = np.ascontiguousarray(array.swapaxes(0, 1)) if transposed else array
+    out = np.empty_like(array)
+    # A tiny budget forces many strips
+    sort_layout(layout, out, angle, criterion, 'Linear', 1.0, memory_budget=4096, transposed=transposed)
+    assert np.array_equal(out, sort_image(array, angle, criterion, 'Linear', 1.0, shear_mode='exact'))
+
+
+def test_sort_file_equals_sort_image(random_image, tmp_path):
+    array = random_image()
+    Image.fromarray(array).save(tmp_path / 'in.png')
+    sort_file(str(tmp_path / 'in.png'), str(tmp_path / 'out.npy'), 30, 'Hue', 'Linear', 1.0,
+              memory_budget=4096, scratch_dir=str(tmp_path))
+    assert np.array_equal(np.load(tmp_path / 'out.npy'), sort_image(array, 30, 'Hue', 'Linear', 1.0))
+
+
+def test_layout_must_match_the_sort_axis(random_image):
+    array = random_image()
+    with pytest.raises(ValueError):
+        sort_layout(array, np.empty_like(array), 90, 'Hue', 'Linear', 1.0, transposed=False)
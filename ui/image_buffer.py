@@ -0,0 +1,87 @@
+import numpy as np
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImage, QPixmap
+from PIL import Image
+from pixfuck.cache import content_hash
+
+# Number of scaled pixmaps kept per image; resizing only ever needs the latest few
+SCALED_CACHE_SIZE = 4
+
+class ImageBuffer:
+    """A contiguous (height, width, 3) uint8 RGB array shared by NumPy, Qt and PIL.
+
+    The sort engine reads and writes the array, the QImage wraps the same
+    memory without copying, and the full-size QPixmap and its scaled versions
+    are converted once and cached, so redisplaying never reconverts the
+    source. A PIL image is only made on demand, for saving. key_cache holds
+    the sort keys of recent criteria, so re-sorting at another angle skips
+    computing them, and resort holds the last full-intensity sort, so an
+    intensity-only change just re-blends it. content_hash identifies the
+    pixels for the result cache. mask is an optional (height, width) uint8 mask for sort_image, such as
+    the image's alpha channel.
+    """
+
+    def __init__(self, array, mask=None):
+        if array.dtype != np.uint8 or array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError(f"Expected a (height, width, 3) uint8 array, got {array.dtype} {array.shape}")
+        self.array = np.ascontiguousarray(array)
+        self._qimage = None
+        self._pixmap = None
+        self._scaled = {}
+        self.key_cache = {}
+        self.resort = {}
+        self._content_hash = None
+        self.mask = mask
+
+    @classmethod
+    def from_pil(cls, image):
+        """Copy a PIL image into a new buffer, converting it to RGB if needed."""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cls(np.asarray(image))
+
+    @property
+    def size(self):
+        """(width, height), like PIL's Image.size."""
+        height, width = self.array.shape[:2]
+        return width, height
+
+    def content_hash(self):
+        """Hash of the pixels, computed on first use."""
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.array)
+        return self._content_hash
+
+    def to_pil(self):
+        """A PIL copy of the pixels; PIL keeps RGB at 4 bytes per pixel so it cannot share them."""
+        return Image.fromarray(self.array)
+
+    def qimage(self):
+        """A QImage over the array's memory; valid for as long as this buffer is alive."""
+        if self._qimage is None:
+            width, height = self.size
+            self._qimage = QImage(self.array.data, width, height, width * 3, QImage.Format.Format_RGB888)
+        return self._qimage
+
+    def pixmap(self):
+        """The full-size QPixmap, converted on first use. Must be called from the GUI thread."""
+        if self._pixmap is None:
+            self._pixmap = QPixmap.fromImage(self.qimage())
+        return self._pixmap
+
+    def scaled_pixmap(self, width, height):
+        """The pixmap smoothly scaled to fit width x height, cached per size."""
+        key = (width, height)
+        scaled = self._scaled.pop(key, None)
+        if scaled is None:
+            scaled = self.pixmap().scaled(
+                width,
+                height,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation
+            )
+            if len(self._scaled) >= SCALED_CACHE_SIZE:
+                # Dicts keep insertion order and hits are re-inserted, so the first key is the least recent
+                del self._scaled[next(iter(self._scaled))]
+        self._scaled[key] = scaled
+        return scaled
@@ -0,0 +1,86 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+from .worker import PixelSortWorker
+from .logger import get_logger
+
+class SortJobManager(QObject):
+    """Runs one PixelSortWorker at a time; submitting a new job cancels the one in flight.
+
+    Only the current job's signals are forwarded; finished carries the
+    sorted image, its parameters and the job's SortTrace. Superseded workers are
+    cancelled and kept alive until their thread returns, so Qt never destroys
+    a running QThread.
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object, object, object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        self.logger = get_logger(name)
+        self.current = None
+        self.abandoned = []
+
+    def is_running(self):
+        return self.current is not None
+
+    def submit(self, image, parameters, **kwargs):
+        """Cancel any job in flight and sort image with (angle, criterion, pattern, intensity)."""
+        self.abandon_current()
+        worker = PixelSortWorker(image, *parameters, **kwargs)
+        worker.progress.connect(lambda value, worker=worker: self.on_progress(worker, value))
+        worker.finished.connect(lambda image, worker=worker, parameters=parameters:
+                                self.on_finished(worker, image, parameters))
+        worker.error.connect(lambda message, worker=worker: self.on_error(worker, message))
+        worker.cancelled.connect(lambda worker=worker: self.on_cancelled(worker))
+        self.current = worker
+        worker.start()
+
+    def cancel(self):
+        """Cancel the job in flight, if any, and emit cancelled."""
+        if self.abandon_current():
+            self.cancelled.emit()
+
+    def abandon_current(self):
+        """Cancel the job in flight without a signal; its result will be discarded."""
+        if self.current is None:
+            return False
+        self.logger.info("Cancelling in-flight sort")
+        self.current.cancel()
+        self.abandoned.append(self.current)
+        self.current = None
+        return True
+
+    def shutdown(self):
+        """Cancel everything and block until every worker thread has returned."""
+        self.abandon_current()
+        for worker in self.abandoned:
+            worker.wait()
+        self.abandoned = []
+
+    def release(self, worker):
+        """Forget a worker whose run() is returning; True if it was the current job."""
+        # The terminal signal is the last thing run() does, so this wait is brief
+        worker.wait()
+        if worker is self.current:
+            self.current = None
+            return True
+        if worker in self.abandoned:
+            self.abandoned.remove(worker)
+        return False
+
+    def on_progress(self, worker, value):
+        if worker is self.current:
+            self.progress.emit(value)
+
+    def on_finished(self, worker, image, parameters):
+        if self.release(worker):
+            self.finished.emit(image, parameters, worker.trace)
+
+    def on_error(self, worker, message):
+        if self.release(worker):
+            self.error.emit(message)
+
+    def on_cancelled(self, worker):
+        # Only abandoned workers are cancelled, and cancel() already reported it
+        self.release(worker)
@@ -1,13 +1,26 @@
 import os
 import psutil
 from PyQt6.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QLabel, QSpinBox, QProgressDialog
-from PyQt6.QtGui import QPixmap, QImage
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6 import uic
-from PIL import Image, UnidentifiedImageError
-from .worker import PixelSortWorker
+from pixfuck.cache import ResultCache
+from pixfuck.masks import load_mask, scaled_mask
+from pixfuck.pipeline import load_pipeline
+from .jobs import SortJobManager
+from .sweep_dialog import SweepDialog
+from .worker import LoadWorker, PipelineWorker, SweepWorker, WarmUpWorker
 from .logger import get_logger
 
+# Longest side, in pixels, of the proxy image the live preview sorts
+PREVIEW_MAX_SIZE = 800
+
+# Parameter changes closer together than this many milliseconds trigger a single preview
+PREVIEW_DEBOUNCE_MS = 150
+
+# Previews use a fixed seed so partial intensity does not flicker between steps,
+# and full renders use the same one so the saved image matches the preview
+PREVIEW_SEED = 0
+
 class PixelSortApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -20,9 +33,40 @@ class PixelSortApp(QMainWindow):
         # Initialize variables to hold images
         self.original_image = None
         self.sorted_image = None
+        # Parameters sorted_image was rendered with
+        self.sorted_parameters = None
+        # Downsampled copy of original_image for the live preview, and the
+        # image currently shown in sorted_label (a preview or sorted_image)
+        self.preview_source = None
+        self.displayed_sorted = None
+        # The last pipeline result, which no single sort's parameters describe
+        self.pipeline_image = None
+        # The LoadWorker decoding the latest file picked, its progress dialog,
+        # and superseded loads kept alive until their thread returns
+        self.load_worker = None
+        self.load_progress = None
+        self.abandoned_loads = []
+        # Path of the loaded image, and the SweepWorker rendering a contact sheet of it
+        self.image_path = None
+        self.sweep_worker = None
+        # The PipelineWorker running a chain of passes on it
+        self.pipeline_worker = None
+
+        # Full-resolution and preview renders; a new job on either supersedes
+        # the one in flight
+        self.sort_jobs = SortJobManager('SortJobs', self)
+        self.preview_jobs = SortJobManager('PreviewJobs', self)
+        # Where to save once the full-resolution render finishes
+        self.pending_save_path = None
+        # Finished renders, so returning to earlier settings is instant; set
+        # PIXFUCK_CACHE_DIR to keep them on disk as well
+        self.result_cache = ResultCache.from_environment()
 
-        # Initialize worker thread
-        self.worker = None
+        # Restarted on every parameter change; a preview starts once it fires
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self.start_preview)
 
         # Set up image labels
         self.original_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -32,17 +76,37 @@ class PixelSortApp(QMainWindow):
 
         # Connect signals
         self.setup_connections()
+
+        # Compile the sort kernels while the user picks an image
+        self.warm_up_worker = WarmUpWorker()
+        self.warm_up_worker.start()
         self.logger.info("PixelSortApp initialization complete")
 
     def setup_connections(self):
         self.logger.debug("Setting up signal connections")
         self.load_button.clicked.connect(self.load_image)
         self.save_button.clicked.connect(self.save_image)
+        self.load_mask_button.clicked.connect(self.load_mask)
+        self.mask_check.toggled.connect(self.on_mask_changed)
         self.sort_button.clicked.connect(self.sort_pixels)
+        self.sweep_button.clicked.connect(self.start_sweep)
+        self.pipeline_button.clicked.connect(self.start_pipeline)
+        self.cancel_button.clicked.connect(self.cancel_sort)
+        self.sort_jobs.progress.connect(self.update_progress)
+        self.sort_jobs.finished.connect(self.on_sort_finished)
+        self.sort_jobs.error.connect(self.on_sort_error)
+        self.sort_jobs.cancelled.connect(self.on_sort_cancelled)
+        self.preview_jobs.finished.connect(self.on_preview_finished)
+        self.preview_jobs.error.connect(self.on_preview_error)
         self.angle_slider.valueChanged.connect(self.update_angle_spinbox)
         self.intensity_slider.valueChanged.connect(self.update_intensity_spinbox)
         self.angle_value_label.valueChanged.connect(self.update_angle_slider)
         self.intensity_value_label.valueChanged.connect(self.update_intensity_slider)
+        # The spinboxes update the sliders, so these cover every parameter change
+        self.angle_slider.valueChanged.connect(self.schedule_preview)
+        self.intensity_slider.valueChanged.connect(self.schedule_preview)
+        self.criteria_combo.currentIndexChanged.connect(self.schedule_preview)
+        self.pattern_combo.currentIndexChanged.connect(self.schedule_preview)
 
     def update_intensity_spinbox(self, value):
         self.logger.debug(f"Updating intensity spinbox to {value}%")
@@ -60,30 +124,24 @@ class PixelSortApp(QMainWindow):
         self.logger.debug(f"Updating angle slider to {value}°")
         self.angle_slider.setValue(value)
 
-    def validate_image_size(self, image_path):
-        """Validate if the image size is within acceptable limits."""
-        try:
-            with Image.open(image_path) as img:
-                width, height = img.size
-                # Calculate approximate memory usage (3 bytes per pixel for RGB)
-                memory_usage = width * height * 3
-                # Get available system memory
-                available_memory = psutil.virtual_memory().available
-                
-                # Check if image is too large (more than 50% of available memory)
-                if memory_usage > available_memory * 0.5:
-                    return False, f"Image is too large ({width}x{height}). Please use a smaller image."
-                
-                # Check if dimensions are too large
-                if width > 10000 or height > 10000:
-                    return False, f"Image dimensions ({width}x{height}) exceed maximum allowed size (10000x10000)."
-                
-                return True, None
-        except Exception as e:
-            return False, f"Error validating image: {str(e)}"
+    def check_image_size(self, width, height):
+        """Raise ValueError if an image of this size is too large to load; called with its header."""
+        # Calculate approximate memory usage (3 bytes per pixel for RGB)
+        memory_usage = width * height * 3
+        # Get available system memory
+        available_memory = psutil.virtual_memory().available
+
+        # Check if image is too large (more than 50% of available memory)
+        if memory_usage > available_memory * 0.5:
+            raise ValueError(f"Image is too large ({width}x{height}). Please use a smaller image.")
+
+        # Check if dimensions are too large
+        if width > 10000 or height > 10000:
+            raise ValueError(f"Image dimensions ({width}x{height}) exceed maximum allowed size (10000x10000).\n"
+                             "Larger images can be sorted out of core with: python -m pixfuck --max-memory")
 
     def load_image(self):
-        """Load an image with enhanced error handling and validation."""
+        """Pick an image and decode it on a LoadWorker, showing its real progress."""
         self.logger.info("Opening file dialog to load image")
         options = QFileDialog.Option.DontUseNativeDialog
         file_name, _ = QFileDialog.getOpenFileName(
@@ -95,113 +153,179 @@ class PixelSortApp(QMainWindow):
         if not file_name:
             return
 
-        try:
-            # Validate file exists and is readable
-            if not os.path.isfile(file_name):
-                raise FileNotFoundError(f"File not found: {file_name}")
-            
-            if not os.access(file_name, os.R_OK):
-                raise PermissionError(f"Cannot read file: {file_name}")
+        # Validate file exists and is readable
+        if not os.path.isfile(file_name):
+            self.logger.error(f"File not found: {file_name}")
+            QMessageBox.critical(self, "Error", f"File not found: {file_name}")
+            return
+        if not os.access(file_name, os.R_OK):
+            self.logger.error(f"Cannot read file: {file_name}")
+            QMessageBox.critical(self, "Error", f"Cannot read file: {file_name}")
+            return
 
-            # Validate image size and memory requirements
-            is_valid, error_msg = self.validate_image_size(file_name)
-            if not is_valid:
-                QMessageBox.critical(self, "Error", error_msg)
-                return
+        # A new load supersedes one in flight
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+            self.abandoned_loads.append(self.load_worker)
+            self.end_load()
 
-            # Show loading progress dialog
-            progress = QProgressDialog("Loading image...", None, 0, 100, self)
-            progress.setWindowModality(Qt.WindowModality.WindowModal)
-            progress.setWindowTitle("Loading")
-            progress.setMinimumDuration(0)
-            progress.setValue(0)
-            progress.show()
+        self.logger.info(f"Loading image from: {file_name}")
+        self.load_progress = QProgressDialog("Loading image...", "Cancel", 0, 100, self)
+        self.load_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.load_progress.setWindowTitle("Loading")
+        self.load_progress.setMinimumDuration(0)
+        self.load_progress.setValue(0)
 
-            self.logger.info(f"Loading image from: {file_name}")
-            
-            # Load image with progress updates
-            with Image.open(file_name) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    image = img.convert('RGB')
-                else:
-                    image = img.copy()
-            progress.setValue(30)
-            
-            # Store the original image
-            self.original_image = image
-            progress.setValue(60)
-            
-            # Display the image
-            self.display_image(image, self.original_label)
-            progress.setValue(90)
-            
-            # Reset UI state
-            self.sorted_label.clear()
-            self.sorted_label.setText("Sorted Image")
-            self.sort_button.setEnabled(True)
-            self.save_button.setEnabled(False)
-            self.progress_bar.setValue(0)
-            
-            progress.setValue(100)
-            self.logger.info("Image loaded successfully")
-            
-        except UnidentifiedImageError:
-            self.logger.error(f"Invalid image format: {file_name}")
-            QMessageBox.critical(self, "Error", "The selected file is not a valid image format.")
-        except FileNotFoundError as e:
-            self.logger.error(str(e))
-            QMessageBox.critical(self, "Error", str(e))
-        except PermissionError as e:
-            self.logger.error(str(e))
-            QMessageBox.critical(self, "Error", str(e))
-        except MemoryError:
-            self.logger.error("Not enough memory to load the image")
-            QMessageBox.critical(self, "Error", "Not enough memory to load the image. Please try a smaller image.")
+        # The header is checked against the size limits before any pixels are decoded
+        worker = LoadWorker(file_name, PREVIEW_MAX_SIZE, self.check_image_size)
+        worker.progress.connect(lambda value, worker=worker: self.on_load_progress(worker, value))
+        worker.draft.connect(lambda draft, worker=worker: self.on_load_draft(worker, draft))
+        worker.finished.connect(lambda original, preview, trace, worker=worker:
+                                self.on_load_finished(worker, original, preview, trace))
+        worker.error.connect(lambda message, worker=worker: self.on_load_error(worker, message))
+        worker.cancelled.connect(lambda worker=worker: self.on_load_cancelled(worker))
+        self.load_progress.canceled.connect(worker.cancel)
+        self.load_worker = worker
+        worker.start()
+
+    def on_load_progress(self, worker, value):
+        if worker is self.load_worker:
+            self.load_progress.setValue(value)
+
+    def on_load_draft(self, worker, draft):
+        """Show a reduced JPEG decode in the original panel until the full image is ready."""
+        if worker is self.load_worker:
+            self.display_image(draft, self.original_label)
+
+    def on_load_finished(self, worker, original, preview, trace):
+        if not self.release_load(worker):
+            return
+
+        # Renders of the previous image are no longer wanted
+        self.sort_jobs.cancel()
+        self.preview_jobs.cancel()
+
+        # Store the original image and a small proxy for previews
+        self.image_path = worker.path
+        self.original_image = original
+        self.preview_source = preview
+        self.sorted_image = None
+        self.sorted_parameters = None
+        self.displayed_sorted = None
+        self.pipeline_image = None
+
+        # Display the image
+        with trace.stage('display'):
+            self.display_image(original, self.original_label)
+
+        # Reset UI state
+        self.sorted_label.clear()
+        self.sorted_label.setText("Sorted Image")
+        self.sort_button.setEnabled(True)
+        self.sweep_button.setEnabled(self.sweep_worker is None)
+        self.pipeline_button.setEnabled(self.pipeline_worker is None)
+        self.save_button.setEnabled(False)
+        self.load_mask_button.setEnabled(True)
+        self.mask_check.setEnabled(original.mask is not None)
+        self.mask_check.setChecked(original.mask is not None)
+        self.progress_bar.setValue(0)
+        self.schedule_preview()
+
+        self.logger.info("Image loaded successfully")
+        self.show_trace("Loaded", trace)
+
+    def on_load_error(self, worker, message):
+        if self.release_load(worker):
+            self.restore_original()
+            QMessageBox.critical(self, "Error", message)
+
+    def on_load_cancelled(self, worker):
+        if self.release_load(worker):
+            self.restore_original()
+
+    def release_load(self, worker):
+        """Forget a LoadWorker whose run() is returning; True if it was the current load."""
+        # The terminal signal is the last thing run() does, so this wait is brief
+        worker.wait()
+        if worker is self.load_worker:
+            self.end_load()
+            return True
+        if worker in self.abandoned_loads:
+            self.abandoned_loads.remove(worker)
+        return False
+
+    def end_load(self):
+        self.load_worker = None
+        self.load_progress.close()
+
+    def restore_original(self):
+        """Replace a draft left in the original panel by the image that is still loaded."""
+        if self.original_image is not None:
+            self.display_image(self.original_image, self.original_label)
+        else:
+            self.original_label.clear()
+
+    def load_mask(self):
+        """Load a grayscale or alpha image as the mask of the current image."""
+        options = QFileDialog.Option.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(
+            self, "Open Mask File", "",
+            "Images (*.png *.xpm *.jpg *.jpeg *.bmp *.gif);;All Files (*)",
+            options=options
+        )
+        if not file_name or self.original_image is None:
+            return
+        try:
+            mask = load_mask(file_name, self.original_image.size)
         except Exception as e:
-            self.logger.error(f"Failed to load image: {str(e)}", exc_info=True)
-            QMessageBox.critical(self, "Error", f"Failed to load image:\n{str(e)}")
-        finally:
-            if 'progress' in locals():
-                progress.close()
+            self.logger.error(f"Failed to load mask: {str(e)}", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Failed to load mask:\n{str(e)}")
+            return
+        self.logger.info(f"Loaded mask from: {file_name}")
+        self.original_image.mask = mask
+        self.preview_source.mask = scaled_mask(mask, self.preview_source.size)
+        self.mask_check.setEnabled(True)
+        if self.mask_check.isChecked():
+            self.on_mask_changed()
+        else:
+            self.mask_check.setChecked(True)
+
+    def on_mask_changed(self, *args):
+        """A different mask makes the full-resolution render stale, finished or not."""
+        # sort_parameters() does not include the mask, so a render in flight would be taken as current
+        self.sort_jobs.cancel()
+        self.sorted_image = None
+        self.sorted_parameters = None
+        self.schedule_preview()
+
+    def sort_mask(self, image):
+        """The mask to sort image with, or None when masking is off."""
+        return image.mask if self.mask_check.isChecked() else None
 
     def display_image(self, image, label):
-        """Display an image in a label while maintaining aspect ratio."""
+        """Display an ImageBuffer in a label while maintaining aspect ratio.
+
+        The scaled pixmap is cached on the buffer, so redisplaying at a size
+        seen before does no conversion or scaling at all.
+        """
         self.logger.debug(f"Displaying image of size {image.size}")
         try:
-            # Convert PIL Image to QImage
-            qimage = self.pil_to_qimage(image)
-            if qimage.isNull():
-                self.logger.error("Failed to convert PIL image to QImage")
-                return
-
-            # Create pixmap from QImage
-            pixmap = QPixmap.fromImage(qimage)
-            if pixmap.isNull():
-                self.logger.error("Failed to create QPixmap from QImage")
-                return
-
             # Get label size
             label_size = label.size()
+            width, height = image.size
             
             # Calculate scaling factors
-            w_scale = label_size.width() / pixmap.width()
-            h_scale = label_size.height() / pixmap.height()
+            w_scale = label_size.width() / width
+            h_scale = label_size.height() / height
             
             # Use the smaller scale to maintain aspect ratio
             scale = min(w_scale, h_scale)
             
-            # Calculate new dimensions
-            new_width = int(pixmap.width() * scale)
-            new_height = int(pixmap.height() * scale)
-            
             # Scale the pixmap
-            scaled_pixmap = pixmap.scaled(
-                new_width,
-                new_height,
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
+            scaled_pixmap = image.scaled_pixmap(int(width * scale), int(height * scale))
+            if scaled_pixmap.isNull():
+                self.logger.error("Failed to create QPixmap from image buffer")
+                return
             
             # Center the pixmap in the label
             label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -210,42 +334,49 @@ class PixelSortApp(QMainWindow):
         except Exception as e:
             self.logger.error(f"Error displaying image: {str(e)}", exc_info=True)
 
-    def pil_to_qimage(self, image):
-        """Convert PIL Image to QImage with proper format handling."""
-        self.logger.debug("Converting PIL image to QImage")
-        try:
-            # Ensure image is in RGB mode
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Get image data
-            data = image.tobytes("raw", "RGB")
-            
-            # Create QImage with proper format
-            qimage = QImage(
-                data,
-                image.width,
-                image.height,
-                image.width * 3,  # stride
-                QImage.Format.Format_RGB888
-            )
-            
-            # Create a deep copy to ensure data ownership
-            return qimage.copy()
-            
-        except Exception as e:
-            self.logger.error(f"Error converting PIL image to QImage: {str(e)}", exc_info=True)
-            return QImage()
-
     def resizeEvent(self, event):
         self.logger.debug("Window resize event triggered")
         # Refresh images on window resize
-        if self.original_image:
+        if self.original_image is not None:
             self.display_image(self.original_image, self.original_label)
-        if self.sorted_image:
-            self.display_image(self.sorted_image, self.sorted_label)
+        if self.displayed_sorted is not None:
+            self.display_image(self.displayed_sorted, self.sorted_label)
         super().resizeEvent(event)
 
+    def sort_parameters(self):
+        """Current (angle, criterion, pattern, intensity) from the controls."""
+        return (
+            self.angle_slider.value(),
+            self.criteria_combo.currentText(),
+            self.pattern_combo.currentText(),
+            self.intensity_slider.value() / 100.0,
+        )
+
+    def schedule_preview(self, *args):
+        """Restart the debounce timer; the preview runs once the controls settle."""
+        if self.preview_source is not None:
+            self.preview_timer.start()
+
+    def start_preview(self):
+        """Sort the proxy image with the current parameters, superseding any running preview."""
+        parameters = self.sort_parameters()
+        self.logger.debug(f"Starting preview with {parameters}")
+        self.preview_jobs.submit(self.preview_source, parameters, seed=PREVIEW_SEED,
+                                 cache=self.result_cache, mask=self.sort_mask(self.preview_source))
+
+    def on_preview_finished(self, preview_image, parameters, trace):
+        # The full-resolution render wins over a preview of the same parameters
+        if parameters == self.sorted_parameters:
+            return
+        self.displayed_sorted = preview_image
+        with trace.stage('display'):
+            self.display_image(preview_image, self.sorted_label)
+        self.save_button.setEnabled(not self.sort_jobs.is_running())
+        self.show_trace("Preview", trace)
+
+    def on_preview_error(self, error_message):
+        self.logger.warning(f"Preview error: {error_message}")
+
     def sort_pixels(self):
         if self.original_image is None:
             self.logger.warning("Attempted to sort pixels without loading an image")
@@ -253,42 +384,205 @@ class PixelSortApp(QMainWindow):
             return
 
         self.logger.info("Starting pixel sorting operation")
-        # Disable buttons to prevent multiple operations
-        self.sort_button.setEnabled(False)
+        # Sorting again supersedes a render in flight; saving waits for it
         self.save_button.setEnabled(False)
-
-        # Get sorting parameters
-        angle = self.angle_slider.value()
-        criterion = self.criteria_combo.currentText()
-        pattern = self.pattern_combo.currentText()
-        intensity = self.intensity_slider.value() / 100.0
+        self.cancel_button.setEnabled(True)
+        self.progress_bar.setValue(0)
 
         # Start the worker thread
-        self.worker = PixelSortWorker(self.original_image, angle, criterion, pattern, intensity)
-        self.worker.progress.connect(self.update_progress)
-        self.worker.finished.connect(self.on_sort_finished)
-        self.worker.error.connect(self.on_sort_error)
-        self.worker.start()
+        self.sort_jobs.submit(self.original_image, self.sort_parameters(), seed=PREVIEW_SEED,
+                              cache=self.result_cache, mask=self.sort_mask(self.original_image))
+
+    def cancel_sort(self):
+        self.sort_jobs.cancel()
+        if self.sweep_worker is not None:
+            self.sweep_worker.cancel()
+        if self.pipeline_worker is not None:
+            self.pipeline_worker.cancel()
+
+    def start_sweep(self):
+        """Ask for a parameter grid and render it as a contact sheet on a SweepWorker."""
+        if self.original_image is None or self.sweep_worker is not None:
+            return
+        criteria = [self.criteria_combo.itemText(i) for i in range(self.criteria_combo.count())]
+        dialog = SweepDialog(criteria, self.criteria_combo.currentText(), self)
+        if not dialog.exec():
+            return
+        angles, criteria, intensities, output_dir, save_variants = dialog.parameters()
+        stem = os.path.splitext(os.path.basename(self.image_path))[0]
+        self.logger.info(f"Starting sweep of {len(angles)} angle(s), {len(criteria)} criteria and "
+                         f"{len(intensities)} intensities")
+        worker = SweepWorker(self.original_image, stem, output_dir, angles, criteria, intensities,
+                             self.pattern_combo.currentText(), save_variants=save_variants)
+        worker.progress.connect(self.update_progress)
+        worker.finished.connect(self.on_sweep_finished)
+        worker.error.connect(self.on_sweep_error)
+        worker.cancelled.connect(self.on_sweep_cancelled)
+        self.sweep_worker = worker
+        self.sweep_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.progress_bar.setValue(0)
+        worker.start()
+
+    def end_sweep(self):
+        """Forget the sweep worker once its run() is returning."""
+        # The terminal signal is the last thing run() does, so this wait is brief
+        self.sweep_worker.wait()
+        self.sweep_worker = None
+        self.sweep_button.setEnabled(self.original_image is not None)
+        self.cancel_button.setEnabled(self.sort_jobs.is_running() or self.pipeline_worker is not None)
+
+    def on_sweep_finished(self, sheet, sheet_path, trace):
+        self.end_sweep()
+        self.displayed_sorted = sheet
+        with trace.stage('display'):
+            self.display_image(sheet, self.sorted_label)
+        self.progress_bar.setValue(100)
+        trace.record()
+        self.statusBar().showMessage(f"Sweep saved to {sheet_path}: {trace.summary()}")
+
+    def on_sweep_error(self, error_message):
+        self.end_sweep()
+        self.logger.error(f"Sweep error: {error_message}")
+        QMessageBox.critical(self, "Error", f"An error occurred during the sweep:\n{error_message}")
+        self.progress_bar.setValue(0)
+
+    def on_sweep_cancelled(self):
+        self.end_sweep()
+        self.logger.info("Sweep cancelled")
+        self.progress_bar.setValue(0)
+
+    def start_pipeline(self):
+        """Pick a pipeline file and run its passes on the full-resolution image on a PipelineWorker."""
+        if self.original_image is None or self.pipeline_worker is not None:
+            return
+        options = QFileDialog.Option.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(
+            self, "Open Pipeline File", "",
+            "Pipelines (*.json *.yaml *.yml);;All Files (*)",
+            options=options
+        )
+        if not file_name:
+            return
+        try:
+            passes = load_pipeline(file_name)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Failed to load pipeline: {str(e)}")
+            QMessageBox.critical(self, "Error", f"Failed to load pipeline:\n{str(e)}")
+            return
+        self.logger.info(f"Starting pipeline of {len(passes)} pass(es) from {file_name}")
+        worker = PipelineWorker(self.original_image, passes, self.sort_mask(self.original_image), file_name)
+        worker.progress.connect(self.update_progress)
+        worker.finished.connect(self.on_pipeline_finished)
+        worker.error.connect(self.on_pipeline_error)
+        worker.cancelled.connect(self.on_pipeline_cancelled)
+        self.pipeline_worker = worker
+        self.pipeline_button.setEnabled(False)
+        self.save_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.progress_bar.setValue(0)
+        worker.start()
+
+    def end_pipeline(self):
+        """Forget the pipeline worker once its run() is returning."""
+        # The terminal signal is the last thing run() does, so this wait is brief
+        self.pipeline_worker.wait()
+        self.pipeline_worker = None
+        self.pipeline_button.setEnabled(self.original_image is not None)
+        self.cancel_button.setEnabled(self.sort_jobs.is_running() or self.sweep_worker is not None)
+
+    def on_pipeline_finished(self, result, trace):
+        source = self.pipeline_worker.image
+        self.end_pipeline()
+        if source is not self.original_image:
+            # Another image was loaded while the passes ran
+            return
+        # A pipeline result is not a sort with the current parameters, so it is
+        # kept apart and the single-sort state starts over
+        self.pipeline_image = result
+        self.sorted_image = None
+        self.sorted_parameters = None
+        self.displayed_sorted = result
+        with trace.stage('display'):
+            self.display_image(result, self.sorted_label)
+        self.progress_bar.setValue(100)
+        self.save_button.setEnabled(True)
+        self.show_trace("Pipeline", trace)
+
+    def on_pipeline_error(self, error_message):
+        self.end_pipeline()
+        self.logger.error(f"Pipeline error: {error_message}")
+        QMessageBox.critical(self, "Error", f"An error occurred during the pipeline:\n{error_message}")
+        self.save_button.setEnabled(self.displayed_sorted is not None)
+        self.progress_bar.setValue(0)
+
+    def on_pipeline_cancelled(self):
+        self.end_pipeline()
+        self.logger.info("Pipeline cancelled")
+        self.save_button.setEnabled(self.displayed_sorted is not None)
+        self.progress_bar.setValue(0)
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
 
-    def on_sort_finished(self, sorted_image):
+    def on_sort_finished(self, sorted_image, parameters, trace):
         self.logger.info("Sorting finished, displaying result")
         self.sorted_image = sorted_image
-        self.display_image(sorted_image, self.sorted_label)
-        self.sort_button.setEnabled(True)
+        self.sorted_parameters = parameters
+        self.displayed_sorted = sorted_image
+        with trace.stage('display'):
+            self.display_image(sorted_image, self.sorted_label)
+        self.show_trace("Sorted", trace)
+        self.cancel_button.setEnabled(False)
         self.save_button.setEnabled(True)
-        self.worker = None
+        if self.pending_save_path:
+            file_name, self.pending_save_path = self.pending_save_path, None
+            self.write_image(file_name)
+
+    def show_trace(self, label, trace):
+        """Record a job's trace and show its stage breakdown in the status bar."""
+        trace.record()
+        self.statusBar().showMessage(f"{label}: {trace.summary()}")
 
     def on_sort_error(self, error_message):
         self.logger.error(f"Sorting error: {error_message}")
         QMessageBox.critical(self, "Error", f"An error occurred during sorting:\n{error_message}")
-        self.sort_button.setEnabled(True)
-        self.worker = None
+        self.reset_sort_controls()
+
+    def on_sort_cancelled(self):
+        self.logger.info("Sorting cancelled")
+        self.reset_sort_controls()
+
+    def reset_sort_controls(self):
+        """Return the sort controls to idle after a render that produced nothing."""
+        self.cancel_button.setEnabled(False)
+        self.save_button.setEnabled(self.displayed_sorted is not None)
+        self.progress_bar.setValue(0)
+        self.pending_save_path = None
+
+    def closeEvent(self, event):
+        self.logger.info("Window closing, stopping sort jobs")
+        self.preview_timer.stop()
+        self.sort_jobs.shutdown()
+        self.preview_jobs.shutdown()
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+            self.abandoned_loads.append(self.load_worker)
+        for worker in self.abandoned_loads:
+            worker.wait()
+        if self.sweep_worker is not None:
+            self.sweep_worker.cancel()
+            self.sweep_worker.wait()
+        if self.pipeline_worker is not None:
+            self.pipeline_worker.cancel()
+            self.pipeline_worker.wait()
+        # The cache is only written once compilation finishes, so an unfinished warm-up has nothing to keep
+        self.warm_up_worker.stop()
+        self.warm_up_worker.wait()
+        super().closeEvent(event)
 
     def save_image(self):
-        if self.sorted_image is None:
+        if self.displayed_sorted is None:
             QMessageBox.warning(self, "Warning", "No sorted image to save.")
             return
         options = QFileDialog.Option.DontUseNativeDialog
@@ -297,11 +591,27 @@ class PixelSortApp(QMainWindow):
             "PNG Image (*.png);;JPEG Image (*.jpg);;BMP Image (*.bmp);;All Files (*)",
             options=options
         )
-        if file_name:
-            try:
-                self.logger.info(f"Saving image to: {file_name}")
-                self.sorted_image.save(file_name)
-                self.logger.info("Image saved successfully")
-            except Exception as e:
-                self.logger.error(f"Failed to save image: {str(e)}", exc_info=True)
-                QMessageBox.critical(self, "Error", f"Failed to save image:\n{e}") 
\ No newline at end of file
+        if not file_name:
+            return
+        if self.pipeline_image is not None and self.displayed_sorted is self.pipeline_image:
+            self.write_image(file_name, self.pipeline_image)
+            return
+        if self.sorted_image is None or self.sorted_parameters != self.sort_parameters():
+            # Only a preview has been rendered for these parameters; render at
+            # full resolution first and save when it finishes
+            self.logger.info("Rendering full resolution before saving")
+            self.pending_save_path = file_name
+            self.sort_pixels()
+            return
+        self.write_image(file_name)
+
+    def write_image(self, file_name, image=None):
+        """Save image, or the full-resolution sort, to file_name."""
+        image = image if image is not None else self.sorted_image
+        try:
+            self.logger.info(f"Saving image to: {file_name}")
+            image.to_pil().save(file_name)
+            self.logger.info("Image saved successfully")
+        except Exception as e:
+            self.logger.error(f"Failed to save image: {str(e)}", exc_info=True)
+            QMessageBox.critical(self, "Error", f"Failed to save image:\n{e}") 
\ No newline at end of file
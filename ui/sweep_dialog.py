@@ -0,0 +1,71 @@
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import (QAbstractItemView, QCheckBox, QDialog, QDialogButtonBox, QFileDialog, QFormLayout,
+                             QHBoxLayout, QLineEdit, QListWidget, QMessageBox, QPushButton, QWidget)
+from pixfuck.sweep import parse_angles
+
+class SweepDialog(QDialog):
+    """Asks for the grid of a parameter sweep and where to write it.
+
+    The criteria list starts with the current criterion selected; parameters()
+    returns the choices in the form pixfuck.sweep.render_sweep takes them.
+    """
+
+    def __init__(self, criteria, current_criterion, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Render Sweep")
+        self.angles_edit = QLineEdit("0:165:15")
+        self.angles_edit.setToolTip("Angles in degrees, or start:stop:step ranges with stop included")
+        self.criteria_list = QListWidget()
+        self.criteria_list.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
+        self.criteria_list.addItems(criteria)
+        for item in self.criteria_list.findItems(current_criterion, Qt.MatchFlag.MatchExactly):
+            item.setSelected(True)
+        self.intensities_edit = QLineEdit("0.5 0.75 1")
+        self.save_variants_check = QCheckBox("Save every variant, not just the contact sheet")
+        self.save_variants_check.setChecked(True)
+        self.output_edit = QLineEdit()
+        browse_button = QPushButton("Browse...")
+        browse_button.clicked.connect(self.browse)
+        output_row = QHBoxLayout()
+        output_row.addWidget(self.output_edit)
+        output_row.addWidget(browse_button)
+        output_widget = QWidget()
+        output_widget.setLayout(output_row)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout = QFormLayout(self)
+        layout.addRow("Angles:", self.angles_edit)
+        layout.addRow("Criteria:", self.criteria_list)
+        layout.addRow("Intensities:", self.intensities_edit)
+        layout.addRow("", self.save_variants_check)
+        layout.addRow("Output folder:", output_widget)
+        layout.addRow(buttons)
+
+    def browse(self):
+        directory = QFileDialog.getExistingDirectory(self, "Sweep Output Folder", self.output_edit.text(),
+                                                     QFileDialog.Option.DontUseNativeDialog)
+        if directory:
+            self.output_edit.setText(directory)
+
+    def parameters(self):
+        """(angles, criteria, intensities, output folder, save variants); raises ValueError if invalid."""
+        angles = parse_angles(self.angles_edit.text().split())
+        criteria = [item.text() for item in self.criteria_list.selectedItems()]
+        intensities = [float(value) for value in self.intensities_edit.text().replace(',', ' ').split()]
+        if not angles or not criteria or not intensities:
+            raise ValueError("Choose at least one angle, criterion and intensity.")
+        if not all(0.0 <= intensity <= 1.0 for intensity in intensities):
+            raise ValueError("Intensities must be between 0 and 1.")
+        if not self.output_edit.text():
+            raise ValueError("Choose an output folder.")
+        return angles, criteria, intensities, self.output_edit.text(), self.save_variants_check.isChecked()
+
+    def accept(self):
+        try:
+            self.parameters()
+        except ValueError as e:
+            QMessageBox.warning(self, "Render Sweep", str(e))
+            return
+        super().accept()
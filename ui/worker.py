@@ -1,110 +1,31 @@
+import os
+import subprocess
+import sys
+import threading
+import time
 import traceback
+from PIL import UnidentifiedImageError
 from PyQt6.QtCore import QThread, pyqtSignal
-from PIL import Image
-import numpy as np
-from numba import njit
-import scipy.ndimage
+from pixfuck.cache import cached_sort
+from pixfuck.core import SortCancelled
+from pixfuck.decode import DecodeCancelled, decode_image, draft_preview, preview_size, reduced, rgb_array
+from pixfuck.masks import alpha_mask, scaled_mask
+from pixfuck.pipeline import run_pipeline
+from pixfuck.profiling import SortTrace, profile_job
+from pixfuck.sweep import render_sweep
+from .image_buffer import ImageBuffer
 from .logger import get_logger
 
 logger = get_logger('PixelSortWorker')
 
-# Numba-compatible RGB to HSV conversion
-@njit
-def rgb_to_hsv_numba(r, g, b):
-    maxc = np.maximum(np.maximum(r, g), b)
-    minc = np.minimum(np.minimum(r, g), b)
-    delta = maxc - minc
-    h = np.zeros_like(maxc, dtype=np.float32)
-    s = np.zeros_like(maxc, dtype=np.float32)
-    v = maxc.astype(np.float32)
-
-    mask = delta != 0
-    s[mask] = delta[mask] / maxc[mask]
-
-    rc = np.zeros_like(maxc, dtype=np.float32)
-    gc = np.zeros_like(maxc, dtype=np.float32)
-    bc = np.zeros_like(maxc, dtype=np.float32)
-    rc[mask] = (maxc[mask] - r[mask]) / delta[mask]
-    gc[mask] = (maxc[mask] - g[mask]) / delta[mask]
-    bc[mask] = (maxc[mask] - b[mask]) / delta[mask]
-
-    cond_r = (r == maxc) & mask
-    cond_g = (g == maxc) & mask
-    cond_b = (b == maxc) & mask
-
-    h[cond_r] = bc[cond_r] - gc[cond_r]
-    h[cond_g] = np.float32(2.0) + rc[cond_g] - bc[cond_g]
-    h[cond_b] = np.float32(4.0) + gc[cond_b] - rc[cond_b]
-
-    h = (h / np.float32(6.0)) % np.float32(1.0)
-    h[~mask] = np.float32(0.0)
-
-    return h, s, v
-
-@njit
-def row_max(arr):
-    n_rows, n_cols = arr.shape
-    result = np.empty(n_rows, dtype=arr.dtype)
-    for i in range(n_rows):
-        max_val = arr[i, 0]
-        for j in range(1, n_cols):
-            if arr[i, j] > max_val:
-                max_val = arr[i, j]
-        result[i] = max_val
-    return result
-
-@njit
-def row_min(arr):
-    n_rows, n_cols = arr.shape
-    result = np.empty(n_rows, dtype=arr.dtype)
-    for i in range(n_rows):
-        min_val = arr[i, 0]
-        for j in range(1, n_cols):
-            if arr[i, j] < min_val:
-                min_val = arr[i, j]
-        result[i] = min_val
-    return result
-
-@njit
-def process_line(line, criterion_id):
-    length = line.shape[0]
-    key = np.empty(length, dtype=np.float32)
-    line = line.astype(np.float32)
-    if criterion_id == 0:
-        for j in range(length):
-            key[j] = (line[j, 0] + line[j, 1] + line[j, 2]) / np.float32(3.0)
-    elif criterion_id == 1:
-        r = line[:, 0] / np.float32(255.0)
-        g = line[:, 1] / np.float32(255.0)
-        b = line[:, 2] / np.float32(255.0)
-        h, s, v = rgb_to_hsv_numba(r, g, b)
-        key = h.astype(np.float32)
-    elif criterion_id == 2:
-        r = line[:, 0] / np.float32(255.0)
-        g = line[:, 1] / np.float32(255.0)
-        b = line[:, 2] / np.float32(255.0)
-        h, s, v = rgb_to_hsv_numba(r, g, b)
-        key = s.astype(np.float32)
-    elif criterion_id == 3:
-        max_vals = row_max(line)
-        min_vals = row_min(line)
-        key = (max_vals + min_vals) / np.float32(2.0)
-    elif criterion_id == 4:
-        key = row_min(line)
-    else:
-        for j in range(length):
-            key[j] = (line[j, 0] + line[j, 1] + line[j, 2]) / np.float32(3.0)
-
-    sorted_indices = np.argsort(key)
-    sorted_line = line[sorted_indices].astype(np.uint8)
-    return sorted_line
-
 class PixelSortWorker(QThread):
     progress = pyqtSignal(int)
-    finished = pyqtSignal(Image.Image)
+    finished = pyqtSignal(object)
     error = pyqtSignal(str)
+    cancelled = pyqtSignal()
 
-    def __init__(self, image, angle, criterion, pattern, intensity):
+    def __init__(self, image, angle, criterion, pattern, intensity, shear_mode='exact', key_bits=None, seed=None,
+                 cache=None, mask=None):
         super().__init__()
         self.logger = get_logger('PixelSortWorker')
         self.image = image
@@ -112,202 +33,245 @@ class PixelSortWorker(QThread):
         self.criterion = criterion
         self.pattern = pattern
         self.intensity = intensity
-        self.logger.info(f"Initialized worker with angle={angle}, criterion={criterion}, pattern={pattern}, intensity={intensity}")
+        self.shear_mode = shear_mode
+        self.key_bits = key_bits
+        self.seed = seed
+        self.cache = cache
+        self.mask = mask
+        self.cancel_event = threading.Event()
+        # Stage timings of this job, read by whoever handles finished
+        self.trace = SortTrace('sort', size=image.size, angle=angle, criterion=criterion, pattern=pattern,
+                               intensity=intensity, shear_mode=shear_mode, key_bits=key_bits, seed=seed,
+                               masked=mask is not None)
+        self.logger.info(f"Initialized worker with angle={angle}, criterion={criterion}, pattern={pattern}, intensity={intensity}, shear_mode={shear_mode}, key_bits={key_bits}, seed={seed}")
 
     def run(self):
         try:
             self.logger.info("Starting pixel sorting operation")
-            sorted_image = self.pixel_sort(self.image, self.angle, self.criterion, self.pattern, self.intensity)
+            with profile_job('sort'):
+                sorted_image = self.pixel_sort(self.image, self.angle, self.criterion, self.pattern, self.intensity, self.shear_mode, self.key_bits, self.seed)
             self.logger.info("Pixel sorting completed successfully")
             self.finished.emit(sorted_image)
+        except SortCancelled:
+            self.logger.info("Pixel sorting cancelled")
+            self.cancelled.emit()
         except Exception as e:
             self.logger.error(f"Error during pixel sorting: {str(e)}", exc_info=True)
             tb = traceback.format_exc()
             self.error.emit(f"{str(e)}\n{tb}")
 
-    def pixel_sort(self, image, angle, criterion, pattern, intensity):
+    def pixel_sort(self, image, angle, criterion, pattern, intensity, shear_mode='exact', key_bits=None, seed=None):
+        """Sort an ImageBuffer with pixfuck.core.sort_image, reporting progress.
+
+        The sort reads the buffer's array in place and its result becomes the
+        new buffer, so no PIL conversion happens on either side. Results come
+        from and go to self.cache when the worker has one, and only the pixels
+        of self.mask are sorted when it has one.
+        """
         self.logger.debug(f"Starting pixel_sort with image size {image.size}")
-        # Convert image to NumPy array
-        img_array = np.array(image)
-        height, width, channels = img_array.shape
-        self.logger.debug(f"Original image shape: {img_array.shape}")
+        image_hash = image.content_hash() if self.cache is not None else None
+        result_array, _ = cached_sort(self.cache, image.array, angle, criterion, pattern, intensity, seed,
+                                      image_hash, progress=self.progress.emit, shear_mode=shear_mode,
+                                      key_bits=key_bits, cancel=self.cancel_event, key_cache=image.key_cache,
+                                      trace=self.trace, mask=self.mask, resort=image.resort)
+
+        self.logger.debug("Pixel sorting completed")
+        return ImageBuffer(result_array, image.mask)
 
-        # Map criterion to integer id
-        criterion_map = {
-            'Brightness': 0,
-            'Hue': 1,
-            'Saturation': 2,
-            'Intensity': 3,
-            'Minimum': 4,
-        }
-        criterion_id = criterion_map.get(criterion, 0)
-        self.logger.debug(f"Using criterion ID: {criterion_id} ({criterion})")
-        self.logger.debug(f"Using pattern: {pattern}")
+    def cancel(self):
+        """Ask the sort to stop at the next chunk; the worker then emits cancelled."""
+        self.cancel_event.set()
 
-        # Convert angle to radians
-        angle_rad = np.radians(angle)
-        
-        # Normalize angle to -180 to 180 degrees
-        angle_rad = angle_rad % (2 * np.pi)
-        if angle_rad > np.pi:
-            angle_rad -= 2 * np.pi
-            
-        # Determine if we should shear horizontally or vertically
-        # For angles between -45 and 45 degrees, shear horizontally
-        # For angles between 45 and 135 degrees, shear vertically
-        if -np.pi/4 <= angle_rad <= np.pi/4:
-            # Shear horizontally
-            shear_factor = np.tan(angle_rad)
-            shear_matrix = np.array([
-                [1, shear_factor, 0],
-                [0, 1, 0],
-                [0, 0, 1]
-            ])
-            inverse_shear_matrix = np.array([
-                [1, -shear_factor, 0],
-                [0, 1, 0],
-                [0, 0, 1]
-            ])
-            # Sort horizontally
-            sort_axis = 1
-        else:
-            # Shear vertically
-            shear_factor = 1.0 / np.tan(angle_rad)
-            shear_matrix = np.array([
-                [1, 0, 0],
-                [shear_factor, 1, 0],
-                [0, 0, 1]
-            ])
-            inverse_shear_matrix = np.array([
-                [1, 0, 0],
-                [-shear_factor, 1, 0],
-                [0, 0, 1]
-            ])
-            # Sort vertically
-            sort_axis = 0
-        
-        # Apply shear transformation
-        self.logger.debug("Applying shear transformation")
-        sheared_array = scipy.ndimage.affine_transform(
-            img_array,
-            shear_matrix,
-            offset=[0, 0, 0],
-            order=1,
-            mode='wrap',
-            cval=0
-        )
+class LoadWorker(QThread):
+    """Decodes an image file off the GUI thread, with real progress and cancellation.
 
-        # Sort pixels
-        self.logger.debug("Sorting pixels")
-        sorted_array = sheared_array.copy()
-        
-        # Process each line along the appropriate axis
-        if sort_axis == 1:  # Sort horizontally
-            for i in range(sheared_array.shape[0]):
-                line = sorted_array[i, :, :].copy()
-                sorted_line = process_line(line, criterion_id)
-                if intensity < 1.0:
-                    mask = np.random.rand(line.shape[0]) < intensity
-                    blended_line = line.copy()
-                    blended_line[mask] = sorted_line[mask]
-                    sorted_array[i, :, :] = blended_line
-                else:
-                    sorted_array[i, :, :] = sorted_line
-                progress_percent = int(((i + 1) / sheared_array.shape[0]) * 100)
-                self.progress.emit(progress_percent)
-        else:  # Sort vertically
-            for i in range(sheared_array.shape[1]):
-                line = sorted_array[:, i, :].copy()
-                sorted_line = process_line(line, criterion_id)
-                if intensity < 1.0:
-                    mask = np.random.rand(line.shape[0]) < intensity
-                    blended_line = line.copy()
-                    blended_line[mask] = sorted_line[mask]
-                    sorted_array[:, i, :] = blended_line
-                else:
-                    sorted_array[:, i, :] = sorted_line
-                progress_percent = int(((i + 1) / sheared_array.shape[1]) * 100)
-                self.progress.emit(progress_percent)
+    For JPEGs, draft emits a reduced decode as soon as it is ready, well before
+    the full image. finished carries the full-size ImageBuffer, its preview
+    proxy (both with the alpha channel, if any, as their mask) and the load's
+    SortTrace. check_size is called with (width, height) from the header and
+    may raise ValueError to refuse the image before it is decoded.
+    """
+    progress = pyqtSignal(int)
+    draft = pyqtSignal(object)
+    finished = pyqtSignal(object, object, object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
 
-        # Apply inverse shear transformation
-        self.logger.debug("Applying inverse shear transformation")
-        result_array = scipy.ndimage.affine_transform(
-            sorted_array,
-            inverse_shear_matrix,
-            offset=[0, 0, 0],
-            order=1,
-            mode='wrap',
-            cval=0
-        )
+    def __init__(self, path, preview_max_size, check_size=None):
+        super().__init__()
+        self.logger = get_logger('LoadWorker')
+        self.path = path
+        self.preview_max_size = preview_max_size
+        self.check_size = check_size
+        self.cancel_event = threading.Event()
+        self.trace = SortTrace('load', path=path)
 
-        # Ensure the result has the same shape as the input
-        if result_array.shape != img_array.shape:
-            result_array = self.maintain_aspect_ratio(result_array, img_array.shape)
+    def check_header(self, image):
+        if self.check_size is not None:
+            self.check_size(*image.size)
 
-        # Convert back to PIL Image
-        sorted_image = Image.fromarray(result_array.astype(np.uint8))
-        self.logger.debug("Pixel sorting completed")
-        return sorted_image
+    def run(self):
+        try:
+            with self.trace.stage('draft'):
+                draft = draft_preview(self.path, self.preview_max_size, self.check_header)
+            if draft is not None:
+                self.draft.emit(ImageBuffer.from_pil(draft))
+            with self.trace.stage('decode'):
+                image = decode_image(self.path, self.progress.emit, self.cancel_event, self.check_header)
+                mask = alpha_mask(image)
+                original = ImageBuffer(rgb_array(image, self.progress.emit, self.cancel_event))
+            with self.trace.stage('preview proxy'):
+                size = preview_size(original.size, self.preview_max_size)
+                # The draft is already a reduced decode; rescaling it is cheaper than the full image
+                preview = ImageBuffer.from_pil(reduced(draft if draft is not None else image, size))
+                original.mask = mask
+                if mask is not None:
+                    preview.mask = scaled_mask(mask, size)
+            self.finished.emit(original, preview, self.trace)
+        except DecodeCancelled:
+            self.logger.info(f"Loading {self.path} cancelled")
+            self.cancelled.emit()
+        except UnidentifiedImageError:
+            self.logger.error(f"Invalid image format: {self.path}")
+            self.error.emit("The selected file is not a valid image format.")
+        except MemoryError:
+            self.logger.error("Not enough memory to load the image")
+            self.error.emit("Not enough memory to load the image. Please try a smaller image.")
+        except ValueError as e:
+            # Refused by check_size
+            self.error.emit(str(e))
+        except Exception as e:
+            self.logger.error(f"Failed to load image: {str(e)}", exc_info=True)
+            self.error.emit(f"Failed to load image:\n{str(e)}")
+
+    def cancel(self):
+        """Stop decoding at the next chunk; the worker then emits cancelled."""
+        self.cancel_event.set()
 
-    def get_line_points(self, x1, y1, x2, y2):
-        """Get all points along a line using Bresenham's line algorithm."""
-        points = []
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        x, y = x1, y1
-        n = 1 + dx + dy
-        x_inc = 1 if x2 > x1 else -1
-        y_inc = 1 if y2 > y1 else -1
-        error = dx - dy
-        dx *= 2
-        dy *= 2
+class SweepWorker(QThread):
+    """Renders a parameter sweep of an ImageBuffer with pixfuck.sweep.render_sweep.
 
-        for _ in range(n):
-            points.append((x, y))
-            if error > 0:
-                x += x_inc
-                error -= dy
-            else:
-                y += y_inc
-                error += dx
+    finished carries the contact sheet as an ImageBuffer, the path it was
+    saved to and the sweep's SortTrace.
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object, str, object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
 
-        return points
+    def __init__(self, image, stem, output_dir, angles, criteria, intensities, pattern, seed=0,
+                 save_variants=True):
+        super().__init__()
+        self.logger = get_logger('SweepWorker')
+        self.image = image
+        self.stem = stem
+        self.output_dir = output_dir
+        self.angles = angles
+        self.criteria = criteria
+        self.intensities = intensities
+        self.pattern = pattern
+        self.seed = seed
+        self.save_variants = save_variants
+        self.cancel_event = threading.Event()
+        self.trace = SortTrace('sweep', size=image.size, angles=angles, criteria=criteria,
+                               intensities=intensities, pattern=pattern, seed=seed)
+
+    def run(self):
+        try:
+            n_variants = len(self.angles) * len(self.criteria) * len(self.intensities)
+            self.logger.info(f"Rendering {n_variants} variant(s) to {self.output_dir}")
+            with profile_job('sweep'):
+                sheet_path, sheet = render_sweep(
+                    self.image.array, self.output_dir, self.stem, self.angles, self.criteria, self.intensities,
+                    self.pattern, self.seed, save_variants=self.save_variants, progress=self.progress.emit,
+                    cancel=self.cancel_event, trace=self.trace)
+            self.finished.emit(ImageBuffer(sheet), sheet_path, self.trace)
+        except SortCancelled:
+            self.logger.info("Sweep cancelled")
+            self.cancelled.emit()
+        except Exception as e:
+            self.logger.error(f"Error during sweep: {str(e)}", exc_info=True)
+            self.error.emit(f"{str(e)}\n{traceback.format_exc()}")
+
+    def cancel(self):
+        """Stop at the next chunk of the current sort; the worker then emits cancelled."""
+        self.cancel_event.set()
+
+class PipelineWorker(QThread):
+    """Runs a chain of sort passes on an ImageBuffer with pixfuck.pipeline.run_pipeline.
+
+    finished carries the result as an ImageBuffer and the pipeline's
+    SortTrace, which has one stage per pass.
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object, object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, image, passes, mask=None, path=None):
+        super().__init__()
+        self.logger = get_logger('PipelineWorker')
+        self.image = image
+        self.passes = passes
+        self.mask = mask
+        self.cancel_event = threading.Event()
+        self.trace = SortTrace('pipeline', size=image.size, path=path, passes=passes, masked=mask is not None)
+
+    def run(self):
+        try:
+            self.logger.info(f"Running a pipeline of {len(self.passes)} pass(es)")
+            with profile_job('pipeline'):
+                result, _ = run_pipeline(self.image.array, self.passes, self.mask, self.progress.emit,
+                                         self.cancel_event, self.trace)
+            self.finished.emit(ImageBuffer(result, self.image.mask), self.trace)
+        except SortCancelled:
+            self.logger.info("Pipeline cancelled")
+            self.cancelled.emit()
+        except Exception as e:
+            self.logger.error(f"Error during pipeline: {str(e)}", exc_info=True)
+            self.error.emit(f"{str(e)}\n{traceback.format_exc()}")
+
+    def cancel(self):
+        """Stop at the next chunk of the current pass; the worker then emits cancelled."""
+        self.cancel_event.set()
+
+class WarmUpWorker(QThread):
+    """Fills the numba cache in a child process so the first sort loads its kernels instead of compiling them.
+
+    Running pixfuck.warmup in this process would start numba's parallel
+    threads from a background thread, which then keep the application from
+    exiting; the child compiles, writes the cache and exits on its own.
+    """
+    finished = pyqtSignal(float)
+
+    def __init__(self):
+        super().__init__()
+        self.process = None
+        self.stopped = False
+
+    def run(self):
+        if self.stopped:
+            return
+        started = time.perf_counter()
+        # The package root, so the child finds pixfuck wherever the GUI was started from
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        try:
+            self.process = subprocess.Popen([sys.executable, '-m', 'pixfuck.warmup'], cwd=root,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if self.stopped:
+                self.process.kill()
+            _, stderr = self.process.communicate()
+            if self.process.returncode != 0:
+                # A failed warm-up only means the first sort compiles instead
+                if not self.stopped:
+                    logger.warning(f"JIT warm-up failed:\n{stderr.decode(errors='replace')}")
+                return
+            self.finished.emit(time.perf_counter() - started)
+        except OSError as e:
+            logger.warning(f"JIT warm-up could not start: {str(e)}")
 
-    def maintain_aspect_ratio(self, img_array, target_shape):
-        """Maintain aspect ratio while resizing the image to match target shape."""
-        self.logger.debug(f"Maintaining aspect ratio: current shape {img_array.shape} -> target shape {target_shape}")
-        
-        current_height, current_width = img_array.shape[:2]
-        target_height, target_width = target_shape[:2]
-        
-        # Calculate scaling factors
-        scale_h = target_height / current_height
-        scale_w = target_width / current_width
-        
-        # Use the smaller scaling factor to maintain aspect ratio
-        scale = min(scale_h, scale_w)
-        
-        # Calculate new dimensions
-        new_height = int(current_height * scale)
-        new_width = int(current_width * scale)
-        
-        # Resize the image
-        resized = scipy.ndimage.zoom(
-            img_array,
-            (scale, scale, 1) if len(img_array.shape) == 3 else (scale, scale),
-            order=1,
-            mode='constant',
-            cval=0
-        )
-        
-        # Create a new array with target shape
-        result = np.zeros(target_shape, dtype=img_array.dtype)
-        
-        # Calculate padding
-        pad_h = (target_height - new_height) // 2
-        pad_w = (target_width - new_width) // 2
-        
-        # Copy the resized image into the center of the result
-        result[pad_h:pad_h + new_height, pad_w:pad_w + new_width] = resized
-        
-        return result 
\ No newline at end of file
+    def stop(self):
+        """Kill the warm-up process, if it is still running; the thread then returns."""
+        self.stopped = True
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()